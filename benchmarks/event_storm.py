@@ -0,0 +1,241 @@
+"""
+Event-storm benchmark: replays a synthetic or recorded stream of filesystem events through the
+daemon's event handling, against a local stub Plex server, and reports its throughput,
+event-to-dispatch latency, peak queue depth and memory.
+
+    python benchmarks/event_storm.py --events 50000 --depth 2 --fanout 20
+    python benchmarks/event_storm.py --replay events.jsonl --realtime
+    python benchmarks/event_storm.py -- --quiet-period 1 --merge-siblings 0
+
+Arguments after '--' are passed to the daemon, on top of the benchmark defaults.
+Traces are recorded by the daemon with --record-events.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from bisect import bisect_left
+from pathlib import Path, PurePosixPath
+from threading import Thread
+from typing import Optional
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src" / "plex_nfs_watchdog"))
+
+import plex_nfs_watchdog  # noqa: E402
+from modules.config import shared  # noqa: E402
+from modules.metrics import metrics  # noqa: E402
+from modules.plex.plex_agent_group import plex_agents  # noqa: E402
+from modules.watchdog.plex_watchdog_event import build_event_handler  # noqa: E402
+from synthetic_tree import MediaTree, build_tree, load_trace, synthetic_events  # noqa: E402
+from stub_plex import StubPlexServer  # noqa: E402
+
+
+def get_args() -> tuple[argparse.Namespace, list[str]]:
+    argv = sys.argv[1:]
+    daemon_argv = []
+    if "--" in argv:
+        daemon_argv = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    parser = argparse.ArgumentParser(description="Replays an event storm through the watchdog and measures it")
+    parser.add_argument("--sections", type=int, default=2, help="Synthetic library sections")
+    parser.add_argument("--locations", type=int, default=2, help="Library folders per section")
+    parser.add_argument("--depth", type=int, default=2, help="Folder levels below each library folder")
+    parser.add_argument("--fanout", type=int, default=10, help="Sub-folders per folder")
+    parser.add_argument("--files", type=int, default=3, help="Media files per leaf folder")
+    parser.add_argument("--events", type=int, default=20000, help="Synthetic events to replay")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic events")
+    parser.add_argument("--replay", type=Path, default=None, help="Replays a trace recorded with --record-events")
+    parser.add_argument("--realtime", action="store_true", help="Keeps the recorded delays between replayed events")
+    parser.add_argument("--direct", action="store_true",
+                        help="Feeds the events straight to parse_event, bypassing the event pipeline")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="Seconds without new scan requests after which the run is over")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also reports the peak of traced allocations")
+    parser.add_argument("--log-level", default="WARNING", help="Log level of the watchdog during the run")
+    parser.add_argument("--json", action="store_true", help="Prints the report as JSON")
+    return parser.parse_args(argv), daemon_argv
+
+
+def percentile(values: list[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    return sorted(values)[min(len(values) - 1, int(share * len(values)))]
+
+
+class DispatchIndex:
+    """
+    Scan requests received by the stub, by (section title, subpath parts) they cover.
+    """
+
+    def __init__(self, stub: StubPlexServer):
+        locations = {title: [PurePosixPath(path) for path in paths] for title, paths in stub.sections.values()}
+        self.__times: dict[tuple[str, tuple[str, ...]], list[float]] = {}
+        for received, title, path in stub.refreshes:
+            parts = ()
+            if path is not None:
+                for location in locations[title]:
+                    remote_path = PurePosixPath(path)
+                    if remote_path == location or location in remote_path.parents:
+                        parts = remote_path.relative_to(location).parts
+                        break
+            self.__times.setdefault((title, parts), []).append(received)
+        for times in self.__times.values():
+            times.sort()
+
+    def dispatched_at(self, section_title: str, parts: tuple[str, ...], submitted: float) -> Optional[float]:
+        """
+        :return: When the first scan covering the folder was sent after submitted, if any.
+        """
+        dispatched = None
+        for depth in range(len(parts) + 1):
+            times = self.__times.get((section_title, parts[:depth]))
+            if times:
+                idx = bisect_left(times, submitted)
+                if idx < len(times) and (dispatched is None or times[idx] < dispatched):
+                    dispatched = times[idx]
+        return dispatched
+
+
+def event_latencies(events: list, submitted: list[float], stub: StubPlexServer) -> list[float]:
+    """
+    :return: The event-to-dispatch latency of every event whose folder was scanned.
+    """
+    index = DispatchIndex(stub)
+    agent = plex_agents.agents[0]
+    resolved: dict[str, list] = {}
+    latencies = []
+    for event, submit_time in zip(events, submitted):
+        # The destination of a move, its source is scanned as a deletion
+        event_path = Path(plex_agents.get_event_paths(event)[0][1])
+        folder = str(event_path if event.is_directory else event_path.parent)
+        if folder not in resolved:
+            resolved[folder] = agent.find_sections_and_subpaths(Path(folder))
+        dispatched = [
+            index.dispatched_at(section_title, subpath.parts, submit_time)
+            for section_title, subpath in resolved[folder]
+        ]
+        dispatched = [dispatch_time for dispatch_time in dispatched if dispatch_time is not None]
+        if dispatched:
+            latencies.append(min(dispatched) - submit_time)
+    return latencies
+
+
+def replay(events: list, delays: Optional[list[float]], direct: bool) -> tuple[list[float], float]:
+    """
+    Submits the events like the observer would, then waits for the pipeline to drain.
+    :return: The submit time of every event, and the total ingest time.
+    """
+    event_pipeline, event_handler = build_event_handler(plex_agents.queue_paths_threadsafe)
+    if not direct:
+        event_pipeline.start()
+    submitted = []
+    start = time.monotonic()
+    for idx, event in enumerate(events):
+        if delays is not None:
+            time.sleep(max(0.0, start + delays[idx] - time.monotonic()))
+        submitted.append(time.monotonic())
+        if direct:
+            plex_agents.parse_event(event)
+        else:
+            event_handler.dispatch(event)
+    if not direct:
+        event_pipeline.stop()
+    return submitted, time.monotonic() - start
+
+
+def wait_settled(stub: StubPlexServer, host: str, settle: float) -> None:
+    last_count, last_change = -1, time.monotonic()
+    while True:
+        time.sleep(0.1)
+        busy = metrics.queue_depth.get(host) or metrics.parked_scans.get(host)
+        if len(stub.refreshes) != last_count or busy:
+            last_count, last_change = len(stub.refreshes), time.monotonic()
+        elif time.monotonic() - last_change >= settle:
+            return
+
+
+def run(args: argparse.Namespace, daemon_argv: list[str], workdir: Path) -> dict:
+    shared.cache_path = workdir / "plex_config.json"
+    shared.journal_path = workdir / "scan_journal.jsonl"
+    shared.sections_cache_path = workdir / "sections_cache.json"
+
+    delays = None
+    if args.replay is not None:
+        tree, timed_events = load_trace(args.replay, workdir / "media")
+        events = [event for _, event in timed_events]
+        if args.realtime:
+            delays = [offset - timed_events[0][0] for offset, _ in timed_events]
+    else:
+        tree: MediaTree = build_tree(
+            workdir / "media", args.sections, args.locations, args.depth, args.fanout, args.files
+        )
+        events = synthetic_events(tree, args.events, args.seed)
+
+    stub = StubPlexServer(tree.sections)
+    stub.start()
+    try:
+        tree.root.mkdir(parents=True, exist_ok=True)
+        plex_nfs_watchdog.get_args_from_cli([
+            "--daemon", "--host", stub.url, "--token", "benchmark", "--paths", str(tree.root),
+            "--interval", "1", "--quiet-period", "0.5", "--max-rps", "0", "--library-refresh", "0",
+            "--listeners", *shared.listeners_type, *daemon_argv
+        ])
+        logging.getLogger().setLevel(args.log_level)
+        # The tree is created right before the run, within the timestamp granularity of some filesystems
+        plex_agents.set_script_start_time(0)
+        plex_agents.set_stat_cache_ttl(shared.user_input.stat_cache_ttl)
+        plex_agents.connect()
+        # The service event loop runs on its own thread, the events are replayed from this one
+        loop = asyncio.new_event_loop()
+        loop_thread = Thread(target=loop.run_forever, name="service-loop", daemon=True)
+        loop_thread.start()
+        asyncio.run_coroutine_threadsafe(plex_agents.start_service(), loop).result()
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        submitted, ingest_time = replay(events, delays, args.direct)
+        wait_settled(stub, stub.url, args.settle)
+        asyncio.run_coroutine_threadsafe(plex_agents.stop_service(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        tracemalloc.stop()
+    finally:
+        stub.stop()
+
+    latencies = event_latencies(events, submitted, stub)
+    p50, p99 = percentile(latencies, 0.50), percentile(latencies, 0.99)
+    return {
+        "events": len(events),
+        "ingest_seconds": round(ingest_time, 3),
+        "events_per_second": round(len(events) / ingest_time) if ingest_time else None,
+        "dispatched_events": len(latencies),
+        "latency_p50_seconds": round(p50, 3) if p50 is not None else None,
+        "latency_p99_seconds": round(p99, 3) if p99 is not None else None,
+        "scan_requests": len(stub.refreshes),
+        "full_section_scans": sum(1 for _, _, path in stub.refreshes if path is None),
+        "peak_queue_depth": int(metrics.queue_max_depth.get(stub.url)),
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "traced_peak_kib": traced_peak // 1024 if traced_peak is not None else None,
+    }
+
+
+def main() -> None:
+    args, daemon_argv = get_args()
+    with tempfile.TemporaryDirectory(prefix="plex_nfs_watchdog_bench_") as workdir:
+        report = run(args, daemon_argv, Path(workdir))
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for name, value in report.items():
+            print(f"{name:<22}{value if value is not None else '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Memory benchmark of the pending scans during a long import storm: queues a storm of events on distinct
+folders, none of them due, and samples the memory traced by tracemalloc along the way, for
+
+  - queue: the scan queue of a Plex server, between two batches;
+  - parked: the parked scans of a section, while Plex is unreachable.
+
+With --max-queued-scans the memory must level off once the cap is reached: the benchmark fails if the
+peak traced memory exceeds --kib-per-scan for every scan of the cap, however long the storm.
+With 0, it grows with every folder.
+
+    python benchmarks/queue_memory.py --events 1000000
+    python benchmarks/queue_memory.py --target parked --max-queued-scans 0
+"""
+import argparse
+import gc
+import json
+import random
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src" / "plex_nfs_watchdog"))
+
+from modules.plex.retry_state import FAILING, SectionTracker  # noqa: E402
+from modules.plex.scan_queue import ScanQueue  # noqa: E402
+
+
+def get_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measures the memory of the pending scans under an event storm")
+    parser.add_argument("--events", type=int, default=1000000, help="Events of the storm")
+    parser.add_argument("--sections", type=int, default=4, help="Synthetic library sections")
+    parser.add_argument("--depth", type=int, default=3, help="Folder levels below each section")
+    parser.add_argument("--fanout", type=int, default=100, help="Sub-folders per folder")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the synthetic events")
+    parser.add_argument("--target", choices=["queue", "parked"], default="queue", help="Where the scans pile up")
+    parser.add_argument("--max-queued-scans", type=int, default=50000, help="Cap of the pending scans, 0 for none")
+    parser.add_argument("--samples", type=int, default=10, help="Memory samples taken during the storm")
+    parser.add_argument("--kib-per-scan", type=float, default=2.0,
+                        help="Peak memory allowed for every scan of the cap, in KiB")
+    parser.add_argument("--json", action="store_true", help="Prints the report as JSON")
+    return parser.parse_args()
+
+
+def traced_kib() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] // 1024
+
+
+def run(args: argparse.Namespace) -> dict:
+    rng = random.Random(args.seed)
+    queue = ScanQueue(3600.0, 3600.0, args.max_queued_scans)
+    tracker = SectionTracker(3600.0, 3600.0, args.max_queued_scans)
+    section_titles = [f"Section {idx}" for idx in range(args.sections)]
+
+    def pending() -> int:
+        return len(queue) if args.target == "queue" else tracker.parked_count()
+
+    def collapsed() -> int:
+        return queue.collapsed if args.target == "queue" else tracker.collapsed
+
+    samples = []
+    every = max(1, args.events // args.samples)
+    tracemalloc.start()
+    baseline = traced_kib()
+    for idx in range(1, args.events + 1):
+        section_title = rng.choice(section_titles)
+        # A fresh Path per event, as handed over by the event pipeline
+        subpath = Path(*(f"d{level}_{rng.randrange(args.fanout)}" for level in range(args.depth)))
+        if args.target == "queue":
+            queue.put(section_title, subpath)
+        else:
+            tracker.park(section_title, [(section_title, subpath, 0.0)], FAILING, retry_at=float("inf"))
+        if idx % every == 0:
+            samples.append({"events": idx, "pending": pending(), "collapsed": collapsed(),
+                            "traced_kib": traced_kib() - baseline})
+    peak = tracemalloc.get_traced_memory()[1] // 1024 - baseline
+    tracemalloc.stop()
+
+    # The stale entries of the due-time heap are dropped in bulk, so the samples go up and down once capped:
+    # the peak is checked against an absolute budget instead of the trend of the samples
+    budget_kib = args.kib_per_scan * args.max_queued_scans
+    return {
+        "target": args.target,
+        "events": args.events,
+        "max_queued_scans": args.max_queued_scans,
+        "samples": samples,
+        "traced_peak_kib": peak,
+        "bytes_per_scan": samples[-1]["traced_kib"] * 1024 // max(1, samples[-1]["pending"]),
+        "budget_kib": budget_kib,
+        "bounded": peak <= budget_kib,
+    }
+
+
+def main() -> None:
+    args = get_args()
+    report = run(args)
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"{'events':>10}{'pending':>10}{'collapsed':>12}{'traced_kib':>12}")
+        for sample in report["samples"]:
+            print(f"{sample['events']:>10}{sample['pending']:>10}{sample['collapsed']:>12}{sample['traced_kib']:>12}")
+        for name in ("traced_peak_kib", "bytes_per_scan", "budget_kib", "bounded"):
+            print(f"{name:<22}{report[name]}")
+    if args.max_queued_scans and not report["bounded"]:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Startup benchmark of a manual --scan, as run by post-processing hooks: times complete
+invocations in fresh interpreters against a local stub Plex server, for
+
+  - plexapi: the former --scan path, connecting with plexapi and fetching the sections;
+  - quick (cold): the --scan path without a sections cache, fetched with one request;
+  - quick (warm): the --scan path with a fresh sections cache.
+
+    python benchmarks/scan_startup.py --runs 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from stub_plex import StubPlexServer
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent / "src" / "plex_nfs_watchdog"
+
+PLEXAPI_SCAN = f"""
+import sys
+sys.path.insert(0, {str(SOURCE_DIR)!r})
+import plex_nfs_watchdog
+from modules.config import shared
+from modules.plex.plex_agent_group import plex_agents
+if shared.cache_path.exists():
+    plex_agents.load_config_cache()
+plex_nfs_watchdog.get_args_from_cli()
+plex_agents.connect()
+plex_agents.manual_scan(shared.user_input.paths)
+"""
+
+
+def time_runs(command: list[str], runs: int, env: dict, stub: StubPlexServer, before_run=None) -> dict:
+    durations = []
+    requests = stub.requests
+    for _ in range(runs):
+        if before_run is not None:
+            before_run()
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+    return {
+        "median_ms": round(statistics.median(durations) * 1000, 1),
+        "min_ms": round(min(durations) * 1000, 1),
+        "requests_per_run": round((stub.requests - requests) / runs, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Times manual --scan invocations")
+    parser.add_argument("--runs", type=int, default=10, help="Invocations timed per mode")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="plex_nfs_watchdog_bench_") as workdir:
+        media_folder = Path(workdir) / "media" / "Movies" / "Some Movie (2024)"
+        media_folder.mkdir(parents=True)
+        stub = StubPlexServer({"Movies": ["/data/Movies"], "TV Shows": ["/data/TV Shows"]})
+        stub.start()
+        # Keeps the config and sections caches in the temporary folder
+        env = dict(os.environ, HOME=workdir)
+        scan_args = ["--scan", "--paths", str(media_folder), "--host", stub.url, "--token", "benchmark"]
+        try:
+            # Writes the config cache, so that no run includes it
+            subprocess.run([sys.executable, str(SOURCE_DIR / "plex_nfs_watchdog.py"), *scan_args],
+                           env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            sections_cache = next(Path(workdir).glob("**/sections_cache.json"))
+
+            report = {
+                "plexapi": time_runs(
+                    [sys.executable, "-c", PLEXAPI_SCAN, *scan_args], args.runs, env, stub
+                ),
+                "quick (cold)": time_runs(
+                    [sys.executable, str(SOURCE_DIR / "plex_nfs_watchdog.py"), *scan_args], args.runs, env, stub,
+                    before_run=lambda: sections_cache.unlink(missing_ok=True)
+                ),
+                "quick (warm)": time_runs(
+                    [sys.executable, str(SOURCE_DIR / "plex_nfs_watchdog.py"), *scan_args], args.runs, env, stub
+                ),
+            }
+        finally:
+            stub.stop()
+
+    print(f"{'mode':<14}{'median ms':>12}{'min ms':>10}{'requests':>10}")
+    for mode, result in report.items():
+        print(f"{mode:<14}{result['median_ms']:>12}{result['min_ms']:>10}{result['requests_per_run']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Minimal local stand-in for a Plex Media Server, answering the few endpoints the watchdog uses
+and recording every partial-scan request it receives.
+"""
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import quoteattr
+
+
+class StubPlexServer:
+    """
+    Serves library sections, given as {title: [remote_path, ...]}, on 127.0.0.1.
+    Every refresh request is recorded as (monotonic receive time, section title, path or None for a full scan).
+    """
+
+    def __init__(self, sections: dict[str, list[str]], port: int = 0):
+        self.sections = {str(key): (title, paths) for key, (title, paths) in enumerate(sections.items(), 1)}
+        self.refreshes: list[tuple[float, str, str]] = []
+        self.requests = 0
+        self.__lock = Lock()
+        self.__server = ThreadingHTTPServer(("127.0.0.1", port), self.__handler_class())
+        self.__server.daemon_threads = True
+        self.__thread = Thread(target=self.__server.serve_forever, name="stub-plex", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.__server.server_address[1]}"
+
+    def start(self) -> None:
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def __sections_xml(self) -> str:
+        directories = "".join(
+            f'<Directory key="{key}" title={quoteattr(title)} type="movie" refreshing="0" updatedAt="1">'
+            + "".join(f'<Location id="{idx}" path={quoteattr(path)}/>' for idx, path in enumerate(paths))
+            + "</Directory>"
+            for key, (title, paths) in self.sections.items()
+        )
+        return f'<MediaContainer size="{len(self.sections)}">{directories}</MediaContainer>'
+
+    def respond(self, url: str) -> str:
+        """
+        :return: The XML body answering a GET request.
+        :raise KeyError: The request is about an unknown section.
+        """
+        parsed = urlparse(url)
+        parts = parsed.path.strip("/").split("/")
+        with self.__lock:
+            self.requests += 1
+        if parsed.path == "/":
+            return '<MediaContainer size="0" version="1.40.0" machineIdentifier="stub" friendlyName="stub"/>'
+        if parsed.path == "/library/sections":
+            return self.__sections_xml()
+        if len(parts) == 4 and parts[:2] == ["library", "sections"] and parts[3] == "refresh":
+            path = parse_qs(parsed.query).get("path", [None])[0]
+            with self.__lock:
+                self.refreshes.append((time.monotonic(), self.sections[parts[2]][0], path))
+            return '<MediaContainer size="0"/>'
+        if len(parts) == 4 and parts[:2] == ["library", "sections"] and parts[3] == "all":
+            # Item counts, used to plan section escalations
+            return '<MediaContainer size="0" totalSize="1000000"/>'
+        return '<MediaContainer size="0"/>'
+
+    def __handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                try:
+                    body = stub.respond(self.path).encode()
+                except KeyError:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
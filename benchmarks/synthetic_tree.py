@@ -0,0 +1,122 @@
+"""
+Synthetic media trees and event streams for the benchmarks, and loading of recorded event traces.
+"""
+import json
+import random
+from pathlib import Path, PurePath
+
+from watchdog.events import (DirCreatedEvent, DirModifiedEvent, FileClosedEvent, FileCreatedEvent,
+                             FileDeletedEvent, FileModifiedEvent, FileMovedEvent, FileSystemEvent,
+                             DirDeletedEvent, DirMovedEvent, FileOpenedEvent)
+
+# (event_type, is_directory) => watchdog event class
+_EVENT_CLASSES = {
+    ("created", False): FileCreatedEvent, ("created", True): DirCreatedEvent,
+    ("modified", False): FileModifiedEvent, ("modified", True): DirModifiedEvent,
+    ("deleted", False): FileDeletedEvent, ("deleted", True): DirDeletedEvent,
+    ("moved", False): FileMovedEvent, ("moved", True): DirMovedEvent,
+    ("closed", False): FileClosedEvent, ("opened", False): FileOpenedEvent,
+}
+
+
+class MediaTree:
+    """
+    Library folders and media files laid out under a root folder, with the Plex sections serving them.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        # Section title => remote paths of its library folders, as served by the stub Plex server
+        self.sections: dict[str, list[str]] = {}
+        self.library_folders: list[Path] = []
+        self.files: list[Path] = []
+
+
+def build_tree(root: Path, sections: int, locations: int, depth: int, fanout: int, files: int) -> MediaTree:
+    """
+    Creates sections * locations library folders, each holding fanout ** depth leaf folders
+    with files media files each.
+    """
+    tree = MediaTree(root)
+    for section_idx in range(sections):
+        title = f"Section {section_idx}"
+        tree.sections[title] = []
+        for location_idx in range(locations):
+            folder_name = f"S{section_idx}L{location_idx}"
+            tree.sections[title].append(f"/remote/{title}/{folder_name}")
+            library_folder = root / folder_name
+            tree.library_folders.append(library_folder)
+            leaves = [library_folder]
+            for level in range(depth):
+                leaves = [leaf / f"d{level}_{idx}" for leaf in leaves for idx in range(fanout)]
+            for leaf in leaves:
+                leaf.mkdir(parents=True, exist_ok=True)
+                for file_idx in range(files):
+                    media_file = leaf / f"episode{file_idx}.mkv"
+                    media_file.write_bytes(b"x")
+                    tree.files.append(media_file)
+    return tree
+
+
+def synthetic_events(tree: MediaTree, count: int, seed: int) -> list[FileSystemEvent]:
+    """
+    A storm of events on random media files, like copies and renames in progress: mostly
+    modifications, plus creations, closings, folder modifications and events the filter drops.
+    """
+    rng = random.Random(seed)
+    events = []
+    for _ in range(count):
+        media_file = rng.choice(tree.files)
+        roll = rng.random()
+        if roll < 0.55:
+            events.append(FileModifiedEvent(str(media_file)))
+        elif roll < 0.70:
+            events.append(FileCreatedEvent(str(media_file)))
+        elif roll < 0.80:
+            events.append(FileClosedEvent(str(media_file)))
+        elif roll < 0.88:
+            events.append(DirModifiedEvent(str(media_file.parent)))
+        elif roll < 0.92:
+            events.append(FileMovedEvent(str(media_file.with_suffix(".part")), str(media_file)))
+        elif roll < 0.96:
+            events.append(FileCreatedEvent(str(media_file.with_suffix(".part"))))
+        else:
+            events.append(FileCreatedEvent(str(media_file.parent / "@eaDir" / "thumb.jpg")))
+    return events
+
+
+def load_trace(trace_path: Path, root: Path) -> tuple[MediaTree, list[tuple[float, FileSystemEvent]]]:
+    """
+    Loads a trace recorded with --record-events, rebasing its paths under root, where the folders
+    and files the events point to are created so that they can be checked like on the original host.
+    :return: The tree, and the events with their recorded time offsets.
+    """
+    tree = MediaTree(root)
+
+    def rebase(path: str) -> str:
+        return str(root.joinpath(*PurePath(path).parts[1:])) if path else path
+
+    events = []
+    with open(trace_path, "r") as trace_file:
+        header = json.loads(trace_file.readline())
+        for remote_path in header["libraries"]:
+            tree.sections.setdefault(PurePath(remote_path).name, []).append(remote_path)
+        for line in trace_file:
+            record = json.loads(line)
+            event_class = _EVENT_CLASSES.get((record["type"], record["dir"]))
+            if event_class is None:
+                continue
+            src_path, dest_path = rebase(record["src"]), rebase(record["dest"])
+            event = event_class(src_path, dest_path) if record["type"] == "moved" else event_class(src_path)
+            events.append((record["t"], event))
+
+            if record["type"] == "deleted":
+                continue
+            existing = Path(dest_path if record["type"] == "moved" else src_path)
+            if record["dir"]:
+                existing.mkdir(parents=True, exist_ok=True)
+            else:
+                existing.parent.mkdir(parents=True, exist_ok=True)
+                existing.touch()
+                tree.files.append(existing)
+    return tree, events
@@ -8,7 +8,19 @@ system_paths: dict[str, str] = {
     'darwin': f"Library/Application Support",
 }
 cache_path: Path = Path(f"{str(Path.home())}/{system_paths[sys.platform]}/plex_nfs_watchdog_cache/plex_config.json")
+journal_path: Path = cache_path.with_name("scan_journal.jsonl")
+sections_cache_path: Path = cache_path.with_name("sections_cache.json")
+control_socket_path: Path = cache_path.with_name("daemon.sock")
+dir_snapshot_path: Path = cache_path.with_name("dir_snapshot.json")
 
 listeners_type: list[str] = ["move", "modify", "create", "delete", "io_close", "io_open"]
+supported_ext: list[str] = [
+    "3g2", "3gp", "amv", "asf", "ass", "avi", "drc", "f4a", "f4b", "f4p", "f4v", "flac", "flv",
+    "gif", "gifv", "idx", "m2ts", "m2v", "m4p", "m4v", "m4v", "mkv", "mng", "mov", "mp2", "mp3",
+    "mp4", "mpe", "mpeg", "mpg", "mpv", "mxf", "nsv", "ogg", "ogv", "qt", "rm", "rmvb", "roq",
+    "smi", "srt", "ssa", "sub", "svi", "ts", "vob", "vtt", "wmv", "yuv", "webm",
+    "aac", "aiff", "alac", "m4a", "opus", "wav", "wma", "heic", "jpeg", "jpg", "png", "raw", "tif", "tiff"
+]
+ignored_dirs: list[str] = ["@eaDir", ".grab", "#recycle", "#snapshot", ".AppleDouble", "lost+found"]
 VERSION: str = "0.0.11"
 user_input: Namespace
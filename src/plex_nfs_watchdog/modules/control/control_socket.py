@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+from pathlib import Path
+from threading import Thread
+from typing import Callable, Optional
+
+from ..config import shared
+
+# Largest request accepted, about 100k paths
+MAX_REQUEST_SIZE: int = 16 * 1024 * 1024
+# Seconds a client waits for the daemon to accept and answer its request
+CLIENT_TIMEOUT: float = 30.0
+
+
+def is_supported() -> bool:
+    return hasattr(socket, "AF_UNIX")
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # A client may send several requests over the same connection
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_SIZE + 1)
+            if not line:
+                return
+            if len(line) > MAX_REQUEST_SIZE:
+                self.__reply({"ok": False, "error": f"request larger than {MAX_REQUEST_SIZE} bytes"})
+                return
+            try:
+                reply = self.server.control.handle_request(json.loads(line))
+            except (ValueError, TypeError, KeyError) as e:
+                reply = {"ok": False, "error": f"invalid request: {e}"}
+            self.__reply(reply)
+
+    def __reply(self, reply: dict) -> None:
+        self.wfile.write((json.dumps(reply) + "\n").encode())
+        self.wfile.flush()
+
+
+class ControlServer:
+    """
+    Local Unix domain socket on which the daemon takes scan requests from --scan --via-daemon clients,
+    with one thread per connected client.
+
+    The protocol is line-delimited JSON, one request and one reply per line:
+      {"op": "ping"}                            => {"ok": true, "version": "..."}
+      {"op": "scan", "paths": [folder, ...]}    => {"ok": true, "queued": count, "unmatched": [folder, ...]}
+    A single scan request may hold thousands of folders. "paths": null queues every library folder.
+    Errors are replied as {"ok": false, "error": "..."}.
+    """
+
+    def __init__(self, path: Path, on_scan: Callable[[Optional[list[Path]]], tuple[int, list[Path]]]):
+        self.__path = path
+        self.__on_scan = on_scan
+        self.__remove_stale_socket()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Only the user running the daemon may submit scans: the socket is created with mode 0600,
+        # as changing its mode once bound would let other users connect in between
+        umask = os.umask(0o177)
+        try:
+            self.__server = socketserver.ThreadingUnixStreamServer(str(path), _ControlHandler)
+        finally:
+            os.umask(umask)
+        self.__server.daemon_threads = True
+        self.__server.control = self
+        self.__thread = Thread(target=self.__server.serve_forever, name="control-server", daemon=True)
+
+    def __remove_stale_socket(self) -> None:
+        try:
+            mode = self.__path.lstat().st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise OSError(f"{self.__path} exists and is not a socket, not replacing it")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(self.__path))
+            except OSError:
+                # Left over by a daemon that did not stop cleanly
+                self.__path.unlink()
+                return
+        raise OSError(f"another daemon is already listening on {self.__path}")
+
+    def handle_request(self, request: dict) -> dict:
+        if request["op"] == "ping":
+            return {"ok": True, "version": shared.VERSION}
+        if request["op"] == "scan":
+            paths = None if request["paths"] is None else [Path(path) for path in request["paths"]]
+            logging.info(f"Received {len(paths) if paths is not None else 'all'} folders to scan from a client")
+            queued, unmatched = self.__on_scan(paths)
+            return {"ok": True, "queued": queued, "unmatched": [str(path) for path in unmatched]}
+        return {"ok": False, "error": f"unknown operation {request['op']!r}"}
+
+    def start(self) -> None:
+        logging.info(f"Taking scan requests on {self.__path}")
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__server.shutdown()
+        self.__server.server_close()
+        try:
+            self.__path.unlink()
+        except OSError:
+            pass
+
+
+def submit_scans(path: Path, folders: Optional[list[Path]]) -> dict:
+    """
+    Sends folders to scan to the daemon listening on path, every library folder if folders is None.
+    :return: The daemon reply.
+    :raise FileNotFoundError, ConnectionRefusedError: No daemon listens on path.
+    :raise TimeoutError: The daemon did not reply in time, it may still queue the folders.
+    :raise OSError: The connection failed after the request was sent.
+    :raise ValueError: The reply is not a JSON object.
+    """
+    request = {"op": "scan", "paths": [str(folder) for folder in folders] if folders is not None else None}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CLIENT_TIMEOUT)
+        client.connect(str(path))
+        try:
+            client.sendall((json.dumps(request) + "\n").encode())
+            with client.makefile("rb") as reply_file:
+                line = reply_file.readline()
+        except socket.timeout:
+            raise TimeoutError(f"the daemon on {path} did not reply within {CLIENT_TIMEOUT:.0f}s")
+    if not line:
+        raise OSError(f"the daemon on {path} closed the connection without replying")
+    reply = json.loads(line)
+    if not isinstance(reply, dict):
+        raise ValueError(f"unexpected reply {reply!r}")
+    return reply
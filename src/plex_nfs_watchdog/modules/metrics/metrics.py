@@ -0,0 +1,225 @@
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Iterable
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """
+    Base class of the metrics, one value per combination of label values.
+    """
+    TYPE: str = ""
+
+    def __init__(self, name: str, description: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._lock = Lock()
+        self._values: dict[tuple[str, ...], object] = {}
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        with self._lock:
+            samples = self._samples()
+        return "\n".join([f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.TYPE}", *samples])
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def _samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_max(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = max(value, self._values.get(label_values, value))
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Iterable[float], label_names: Iterable[str] = ()):
+        super().__init__(name, description, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            # [count per bucket..., +Inf count, sum]
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[bisect_left(self.buckets, value)] += 1
+            state[-1] += value
+
+    def _samples(self) -> list[str]:
+        samples = []
+        for labels, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], state):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, labels, 'le="' + bound + '"')
+                samples.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            samples.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {state[-1]}")
+            samples.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Holds every metric of the daemon and renders them in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.__metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self.__metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.__metrics) + "\n"
+
+
+registry = MetricsRegistry()
+
+_LATENCY_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+_REQUEST_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+events_received: Counter = registry.register(Counter(
+    "plex_watchdog_events_received_total", "Filesystem events received, per listener type", ["listener"]
+))
+events_filtered: Counter = registry.register(Counter(
+    "plex_watchdog_events_filtered_total", "Filesystem events filtered out or ignored, per reason", ["reason"]
+))
+events_overflowed: Counter = registry.register(Counter(
+    "plex_watchdog_events_overflowed_total", "Filesystem events reduced to their parent folder by backpressure"
+))
+queue_depth: Gauge = registry.register(Gauge(
+    "plex_watchdog_queue_depth", "Partial-scans waiting in the notify queue, per Plex server", ["server"]
+))
+queue_max_depth: Gauge = registry.register(Gauge(
+    "plex_watchdog_queue_max_depth", "Highest number of partial-scans seen waiting in the notify queue, per Plex server",
+    ["server"]
+))
+section_requests_saved: Counter = registry.register(Counter(
+    "plex_watchdog_section_requests_saved_total",
+    "Plex section lookups avoided by looking sections up once per batch of scans, per Plex server", ["server"]
+))
+scans_collapsed: Counter = registry.register(Counter(
+    "plex_watchdog_scans_collapsed_total",
+    "Partial-scans merged into a parent folder scan because --max-queued-scans was reached, per Plex server",
+    ["server"]
+))
+scan_latency: Histogram = registry.register(Histogram(
+    "plex_watchdog_event_to_scan_seconds", "Time from the first event on a path to its partial-scan request",
+    _LATENCY_BUCKETS, ["server"]
+))
+plex_request_seconds: Histogram = registry.register(Histogram(
+    "plex_watchdog_plex_request_seconds", "Latency of the requests sent to Plex, per server and operation",
+    _REQUEST_BUCKETS, ["server", "operation"]
+))
+plex_request_errors: Counter = registry.register(Counter(
+    "plex_watchdog_plex_request_errors_total", "Failed requests sent to Plex, per server and operation",
+    ["server", "operation"]
+))
+refreshing_requeues: Counter = registry.register(Counter(
+    "plex_watchdog_refreshing_requeues_total", "Partial-scans parked because their section was refreshing",
+    ["server", "section"]
+))
+parked_scans: Gauge = registry.register(Gauge(
+    "plex_watchdog_parked_scans", "Partial-scans parked until their section is idle or Plex is reachable again",
+    ["server"]
+))
+circuit_open: Gauge = registry.register(Gauge(
+    "plex_watchdog_circuit_open", "1 while requests to an unreachable Plex server are held back", ["server"]
+))
+scans_skipped: Counter = registry.register(Counter(
+    "plex_watchdog_scans_skipped_total", "Partial-scans skipped because Plex had already indexed their folder",
+    ["server", "section"]
+))
+
+
+@contextmanager
+def track_plex_request(server: str, operation: str):
+    """
+    Records the latency of the Plex request sent inside the with block, and its failure if it raises.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    except Exception:
+        plex_request_errors.inc(server, operation)
+        raise
+    finally:
+        plex_request_seconds.observe(time.monotonic() - start, server, operation)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Metrics endpoint: {format % args}")
+
+
+class MetricsServer:
+    """
+    Serves the metrics registry on http://<host>:<port>/metrics from a background thread.
+    """
+
+    def __init__(self, port: int, host: str = ""):
+        self.__server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.__server.daemon_threads = True
+        self.__thread = Thread(target=self.__server.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self) -> None:
+        logging.info(f"Serving metrics on port {self.__server.server_address[1]}")
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__server.shutdown()
+        self.__server.server_close()
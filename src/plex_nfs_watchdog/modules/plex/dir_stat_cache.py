@@ -0,0 +1,90 @@
+import os
+import time
+from threading import Lock
+from typing import NamedTuple, Optional
+
+
+class DirEntry(NamedTuple):
+    expires_at: float
+    # Last seen st_mtime, None when the folder was only seen through a changed file inside it
+    mtime: Optional[float]
+    # True if the folder, or an event file inside it, changed after the script started
+    changed: bool
+
+
+class DirStatCache:
+    """
+    Short-lived cache of folder metadata, shared by the threads checking event paths.
+
+    A burst of events in one folder only needs the folder to be checked once: while its entry is fresh,
+    events in a folder known to have changed since the script started are accepted without any syscall.
+    Entries expire after ttl seconds, and events on a folder invalidate what they may have changed:
+    a deleted or moved folder drops the entries of its whole subtree. Deletions resolve to the nearest
+    existing ancestor from the cache, so they usually cost no syscall either. A ttl of 0 disables the cache.
+
+    Reads are lock-free, the lock only keeps writers from resizing the dict under a subtree invalidation.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 65536):
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        self.__entries: dict[str, DirEntry] = {}
+        self.__lock = Lock()
+
+    def get(self, folder: str) -> Optional[DirEntry]:
+        """
+        :return: The unexpired entry of a folder, if any.
+        """
+        entry = self.__entries.get(folder)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry
+
+    def put(self, folder: str, mtime: Optional[float], changed: bool) -> None:
+        if not self.__ttl:
+            return
+        now = time.monotonic()
+        with self.__lock:
+            if len(self.__entries) >= self.__max_entries:
+                self.__entries = {path: entry for path, entry in self.__entries.items() if entry.expires_at > now}
+                if len(self.__entries) >= self.__max_entries:
+                    self.__entries.clear()
+            self.__entries[folder] = DirEntry(now + self.__ttl, mtime, changed)
+
+    def stat(self, folder: str, since: float) -> Optional[DirEntry]:
+        """
+        Stats a folder and caches the result, with a single syscall.
+        :return: The new entry, or None if the folder doesn't exist.
+        :raise OSError: The folder exists but could not be read.
+        """
+        try:
+            mtime = os.stat(folder).st_mtime
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        changed = mtime >= since
+        self.put(folder, mtime, changed)
+        return DirEntry(time.monotonic() + self.__ttl, mtime, changed)
+
+    def invalidate(self, folder: str, subtree: bool = False) -> None:
+        """
+        Drops the entry of a folder, and the entries below it if subtree is set.
+        """
+        with self.__lock:
+            self.__entries.pop(folder, None)
+            if subtree:
+                prefix = folder.rstrip(os.sep) + os.sep
+                for path in [path for path in self.__entries if path.startswith(prefix)]:
+                    del self.__entries[path]
+
+    def nearest_existing(self, path: str, since: float) -> Optional[str]:
+        """
+        Resolves a deleted path to its nearest existing ancestor folder. Cached ancestors are trusted,
+        the other ones are stated until one exists.
+        :return: The ancestor, or None if the path has none left.
+        """
+        parent = os.path.dirname(path)
+        while parent != path:
+            if self.get(parent) is not None or self.stat(parent, since) is not None:
+                return parent
+            path, parent = parent, os.path.dirname(parent)
+        return None
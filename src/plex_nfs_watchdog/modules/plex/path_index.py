@@ -0,0 +1,46 @@
+from functools import lru_cache
+from pathlib import Path
+
+
+class LibraryPathIndex:
+    """
+    Precomputed lookup from a folder name to the Plex sections and locations that end with it.
+
+    Built once from the (section_title -> [(folder_name, remote_path), ...]) mapping, it resolves
+    a path to its deepest (section_title, subpath) matches with a single pass over the path parts.
+    Resolutions are memoized, since event bursts tend to hit the same parent folder over and over.
+    """
+
+    def __init__(self, internal_paths: dict[str, list[tuple[str, str]]], memo_size: int = 4096):
+        self.__by_folder: dict[str, list[str]] = {}
+        self.__section_order: dict[str, int] = {}
+        for order, (section_title, folder_list) in enumerate(internal_paths.items()):
+            self.__section_order[section_title] = order
+            for (folder_name, _) in folder_list:
+                sections = self.__by_folder.setdefault(folder_name, [])
+                if section_title not in sections:
+                    sections.append(section_title)
+        self.__resolve_parts = lru_cache(maxsize=memo_size)(self.__resolve)
+
+    def __resolve(self, parts: tuple[str, ...]) -> tuple[tuple[str, Path], ...]:
+        best_idx: dict[str, int] = {}
+        # Walking the parts backwards, the first hit for a section is its deepest match
+        for idx in range(len(parts) - 1, -1, -1):
+            for section_title in self.__by_folder.get(parts[idx], ()):
+                if section_title not in best_idx:
+                    best_idx[section_title] = idx
+            if len(best_idx) == len(self.__section_order):
+                break
+
+        matches = []
+        for section_title in sorted(best_idx, key=self.__section_order.__getitem__):
+            sub_path_parts = parts[best_idx[section_title] + 1:]
+            subpath = Path(*sub_path_parts) if sub_path_parts else Path(".")
+            matches.append((section_title, subpath))
+        return tuple(matches)
+
+    def resolve(self, item: Path) -> list[tuple[str, Path]]:
+        """
+        Returns the deepest (section_title, subpath) match of every section for the given path.
+        """
+        return list(self.__resolve_parts(item.parts))
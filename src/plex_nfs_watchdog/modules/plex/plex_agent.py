@@ -1,121 +1,127 @@
-import json
+import asyncio
+import importlib.util
 import logging
 import pprint
+import time
 
+from functools import partial
+from plexapi.library import LibrarySection
 from plexapi.server import PlexServer
 from pathlib import Path
-from threading import Event, Thread
-
+from requests import Session
+from requests.adapters import HTTPAdapter
+from typing import Iterable, Optional
+
+from .path_index import LibraryPathIndex
+from .quick_scan import save_sections_cache
+from .retry_state import FAILING, REFRESHING, CircuitBreaker, SectionTracker
+from .scan_dispatcher import ScanDispatcher
+from .scan_journal import ScanJournal
+from .scan_planner import ScanPlanner
+from .scan_queue import QueuedScan, ScanQueue, to_key
+from .scan_verifier import ScanVerifier
 from ..config import shared
+from ..metrics import metrics
 
 
-class PlexAgent:
-    __plex_config: dict[str, str] = {}
-    __server: PlexServer = None
-    __save_cache: bool = False
-
-    # Each key = Plex library section title, value = list of (folder_name, remote_path).
-    # For example:
-    #   {
-    #     "Movies": [("Movies", "/mnt/media/Movies"), ("Extra", "/mnt/media/MoreMovies")],
-    #     "TV Shows": [("TV", "D:/TV Shows")]
-    #   }
-    __internal_paths: dict[str, list[tuple[str, str]]] = {}
-    __notify_queue: list[tuple[str, str]] = []
-    __supported_ext: list[str] = [
-        "3g2", "3gp", "amv", "asf", "ass", "avi", "drc", "f4a", "f4b", "f4p", "f4v", "flac", "flv",
-        "gif", "gifv", "idx", "m2ts", "m2v", "m4p", "m4v", "m4v", "mkv", "mng", "mov", "mp2", "mp3",
-        "mp4", "mpe", "mpeg", "mpg", "mpv", "mxf", "nsv", "ogg", "ogv", "qt", "rm", "rmvb", "roq",
-        "smi", "srt", "ssa", "sub", "svi", "ts", "vob", "vtt", "wmv", "yuv", "webm"
-    ]
-
-    script_start_time: float = 0.0
+class _LocationRequests:
+    """
+    Progress of the requests sent for the locations of a queued scan, shared by these requests,
+    along with the journal checkpoint taken before the first one was sent.
+    """
+    __slots__ = ("remaining", "failed", "checkpoint")
 
-    def set_script_start_time(self, t: float):
-        self.script_start_time = t
+    def __init__(self, count: int, checkpoint: int):
+        self.remaining = count
+        self.failed = False
+        self.checkpoint = checkpoint
 
-    def is_cache_loaded(self) -> bool:
-        """
-        Checks if the Plex configuration is set.
-        :return: True if the Plex configuration is set, False otherwise.
-        """
-        return bool(self.__plex_config)
 
-    def load_config_cache(self) -> None:
-        """
-        Loads the Plex configuration from the cache.
-        """
-        try:
-            logging.info(f"Found Plex configuration from cache: {shared.cache_path}")
-            with open(shared.cache_path, "r") as cache_file:
-                self.__plex_config = json.load(cache_file)
-        except OSError as e:
-            logging.error(f"Could not load Plex configuration from cache: {e}")
-            exit(-1)
+class PlexAgent:
+    """
+    Scans the libraries of a single Plex server: resolves folders to its sections, queues
+    the resulting scans and sends them through its own dispatcher, with its own journal.
+    Several agents share one event pipeline through PlexAgentGroup.
+
+    The queue, retry state and dispatcher lanes live on the service event loop and are only touched
+    from it: the blocking plexapi calls run on the dispatcher worker pool, and the other threads
+    (event resolver, control socket, alert listener) hand their work over to the loop.
+    """
+
+    def __init__(self, host: str, token: str, journal_path: Optional[Path], sections_cache_path: Optional[Path] = None):
+        self.host = host
+        self.__token = token
+        self.__journal_path = journal_path
+        self.__sections_cache_path = sections_cache_path
+        self.__server: Optional[PlexServer] = None
+        self.__dispatcher: Optional[ScanDispatcher] = None
+        self.__journal: Optional[ScanJournal] = None
+        self.__verifier: Optional[ScanVerifier] = None
+        self.__planner: Optional[ScanPlanner] = None
+        self.__tracker = SectionTracker(
+            shared.user_input.retry_base, shared.user_input.retry_max, shared.user_input.max_queued_scans
+        )
+        self.__breaker = CircuitBreaker(shared.user_input.retry_base, shared.user_input.retry_max)
+        # Section key => title, as of the last sections fetch, to map Plex alerts
+        self.__section_titles: dict[str, str] = {}
+
+        # Each key = Plex library section title, value = list of (folder_name, remote_path).
+        # For example:
+        #   {
+        #     "Movies": [("Movies", "/mnt/media/Movies"), ("Extra", "/mnt/media/MoreMovies")],
+        #     "TV Shows": [("TV", "D:/TV Shows")]
+        #   }
+        self.__internal_paths: dict[str, list[tuple[str, str]]] = {}
+        # Folder-name index over __internal_paths, rebuilt by __inspect_library
+        self.__path_index = LibraryPathIndex({})
+        self.__notify_queue = ScanQueue()
+        # Set to re-plan the service task timer, e.g. when a new scan is queued
+        self.__wakeup: Optional[asyncio.Event] = None
+        self.__sleep_until: Optional[float] = None
+        self.__service: Optional[asyncio.Task] = None
+        self.__alert_listener = None
+        # Local folder of each (section title, folder_name) mapping, learnt from the queued events
+        self.__local_roots: dict[tuple[str, str], Path] = {}
+        # Scans collapsed by the queue and the tracker, as of the last metrics update
+        self.__collapsed = 0
 
-    def __save_config_cache(self) -> None:
+    def connect(self) -> None:
         """
-        Saves the Plex configuration to the cache.
+        Connects to the Plex server and gathers its library folders.
         """
-        try:
-            logging.info(f"Saving Plex configuration to cache: {shared.cache_path}")
-            if not shared.cache_path.parent.exists():
-                shared.cache_path.parent.mkdir(parents=True)
-            with open(shared.cache_path, "w") as cache_file:
-                json.dump(self.__plex_config, cache_file)
-        except OSError as e:
-            logging.error(f"Could not save Plex configuration to cache: {e}")
-            exit(-1)
-
-    def __eval_config(self) -> None:
-        """
-        Ensures that host and token are available either from CLI or cache.
-        """
-        if shared.user_input.token and not self.__plex_config:
-            self.__plex_config["host"] = shared.user_input.host
-            self.__plex_config["token"] = shared.user_input.token
-            self.__save_cache = True
-        elif shared.user_input.token and self.__plex_config:
-            if (self.__plex_config["host"] != shared.user_input.host or
-                    self.__plex_config["token"] != shared.user_input.token):
-                logging.warning("Plex host and/or token differ from the cached ones!")
-                while True:
-                    answer: str = input("Do you want to overwrite the cached configuration? [y/N]: ").lower()
-                    if answer == 'y':
-                        self.__plex_config["host"] = shared.user_input.host
-                        self.__plex_config["token"] = shared.user_input.token
-                        self.__save_cache = True
-                        break
-                    elif answer == 'n':
-                        break
-
-    def connect(self) -> None:
+        self.__server = PlexServer(self.host, self.__token, session=self.__build_session())
+        self.__dispatcher = ScanDispatcher(shared.user_input.workers, shared.user_input.max_rps)
+        self.__planner = ScanPlanner(
+            self.host, shared.user_input.escalate_count, shared.user_input.escalate_ratio,
+            shared.user_input.merge_siblings
+        )
+        if shared.user_input.verify:
+            self.__verifier = ScanVerifier(self.host, shared.user_input.verify_ttl, frozenset(shared.supported_ext))
+        logging.info(f"Connected to Plex server {self.host}")
+        logging.info(f"Plex version: {self.__server.version}")
+        self.__inspect_library()
+
+        # Count how many total folder mappings (all sections)
+        num_detected_paths = sum(len(paths) for paths in self.__internal_paths.values())
+        if num_detected_paths == 0:
+            raise ValueError(f"No Plex library sections or paths detected on {self.host}. Check your configuration.")
+
+        logging.info(
+            f"Found {num_detected_paths} folder mappings across sections:\n"
+            f"{pprint.pformat(self.__internal_paths)}"
+        )
+
+    @staticmethod
+    def __build_session() -> Session:
         """
-        Connects to the Plex server using the stored or user-provided host/token.
+        Builds the keep-alive HTTP session shared by every request sent to Plex,
+        with a connection pool large enough for all the dispatcher workers.
         """
-        self.__eval_config()
-        try:
-            self.__server = PlexServer(self.__plex_config["host"], self.__plex_config["token"])
-            logging.info("Connected to Plex server")
-            logging.info(f"Plex version: {self.__server.version}")
-            self.__inspect_library()
-
-            # Count how many total folder mappings (all sections)
-            num_detected_paths = sum(len(paths) for paths in self.__internal_paths.values())
-            if num_detected_paths == 0:
-                logging.error("No Plex library sections or paths detected. Check your configuration.")
-                exit(-1)
-
-            logging.info(
-                f"Found {num_detected_paths} folder mappings across sections:\n"
-                f"{pprint.pformat(self.__internal_paths)}"
-            )
-
-            if self.__save_cache:
-                self.__save_config_cache()
-        except Exception as e:
-            logging.error(f"Unable to connect to Plex server:\n{e}")
-            exit(-1)
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=shared.user_input.workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     def __inspect_library(self) -> None:
         """
@@ -125,13 +131,54 @@ class PlexAgent:
             }
         This code is platform-neutral, but the remote_path might be formatted for your OS (e.g., "D:/TV Shows" or "/mnt/media").
         """
-        for section in self.__server.library.sections():
-            if section.title not in self.__internal_paths:
-                self.__internal_paths[section.title] = []
+        sections = self.__server.library.sections()
+        self.__save_sections_cache(sections)
+        self.__set_internal_paths(self.__map_sections(sections))
+
+    def __save_sections_cache(self, sections: Iterable[LibrarySection]) -> None:
+        """
+        Keeps the sections cache used by --scan fresh while the daemon runs.
+        """
+        if self.__sections_cache_path is not None:
+            save_sections_cache(self.__sections_cache_path, self.host, [
+                {"key": str(section.key), "title": section.title, "locations": list(section.locations),
+                 "refreshing": bool(section.refreshing)}
+                for section in sections
+            ])
+
+    @staticmethod
+    def __map_sections(sections: Iterable[LibrarySection]) -> dict[str, list[tuple[str, str]]]:
+        internal_paths: dict[str, list[tuple[str, str]]] = {}
+        for section in sections:
+            folders = internal_paths.setdefault(section.title, [])
             for remote_path in section.locations:
                 folder_name = Path(remote_path).name
                 # The final component is used for matching user paths.
-                self.__internal_paths[section.title].append((folder_name, remote_path))
+                folders.append((folder_name, remote_path))
+        return internal_paths
+
+    def __set_internal_paths(self, internal_paths: dict[str, list[tuple[str, str]]]) -> None:
+        """
+        Swaps in new folder mappings without locking: each attribute is replaced at once, the folders first,
+        so a scan resolved with the new index always finds its section folders.
+        """
+        self.__internal_paths = internal_paths
+        self.__path_index = LibraryPathIndex(internal_paths)
+
+    async def refresh_library(self) -> bool:
+        """
+        Re-reads the library sections and swaps in new folder mappings if a section or one of its folders
+        was added, removed or renamed. Queued scans are kept, the ones of a removed section are dropped when due.
+        :return: True if the folder mappings changed.
+        """
+        sections = (await self.__fetch_sections()).values()
+        await self.__dispatcher.run_blocking(self.__save_sections_cache, sections)
+        internal_paths = self.__map_sections(sections)
+        if internal_paths == self.__internal_paths:
+            return False
+        logging.info(f"Library folders of {self.host} changed:\n{pprint.pformat(internal_paths)}")
+        self.__set_internal_paths(internal_paths)
+        return True
 
     def get_all_library_paths(self) -> set[Path]:
         """
@@ -145,6 +192,13 @@ class PlexAgent:
                 all_paths.add(Path(remote_path))
         return all_paths
 
+    @property
+    def folder_mappings(self) -> dict[str, list[tuple[str, str]]]:
+        """
+        The current (section_title -> [(folder_name, remote_path), ...]) mappings, not to be modified.
+        """
+        return self.__internal_paths
+
     def find_sections_and_subpaths(self, item: Path) -> list[tuple[str, Path]]:
         """
         Return the best (section_title, subpath) combos for the user-supplied path.
@@ -160,28 +214,7 @@ class PlexAgent:
 
         If multiple sections have matches at the same depth, all are returned.
         """
-        item_parts = list(item.parts)
-        matches = []
-
-        # For each section, track the deepest match (highest index)
-        for section_title, folder_list in self.__internal_paths.items():
-            best_idx = -1
-            best_folder = None
-            for (folder_name, remote_path) in folder_list:
-                try:
-                    idx = len(item_parts) - 1 - item_parts[::-1].index(folder_name)
-                    if idx > best_idx:
-                        best_idx = idx
-                        best_folder = (folder_name, remote_path)
-                except ValueError:
-                    continue  # folder_name not in item_parts
-            if best_folder is not None:
-                folder_name, remote_path = best_folder
-                sub_path_parts = item_parts[best_idx + 1 :]
-                subpath = Path(*sub_path_parts) if sub_path_parts else Path(".")
-                matches.append((section_title, subpath))
-
-        return matches
+        return self.__path_index.resolve(item)
 
     def __get_scannable_paths(self, section_title: str, subpath: Path) -> list[Path]:
         """
@@ -192,137 +225,374 @@ class PlexAgent:
         On Linux/macOS, it could be "/mnt/media/TV" + subpath = "/mnt/media/TV/Episode..."
         """
         if section_title not in self.__internal_paths:
-            return list[subpath]
+            return [subpath]
 
         return [Path(remote_path) / subpath for _, remote_path in self.__internal_paths[section_title]]
 
-    def _scan(self, section_title: str, subpath: Path) -> None:
+    def __get_local_paths(self, section_title: str, subpath: Path) -> list[Optional[Path]]:
         """
-        Request Plex to scan the computed path in the specified library section.
+        Local counterparts of __get_scannable_paths, in the same order.
+        A path is None while no event was seen below its library folder.
         """
-        plex_section = self.__server.library.section(section_title)
-        if plex_section.refreshing:
-            if shared.user_input.daemon:
-                logging.warning(f"Section '{section_title}' is currently refreshing; re-scheduling scan.")
-                self.__notify_queue.append((section_title, str(subpath)))
-            else:
-                logging.warning(f"Section '{section_title}' is currently refreshing; skipping scan.")
-            return
+        local_paths = []
+        for folder_name, _ in self.__internal_paths.get(section_title, [(None, None)]):
+            local_root = self.__local_roots.get((section_title, folder_name))
+            local_paths.append(local_root / subpath if local_root is not None else None)
+        return local_paths
 
-        scannable_paths = self.__get_scannable_paths(section_title, subpath)
-        for scannable_path in scannable_paths:
-            logging.info(f"Requesting Plex to scan path '{scannable_path}' in section '{section_title}'")
+    def __remember_local_root(self, local_path: Path, section_title: str, subpath: Path) -> None:
+        """
+        Records the local library folder of a resolved path, so that its scans can be verified.
+        """
+        if self.__verifier is not None:
+            local_root = Path(*local_path.parts[:len(local_path.parts) - len(subpath.parts)])
+            self.__local_roots[(section_title, local_root.name)] = local_root
 
-            if shared.user_input.dry_run:
-                logging.info("Skipping Plex scan (dry-run mode)")
-            else:
-                plex_section.update(str(scannable_path))
+    def __request_sections(self) -> list[LibrarySection]:
+        with metrics.track_plex_request(self.host, "sections"):
+            return self.__server.library.sections()
 
-    def _scan_once(self, section_title: str, subpath: Path) -> bool:
+    async def __fetch_sections(self) -> dict[str, LibrarySection]:
         """
-        Attempts a single partial scan. Returns True if success,
-        False if the section is refreshing (and we should retry later).
+        Fetches every Plex library section, and its current refreshing state, with a single request.
+        :return: A dict keyed by section title.
         """
-        plex_section = self.__server.library.section(section_title)
-        if plex_section.refreshing:
-            logging.warning(f"Section '{section_title}' is currently refreshing; re-scheduling scan.")
-            return False  # We'll reschedule in start_service() loop
+        sections = await self.__dispatcher.run_blocking(self.__request_sections)
+        plex_sections = {section.title: section for section in sections}
+        self.__section_titles = {str(section.key): section.title for section in plex_sections.values()}
+        return plex_sections
+
+    async def __request_scan(self, plex_section: LibrarySection, queued_scan: QueuedScan,
+                             scannable_path: Optional[Path], local_path: Optional[Path] = None,
+                             requests: Optional[_LocationRequests] = None) -> None:
+        """
+        Sends a single partial-scan request through an already fetched section handle.
+        A scannable_path of None scans the whole section. If the request fails, the queued scan is parked.
+        The queued scan is journaled as done once the requests for all of its locations succeeded.
+        :param local_path: The local folder matching scannable_path, to verify it against Plex first (--verify).
+        :param requests: The requests sent for the locations of the queued scan, None for a single request.
+        """
+        section_title, subpath, first_seen = queued_scan
+        requests = requests or _LocationRequests(1, self.__journal_checkpoint())
+        requests.remaining -= 1
+        try:
+            await self.__dispatcher.run_blocking(self.__verify_and_send, plex_section, queued_scan, scannable_path,
+                                                 local_path)
+        except Exception as e:
+            requests.failed = True
+            if self.__breaker.record_failure():
+                logging.error(f"{self.host} looks unreachable, holding back every request for a while")
+            delay = self.__tracker.park(section_title, [queued_scan], FAILING)
+            logging.error(
+                f"Scan of '{subpath}' in section '{section_title}' of {self.host} failed: {e}. "
+                f"Retrying in {delay:.0f}s."
+            )
+            self.__update_queue_metrics()
+            # The service task must take the new retry time into account
+            self.__wake()
+            return
+        self.__breaker.record_success()
+        self.__tracker.settle(section_title)
+        if not requests.remaining and not requests.failed and self.__journal is not None:
+            self.__journal.record_done(section_title, subpath, requests.checkpoint)
 
-        scannable_paths = self.__get_scannable_paths(section_title, subpath)
-        for scannable_path in scannable_paths:
-            logging.info(f"Requesting Plex to scan path '{scannable_path}' in section '{section_title}'")
-            if shared.user_input.dry_run:
-                logging.info("Skipping Plex scan (dry-run mode)")
-            else:
-                plex_section.update(str(scannable_path))
-        return True
+    def __journal_checkpoint(self) -> int:
+        return self.__journal.checkpoint() if self.__journal is not None else 0
+
+    def __verify_and_send(self, plex_section: LibrarySection, queued_scan: QueuedScan,
+                          scannable_path: Optional[Path], local_path: Optional[Path]) -> None:
+        """
+        Blocking part of __request_scan, run on the dispatcher worker pool.
+        """
+        section_title, _, first_seen = queued_scan
+        if (self.__verifier is not None and local_path is not None and
+                self.__verifier.is_indexed(plex_section, str(scannable_path), local_path)):
+            logging.info(
+                f"Skipping scan of path '{scannable_path}': already indexed in section '{section_title}' "
+                f"of {self.host}"
+            )
+            metrics.scans_skipped.inc(self.host, section_title)
+        else:
+            self.__send_scan(plex_section, scannable_path, first_seen)
+
+    def __send_scan(self, plex_section: LibrarySection, scannable_path: Optional[Path], first_seen: float) -> None:
+        if scannable_path is None:
+            logging.info(f"Requesting {self.host} to scan the whole section '{plex_section.title}'")
+        else:
+            logging.info(f"Requesting {self.host} to scan path '{scannable_path}' in section '{plex_section.title}'")
+        if shared.user_input.dry_run:
+            logging.info("Skipping Plex scan (dry-run mode)")
+        else:
+            with metrics.track_plex_request(self.host, "update"):
+                plex_section.update(str(scannable_path) if scannable_path is not None else None)
+        metrics.scan_latency.observe(time.monotonic() - first_seen, self.host)
+
+    async def _scan_batch(self, pending: list[QueuedScan]) -> list[QueuedScan]:
+        """
+        Requests a partial-scan for every pending (section_title, subpath, first_seen) item.
+        Sections are looked up once for the whole batch, then the items are grouped by section
+        and handed to the dispatcher through the cached section handle, one lane per section.
+        Items are parked instead when their section is refreshing or Plex can't be reached.
+        :return: The parked items.
+        """
+        grouped: dict[str, list[QueuedScan]] = {}
+        for queued_scan in pending:
+            grouped.setdefault(queued_scan[0], []).append(queued_scan)
 
-    def manual_scan(self, paths: set[Path]) -> None:
+        try:
+            plex_sections = await self.__fetch_sections()
+        except Exception as e:
+            if self.__breaker.record_failure():
+                logging.error(f"{self.host} looks unreachable, holding back every request for a while")
+            for section_title, section_scans in grouped.items():
+                self.__tracker.park(section_title, section_scans, FAILING, retry_at=self.__breaker.retry_at)
+            logging.error(f"Could not fetch the library sections of {self.host}: {e}. Parked {len(pending)} scans.")
+            return pending
+        self.__breaker.record_success()
+
+        deferred = []
+        for section_title, section_scans in grouped.items():
+            plex_section = plex_sections.get(section_title)
+            if plex_section is None:
+                logging.error(f"Section '{section_title}' no longer exists on {self.host}; dropping {len(section_scans)} scans.")
+                if self.__journal is not None:
+                    checkpoint = self.__journal.checkpoint()
+                    for _, subpath, _ in section_scans:
+                        self.__journal.record_done(section_title, subpath, checkpoint)
+                continue
+            if plex_section.refreshing:
+                delay = self.__tracker.park(section_title, section_scans, REFRESHING)
+                logging.warning(
+                    f"Section '{section_title}' is currently refreshing; parked {len(section_scans)} scans, "
+                    f"next check in {delay:.0f}s."
+                )
+                metrics.refreshing_requeues.inc(self.host, section_title, amount=len(section_scans))
+                deferred.extend(section_scans)
+                continue
+            if self.__tracker.state(section_title) == REFRESHING:
+                self.__tracker.settle(section_title)
+            # Planning may count the items of the section, which is a Plex request
+            planned_scans = await self.__dispatcher.run_blocking(self.__planner.plan, plex_section, section_scans)
+            for _, subpath, first_seen in planned_scans:
+                if not subpath.parts:
+                    # A single refresh covers every folder of the section
+                    self.__dispatcher.submit(section_title, partial(
+                        self.__request_scan, plex_section, (section_title, subpath, first_seen), None
+                    ))
+                    continue
+                scannable_paths = self.__get_scannable_paths(section_title, subpath)
+                local_paths = self.__get_local_paths(section_title, subpath)
+                requests = _LocationRequests(len(scannable_paths), self.__journal_checkpoint())
+                for idx, scannable_path in enumerate(scannable_paths):
+                    local_path = local_paths[idx] if local_paths else None
+                    self.__dispatcher.submit(section_title, partial(
+                        self.__request_scan, plex_section, (section_title, subpath, first_seen), scannable_path,
+                        local_path, requests
+                    ))
+
+        # One section lookup per item used to be needed, now there is a single one per batch
+        requests_saved = len(pending) - 1
+        metrics.section_requests_saved.inc(self.host, amount=requests_saved)
+        logging.info(
+            f"Processed {len(pending)} queued scans across {len(grouped)} sections of {self.host} "
+            f"({requests_saved} section requests saved)"
+        )
+        return deferred
+
+    async def manual_scan(self, paths: set[Path]) -> None:
         """
         For manual (user-initiated) scans.
         For each path, find which Plex section(s) it might belong to, then request a scan.
+        Does not wait for the requests to be sent, see wait_scans().
         """
+        pending = []
+        now = time.monotonic()
         for given_path in paths:
-            logging.info(f"Analyzing '{given_path}' for manual scan.")
             all_matches = self.find_sections_and_subpaths(given_path)
             if not all_matches:
-                logging.error(f"Could not map '{given_path}' to any known Plex section.")
+                logging.debug(f"Could not map '{given_path}' to any section of {self.host}.")
                 continue
+            for section_title, subpath in all_matches:
+                self.__remember_local_root(given_path, section_title, subpath)
+                pending.append((section_title, subpath, now))
 
-            for (section_title, subpath) in all_matches:
-                self._scan(section_title, subpath)
+        if not pending:
+            return
+        for (section_title, subpath, _) in await self._scan_batch(pending):
+            logging.warning(f"Skipped scan of '{subpath}' in section '{section_title}' of {self.host}.")
 
-    def parse_event(self, event) -> None:
+    async def wait_scans(self) -> None:
         """
-        Filesystem event handler.
-        Figures out which library sections might be impacted, then schedules scans accordingly.
+        Waits until every submitted scan request has been sent.
         """
-        event_type = event.event_type
-
-        # Determine which path to use
-        if event_type != 'moved':
-            event_path = Path(event.src_path)
-        else:
-            event_path = Path(event.dest_path)
-
-        try:
-            # Check if the path still exists (might have been removed)
-            if not event_path.exists():
-                logging.debug(f"Path {event_path} no longer exists; ignoring event.")
-                return
-
-            # Gather the file/folder's last modified time
-            mtime = event_path.stat().st_mtime
-            if mtime < self.script_start_time:
-                # This means the file/folder was last modified before script started
-                logging.debug(f"Ignoring event on {event_path}, modified before script start.")
-                return
-
-            # If it's a file, get the parent folder
-            if not event.is_directory:
-                event_path = event_path.parent
-
-        except OSError as exc:
-            # Handle errors like WinError 1006 or other I/O issues
-            logging.warning(f"OSError accessing {event_path}: {exc}. Skipping this event.")
-            return
+        await self.__dispatcher.wait()
 
-        # If we get here, event_path is valid and recent
+    def queue_path(self, event_path: Path, event_type: str) -> bool:
+        """
+        Maps a checked folder to its library sections and queues the resulting scans.
+        Must be called from the service event loop.
+        :return: False if the folder does not belong to any section of this server.
+        """
         all_matches = self.find_sections_and_subpaths(event_path)
         if not all_matches:
-            logging.error(f"Could not find a matching Plex section for '{event_path}'")
-            return
+            return False
 
         for (section_title, subpath) in all_matches:
-            section_scan = (section_title, str(subpath))
-            if section_scan not in self.__notify_queue:
-                logging.info(
-                    f"Queueing scan (event: {event_type}) => {section_title}: '{subpath}'"
+            self.queue_scan(section_title, subpath, event_path, event_type)
+        return True
+
+    def queue_scan(self, section_title: str, subpath: Path, event_path: Path, event_type: str) -> None:
+        """
+        Queues the scan of a folder already resolved to one of the sections, e.g. by a shard worker.
+        Must be called from the service event loop.
+        """
+        self.__remember_local_root(event_path, section_title, subpath)
+        queued_key = self.__notify_queue.put(section_title, subpath)
+        if queued_key is not None:
+            logging.info(
+                f"Queueing scan on {self.host} (event: {event_type}) => {section_title}: '{subpath}'"
+            )
+            if self.__journal is not None:
+                # The scans absorbed later on by a collapsed ancestor are only journaled through it
+                self.__journal.record_queued(section_title, Path(*queued_key[1]))
+            self.__wake(self.__notify_queue.next_due_time())
+        self.__update_queue_metrics()
+
+    def __update_queue_metrics(self) -> None:
+        metrics.queue_depth.set(len(self.__notify_queue), self.host)
+        metrics.queue_max_depth.set(self.__notify_queue.max_depth, self.host)
+        metrics.parked_scans.set(self.__tracker.parked_count(), self.host)
+        metrics.circuit_open.set(int(self.__breaker.is_open), self.host)
+        collapsed = self.__notify_queue.collapsed + self.__tracker.collapsed
+        if collapsed > self.__collapsed:
+            if not self.__collapsed:
+                logging.warning(
+                    f"More than {shared.user_input.max_queued_scans} scans are pending for {self.host}, "
+                    f"new ones are collapsed into their parent folders"
                 )
-                self.__notify_queue.append(section_scan)
+            metrics.scans_collapsed.inc(self.host, amount=collapsed - self.__collapsed)
+            self.__collapsed = collapsed
 
-    def start_service(self) -> ():
+    def __on_alert(self, data: dict) -> None:
         """
-        Spawns a background thread that periodically checks the notify queue and processes scans.
-        Returns a callable to stop the thread.
+        Plex alert callback: a section whose refresh ended drains its parked scans at once.
         """
-        stopped = Event()
+        if data.get("type") != "activity":
+            return
+        for notification in data.get("ActivityNotification", []):
+            activity = notification.get("Activity", {})
+            if notification.get("event") != "ended" or activity.get("type") != "library.update.section":
+                continue
+            section_title = self.__section_titles.get(str(activity.get("Context", {}).get("librarySectionID")))
+            if section_title is not None and self.__tracker.wake(section_title):
+                logging.info(f"Section '{section_title}' of {self.host} finished refreshing, draining its parked scans")
+                self.__wake()
 
-        def loop():
-            while not stopped.wait(shared.user_input.interval):
-                # We'll iterate a snapshot of the current queue
-                current_queue_size = len(self.__notify_queue)
-                for _ in range(current_queue_size):
-                    section_title, subpath_str = self.__notify_queue.pop(0)
-                    success = self._scan_once(section_title, Path(subpath_str))
-                    if not success:
-                        # Section refreshing => re-queue this item, but continue to next item
-                        self.__notify_queue.append((section_title, str(subpath_str)))
-                    # If success, we do nothing more for that item
-                # Then we wait the next interval
+    def __on_alert_error(self, error: Exception) -> None:
+        logging.warning(f"Plex alert listener of {self.host} failed, falling back to polling: {error}")
 
-        Thread(target=loop).start()
-        return stopped.set
+    def __start_alert_listener(self, loop: asyncio.AbstractEventLoop):
+        """
+        Listens to Plex alerts if the optional websocket-client package is installed.
+        The alerts are received on the listener thread and handled on the service event loop.
+        :return: The listener, or None.
+        """
+        if importlib.util.find_spec("websocket") is None:
+            logging.debug("websocket-client is not installed, refreshing sections are polled with backoff")
+            return None
+        try:
+            return self.__server.startAlertListener(
+                partial(loop.call_soon_threadsafe, self.__on_alert), self.__on_alert_error
+            )
+        except Exception as e:
+            logging.warning(f"Could not listen to the alerts of {self.host}: {e}")
+            return None
 
+    def __next_wake_time(self) -> Optional[float]:
+        """
+        :return: The monotonic time of the next due scan, parked section check or circuit breaker probe, if any.
+        """
+        now = time.monotonic()
+        breaker_retry_at = self.__breaker.retry_at
+        # While the breaker is open, parked sections are not checked before its probe
+        retry_at = breaker_retry_at if breaker_retry_at is not None and breaker_retry_at > now \
+            else self.__tracker.next_retry()
+        return min((t for t in (retry_at, self.__notify_queue.next_due_time()) if t is not None), default=None)
+
+    def __wake(self, at: Optional[float] = None) -> None:
+        """
+        Makes the service task plan its timer again, only if it sleeps past the given monotonic time if one is given.
+        """
+        if self.__wakeup is None:
+            return  # No service task, e.g. a manual scan
+        if at is None or self.__sleep_until is None or at < self.__sleep_until:
+            self.__wakeup.set()
+
+    async def __serve(self) -> None:
+        while True:
+            # A single timer, set to the earliest due time, however many scans are pending
+            self.__sleep_until = self.__next_wake_time()
+            timeout = max(0.0, self.__sleep_until - time.monotonic()) if self.__sleep_until is not None else None
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.__wakeup.clear()
+            # Scans falling due together are processed as a single batch,
+            # along with the parked scans of the sections due for a check
+            pending = self.__notify_queue.pop_due(time.monotonic())
+            if self.__breaker.allow():
+                pending.extend(self.__tracker.take_due())
+            elif pending:
+                # Plex is unreachable: hold the new scans back until the breaker lets a probe through
+                grouped: dict[str, list[QueuedScan]] = {}
+                for queued_scan in pending:
+                    grouped.setdefault(queued_scan[0], []).append(queued_scan)
+                for section_title, section_scans in grouped.items():
+                    self.__tracker.park(section_title, section_scans, FAILING, retry_at=self.__breaker.retry_at)
+                pending = []
+            if pending:
+                try:
+                    await self._scan_batch(pending)
+                except Exception as e:
+                    logging.error(f"Failed to process a batch of {len(pending)} scans for {self.host}: {e}")
+            self.__update_queue_metrics()
 
-plex_agent_singleton = PlexAgent()
+    async def start_service(self) -> None:
+        """
+        Starts a task of the running event loop that processes queued scans as soon as they are due:
+        once their path has been quiet for --quiet-period seconds, or --interval seconds
+        after their first event at the latest. See stop_service().
+        """
+        self.__notify_queue = ScanQueue(
+            shared.user_input.quiet_period, shared.user_input.interval, shared.user_input.max_queued_scans
+        )
+        if self.__journal_path is not None:
+            self.__journal = ScanJournal(self.__journal_path)
+            leftover_scans = self.__journal.replay()
+            if leftover_scans:
+                logging.info(f"Re-queueing {len(leftover_scans)} scans for {self.host} left over by the previous run")
+            for section_title, subpath in leftover_scans:
+                queued_key = self.__notify_queue.put(section_title, subpath)
+                if queued_key is not None and queued_key != to_key(section_title, subpath.parts):
+                    # Collapsed into an ancestor, which must be journaled as well
+                    self.__journal.record_queued(section_title, Path(*queued_key[1]))
+            self.__journal.start()
+        loop = asyncio.get_running_loop()
+        self.__alert_listener = self.__start_alert_listener(loop)
+        self.__wakeup = asyncio.Event()
+        self.__service = loop.create_task(self.__serve(), name=f"scan-service-{self.host}")
+
+    async def stop_service(self) -> None:
+        """
+        Cancels the service task: the scans not sent yet are dropped, the journal keeps them for the next run.
+        Requests already in flight are waited for.
+        """
+        self.__service.cancel()
+        await asyncio.gather(self.__service, return_exceptions=True)
+        if self.__alert_listener is not None:
+            self.__alert_listener.stop()
+        await self.__dispatcher.shutdown()
+        if self.__journal is not None:
+            # Flushes the last records
+            await asyncio.get_running_loop().run_in_executor(None, self.__journal.stop)
@@ -0,0 +1,383 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+from .dir_stat_cache import DirStatCache
+from .quick_scan import QuickScanner
+from ..config import shared
+from ..metrics import metrics
+
+if TYPE_CHECKING:
+    from .plex_agent import PlexAgent
+    from ..watchdog.shards import ShardRecord
+
+
+class PlexAgentGroup:
+    """
+    Every Plex server fed by this process, e.g. a main server and a 4K server over the same share.
+
+    Filesystem events are checked once for all of them, then each checked folder is fanned out
+    to one PlexAgent per server, which maps it with its own library folders and queues the
+    resulting scans with its own queue, dispatcher and journal.
+
+    In daemon mode the agents run on the service event loop passed to start_service(): the methods
+    meant for other threads (parse_event, queue_paths_threadsafe, submit_scans) hand their work over to it.
+    """
+
+    def __init__(self):
+        # One {"host": ..., "token": ...} per server
+        self.__servers: list[dict[str, str]] = []
+        self.__save_cache: bool = False
+        self.agents: list["PlexAgent"] = []
+        self.script_start_time: float = 0.0
+        # Disabled until set_stat_cache_ttl()
+        self.__dir_cache = DirStatCache(0.0)
+        self.__loop: Optional[asyncio.AbstractEventLoop] = None
+        self.__library_refresh: Optional[asyncio.Task] = None
+
+    def set_script_start_time(self, t: float):
+        self.script_start_time = t
+
+    def set_stat_cache_ttl(self, ttl: float):
+        self.__dir_cache = DirStatCache(ttl)
+
+    def is_cache_loaded(self) -> bool:
+        """
+        Checks if the Plex configuration is set.
+        :return: True if the Plex configuration is set, False otherwise.
+        """
+        return bool(self.__servers)
+
+    def load_config_cache(self) -> None:
+        """
+        Loads the Plex configuration from the cache.
+        A single server is cached as {"host": ..., "token": ...}, several as {"servers": [...]}.
+        """
+        try:
+            logging.info(f"Found Plex configuration from cache: {shared.cache_path}")
+            with open(shared.cache_path, "r") as cache_file:
+                plex_config = json.load(cache_file)
+            self.__servers = plex_config["servers"] if "servers" in plex_config else [plex_config]
+        except OSError as e:
+            logging.error(f"Could not load Plex configuration from cache: {e}")
+            exit(-1)
+
+    def __save_config_cache(self) -> None:
+        """
+        Saves the Plex configuration to the cache.
+        """
+        try:
+            logging.info(f"Saving Plex configuration to cache: {shared.cache_path}")
+            if not shared.cache_path.parent.exists():
+                shared.cache_path.parent.mkdir(parents=True)
+            with open(shared.cache_path, "w") as cache_file:
+                # Keep the single server format readable by older versions
+                json.dump(self.__servers[0] if len(self.__servers) == 1 else {"servers": self.__servers}, cache_file)
+        except OSError as e:
+            logging.error(f"Could not save Plex configuration to cache: {e}")
+            exit(-1)
+
+    def __eval_config(self) -> None:
+        """
+        Ensures that hosts and tokens are available either from CLI or cache.
+        A single --token is used for every --host.
+        """
+        if not shared.user_input.token:
+            return
+        tokens = shared.user_input.token * len(shared.user_input.host) \
+            if len(shared.user_input.token) == 1 else shared.user_input.token
+        cli_servers = [{"host": host, "token": token} for host, token in zip(shared.user_input.host, tokens)]
+        if not self.__servers:
+            self.__servers = cli_servers
+            self.__save_cache = True
+        elif self.__servers != cli_servers:
+            logging.warning("Plex hosts and/or tokens differ from the cached ones!")
+            while True:
+                answer: str = input("Do you want to overwrite the cached configuration? [y/N]: ").lower()
+                if answer == 'y':
+                    self.__servers = cli_servers
+                    self.__save_cache = True
+                    break
+                elif answer == 'n':
+                    break
+
+    def __server_path(self, path: Path, host: str) -> Path:
+        """
+        :return: The path of a per server file, suffixed with a hash of the host when there are several servers.
+        """
+        if len(self.__servers) == 1:
+            return path
+        return path.with_name(f"{path.stem}-{hashlib.sha1(host.encode()).hexdigest()[:8]}{path.suffix}")
+
+    def __journal_path(self, host: str) -> Optional[Path]:
+        if shared.user_input.no_journal:
+            return None
+        return self.__server_path(shared.journal_path, host)
+
+    def connect(self) -> None:
+        """
+        Connects to every Plex server using the stored or user-provided hosts/tokens.
+        """
+        # plexapi is only needed from here on, --scan does without it
+        from .plex_agent import PlexAgent
+
+        self.__eval_config()
+        self.agents = [
+            PlexAgent(
+                server["host"], server["token"], self.__journal_path(server["host"]),
+                self.__server_path(shared.sections_cache_path, server["host"])
+            )
+            for server in self.__servers
+        ]
+        for agent in self.agents:
+            try:
+                agent.connect()
+            except Exception as e:
+                logging.error(f"Unable to connect to Plex server {agent.host}:\n{e}")
+                exit(-1)
+        if self.__save_cache:
+            self.__save_config_cache()
+
+    def get_all_library_paths(self) -> set[Path]:
+        """
+        Returns a set of all library folder paths from every section of every server.
+        """
+        return set().union(*(agent.get_all_library_paths() for agent in self.agents))
+
+    def is_library_path(self, item: Path) -> bool:
+        """
+        :return: True if the path belongs to a library section of at least one server.
+        """
+        return any(agent.find_sections_and_subpaths(item) for agent in self.agents)
+
+    def quick_scan(self, paths: Optional[set[Path]]) -> None:
+        """
+        For manual (user-initiated) scans, sent without connecting the agents, see QuickScanner.
+        Every section is scanned if paths is None.
+        """
+        self.__eval_config()
+        if self.__save_cache:
+            self.__save_config_cache()
+        matched = set()
+        failed = False
+        for server in self.__servers:
+            scanner = QuickScanner(
+                server["host"], server["token"], self.__server_path(shared.sections_cache_path, server["host"]),
+                shared.user_input.sections_ttl
+            )
+            try:
+                matched |= scanner.scan(paths)
+            except Exception as e:
+                logging.error(f"Could not request the scans from Plex server {server['host']}: {e}")
+                failed = True
+        for given_path in sorted((paths or set()) - matched):
+            logging.error(f"Could not map '{given_path}' to any known Plex section.")
+        if failed:
+            exit(-1)
+
+    def manual_scan(self, paths: set[Path]) -> None:
+        """
+        For manual (user-initiated) scans, on every server the paths belong to.
+        Returns once every scan request has been sent.
+        """
+        for given_path in paths:
+            logging.info(f"Analyzing '{given_path}' for manual scan.")
+            if not self.is_library_path(given_path):
+                logging.error(f"Could not map '{given_path}' to any known Plex section.")
+        asyncio.run(self.__manual_scan(paths))
+
+    async def __manual_scan(self, paths: set[Path]) -> None:
+        await asyncio.gather(*(agent.manual_scan(paths) for agent in self.agents))
+        await asyncio.gather(*(agent.wait_scans() for agent in self.agents))
+
+    def parse_event(self, event) -> None:
+        """
+        Filesystem event handler, from any thread.
+        Figures out which library sections might be impacted, then schedules scans accordingly.
+        """
+        folders = []
+        for event_type, event_path in self.get_event_paths(event):
+            folder = self.check_event_path(event_type, event_path, event.is_directory)
+            if folder is not None:
+                folders.append((folder, event_type))
+        if folders:
+            self.queue_paths_threadsafe(folders)
+
+    @staticmethod
+    def get_event_paths(event) -> list[tuple[str, str]]:
+        """
+        Returns the (event_type, path) pairs to check for an event: a move is checked at its destination,
+        and at its source as a deletion, so that Plex also notices what left the source folder.
+        """
+        if event.event_type == 'moved':
+            return [('moved', event.dest_path), ('deleted', event.src_path)]
+        return [(event.event_type, event.src_path)]
+
+    def check_event_path(self, event_type: str, event_path: str, is_directory: bool) -> Optional[str]:
+        """
+        Checks that an event path still exists and changed after the script started, through the folder
+        metadata cache: events in a folder already found changed are accepted without touching the filesystem.
+        A deleted path resolves to its nearest existing ancestor instead.
+        Paths stay plain strings, no Path object is built per event.
+        This may touch the filesystem, so it may block on slow network mounts.
+        :return: The folder to scan for the event, or None if the event should be ignored.
+        """
+        try:
+            if event_type == "deleted":
+                return self.__check_deleted_path(event_path, is_directory)
+
+            folder = event_path if is_directory else os.path.dirname(event_path)
+            if is_directory and event_type in ("created", "moved"):
+                # Whatever was cached under this name is gone
+                self.__dir_cache.invalidate(folder, subtree=True)
+            entry = self.__dir_cache.get(folder)
+            if entry is None or not entry.changed:
+                if is_directory:
+                    entry = self.__dir_cache.stat(folder, self.script_start_time)
+                    mtime = entry.mtime if entry is not None else None
+                else:
+                    mtime = self.__stat_file(event_path)
+                if mtime is None:
+                    logging.debug(f"Path {event_path} no longer exists; ignoring event.")
+                    metrics.events_filtered.inc("missing")
+                    return None
+                if mtime < self.script_start_time:
+                    # This means the file/folder was last modified before script started
+                    logging.debug(f"Ignoring event on {event_path}, modified before script start.")
+                    metrics.events_filtered.inc("before_start")
+                    return None
+                if not is_directory:
+                    # The folder will be scanned, the next events inside it don't need a check
+                    self.__dir_cache.put(folder, None, True)
+
+        except OSError as exc:
+            # Handle errors like WinError 1006 or other I/O issues
+            logging.warning(f"OSError accessing {event_path}: {exc}. Skipping this event.")
+            metrics.events_filtered.inc("os_error")
+            return None
+
+        return folder
+
+    @staticmethod
+    def __stat_file(path: str) -> Optional[float]:
+        try:
+            return os.stat(path).st_mtime
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def __check_deleted_path(self, event_path: str, is_directory: bool) -> Optional[str]:
+        """
+        A deleted or moved out path can't be checked anymore: the folder to scan is its nearest existing ancestor,
+        which changed when the path was removed.
+        """
+        if is_directory:
+            self.__dir_cache.invalidate(event_path, subtree=True)
+        folder = self.__dir_cache.nearest_existing(event_path, self.script_start_time)
+        if folder is None:
+            metrics.events_filtered.inc("missing")
+        return folder
+
+    def queue_path(self, event_path: Path, event_type: str) -> None:
+        """
+        Fans a checked folder out to every server, each one queueing the scans of its matching sections.
+        Must be called from the service event loop.
+        """
+        matched = [agent.queue_path(event_path, event_type) for agent in self.agents]
+        if not any(matched):
+            logging.error(f"Could not find a matching Plex section for '{event_path}'")
+            metrics.events_filtered.inc("no_section")
+
+    def __queue_paths(self, folders: list[tuple[str, str]]) -> None:
+        for event_path, event_type in folders:
+            self.queue_path(Path(event_path), event_type)
+
+    def queue_paths_threadsafe(self, folders: list[tuple[str, str]]) -> None:
+        """
+        Hands checked (folder, event_type) pairs, as returned by check_event_path(), over to the service
+        event loop, from any thread, with a single loop wakeup for the whole list.
+        """
+        self.__loop.call_soon_threadsafe(self.__queue_paths, folders)
+
+    def __queue_resolved(self, records: list["ShardRecord"]) -> None:
+        for agent_index, section_title, subpath, event_path, event_type in records:
+            self.agents[agent_index].queue_scan(section_title, Path(subpath), Path(event_path), event_type)
+
+    def queue_resolved_threadsafe(self, records: list["ShardRecord"]) -> None:
+        """
+        Hands scans already resolved by a shard worker over to the service event loop, from any thread.
+        """
+        self.__loop.call_soon_threadsafe(self.__queue_resolved, records)
+
+    def submit_scans(self, paths: Optional[list[Path]]) -> tuple[int, list[Path]]:
+        """
+        Queues folders submitted by a --via-daemon client like checked event folders, so they share
+        the deduplication, batching and retries of the watched events. Every section is queued if paths is None.
+        Called from the control socket threads, it waits for the service event loop to queue them.
+        :return: The number of queued folders, and the folders that don't belong to any section.
+        """
+        return asyncio.run_coroutine_threadsafe(self.__submit_scans(paths), self.__loop).result()
+
+    async def __submit_scans(self, paths: Optional[list[Path]]) -> tuple[int, list[Path]]:
+        if paths is None:
+            paths = sorted(self.get_all_library_paths())
+        unmatched = []
+        for folder in paths:
+            if not any([agent.queue_path(folder, "manual") for agent in self.agents]):
+                logging.error(f"Could not map '{folder}' to any known Plex section.")
+                unmatched.append(folder)
+        return len(paths) - len(unmatched), unmatched
+
+    async def refresh_libraries(self) -> bool:
+        """
+        Refreshes the folder mappings of every server.
+        :return: True if the mappings of at least one server changed.
+        """
+        changed = False
+        for agent in self.agents:
+            try:
+                changed = await agent.refresh_library() or changed
+            except Exception as e:
+                logging.warning(f"Could not refresh the library folders of {agent.host}: {e}")
+        return changed
+
+    async def __refresh_loop(self, interval: float, on_change: Callable[[], None]) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if await self.refresh_libraries():
+                try:
+                    # Updating the watches walks the new library folders
+                    await self.__loop.run_in_executor(None, on_change)
+                except Exception as e:
+                    logging.error(f"Could not update the watches after a library change: {e}")
+
+    def start_library_refresh(self, interval: float, on_change: Callable[[], None]) -> None:
+        """
+        Starts a task of the service event loop refreshing the folder mappings every interval seconds,
+        calling on_change on a worker thread after a refresh changed them. Stopped by stop_service().
+        """
+        self.__library_refresh = self.__loop.create_task(self.__refresh_loop(interval, on_change))
+
+    async def start_service(self) -> None:
+        """
+        Starts the scan service of every server on the running event loop, see stop_service().
+        """
+        self.__loop = asyncio.get_running_loop()
+        for agent in self.agents:
+            await agent.start_service()
+
+    async def stop_service(self) -> None:
+        """
+        Stops the library refresh and the scan service of every server.
+        """
+        if self.__library_refresh is not None:
+            self.__library_refresh.cancel()
+            await asyncio.gather(self.__library_refresh, return_exceptions=True)
+        await asyncio.gather(*(agent.stop_service() for agent in self.agents))
+
+
+plex_agents = PlexAgentGroup()
@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import time
+import xml.etree.ElementTree as ElementTree
+from pathlib import Path
+from typing import Iterable, Optional
+from urllib.error import HTTPError
+from urllib.parse import quote_plus
+from urllib.request import Request, urlopen
+
+from .path_index import LibraryPathIndex
+from ..config import shared
+
+# Seconds before a request to Plex is given up, like plexapi's default
+REQUEST_TIMEOUT: float = 30.0
+
+# (section title, remote path, or None to refresh the whole section)
+RefreshRequest = tuple[str, Optional[str]]
+
+
+def save_sections_cache(cache_path: Path, host: str, sections: list[dict]) -> None:
+    """
+    Atomically writes the sections of a server: {"host": ..., "fetched_at": ..., "sections": [...]},
+    each section being {"key": ..., "title": ..., "locations": [remote_path, ...], "refreshing": ...}.
+    """
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+        with open(tmp_path, "w") as cache_file:
+            json.dump({"host": host, "fetched_at": time.time(), "sections": sections}, cache_file)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logging.warning(f"Could not save the library sections cache {cache_path}: {e}")
+
+
+def load_sections_cache(cache_path: Path, host: str, ttl: float) -> Optional[list[dict]]:
+    """
+    :return: The cached sections of the server, or None if they are missing or older than ttl seconds.
+    """
+    try:
+        with open(cache_path, "r") as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if cached.get("host") != host or time.time() - cached.get("fetched_at", 0) > ttl:
+        return None
+    return cached["sections"]
+
+
+class QuickScanner:
+    """
+    Sends the partial-scans of a manual --scan to a Plex server with the standard library only.
+
+    --scan runs from post-processing hooks thousands of times a day, so it skips plexapi and
+    the connection checks: the sections are read from a cache refreshed every ttl seconds, then
+    every scan is a single refresh request addressed by section key. The cache is fetched again
+    once if a section disappeared since it was written, or if none of the paths matched it.
+    The scans of a section being refreshed are skipped, like before the cache: as the cached refreshing
+    state may be outdated, the sections are fetched again first to check it.
+    """
+
+    def __init__(self, host: str, token: str, cache_path: Path, ttl: float):
+        self.host = host
+        self.__token = token
+        self.__cache_path = cache_path
+        self.__ttl = ttl
+        # Section title => key, and the folder mappings, as built by PlexAgent
+        self.__keys: dict[str, str] = {}
+        self.__refreshing: set[str] = set()
+        self.__internal_paths: dict[str, list[tuple[str, str]]] = {}
+        self.__path_index = LibraryPathIndex({})
+
+    def __get(self, path: str) -> bytes:
+        request = Request(self.host.rstrip("/") + path, headers={"X-Plex-Token": self.__token, "Accept": "application/xml"})
+        with urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+            return response.read()
+
+    def __fetch_sections(self) -> list[dict]:
+        container = ElementTree.fromstring(self.__get("/library/sections"))
+        return [
+            {
+                "key": directory.get("key"), "title": directory.get("title"),
+                "locations": [location.get("path") for location in directory.iter("Location")],
+                "refreshing": directory.get("refreshing") in ("1", "true")
+            }
+            for directory in container.iter("Directory")
+        ]
+
+    def __load_sections(self, refresh: bool) -> bool:
+        """
+        :return: True if the sections were read from the cache.
+        """
+        sections = None if refresh else load_sections_cache(self.__cache_path, self.host, self.__ttl)
+        from_cache = sections is not None
+        if not from_cache:
+            logging.debug(f"Fetching the library sections of {self.host}")
+            sections = self.__fetch_sections()
+            save_sections_cache(self.__cache_path, self.host, sections)
+        self.__keys = {section["title"]: section["key"] for section in sections}
+        # Missing from the caches written by older versions
+        self.__refreshing = {section["title"] for section in sections if section.get("refreshing")}
+        self.__internal_paths = {}
+        for section in sections:
+            folders = self.__internal_paths.setdefault(section["title"], [])
+            folders.extend((Path(remote_path).name, remote_path) for remote_path in section["locations"])
+        self.__path_index = LibraryPathIndex(self.__internal_paths)
+        return from_cache
+
+    def __refresh_requests(self, paths: Optional[Iterable[Path]]) -> tuple[dict[RefreshRequest, None], set[Path]]:
+        """
+        :return: The refresh requests to send, in order, and the given paths that matched a section.
+        """
+        requests: dict[RefreshRequest, None] = {}
+        matched = set()
+        if paths is None:
+            return {(section_title, None): None for section_title in self.__internal_paths}, matched
+        for given_path in paths:
+            for section_title, subpath in self.__path_index.resolve(given_path):
+                matched.add(given_path)
+                if not subpath.parts:
+                    requests[(section_title, None)] = None
+                    continue
+                for _, remote_path in self.__internal_paths[section_title]:
+                    requests[(section_title, str(Path(remote_path) / subpath))] = None
+        # A whole section refresh covers its partial-scans
+        return {
+            (section_title, remote_path): None for section_title, remote_path in requests
+            if remote_path is None or (section_title, None) not in requests
+        }, matched
+
+    def __send(self, section_title: str, remote_path: Optional[str]) -> None:
+        if remote_path is None:
+            logging.info(f"Requesting {self.host} to scan the whole section '{section_title}'")
+        else:
+            logging.info(f"Requesting {self.host} to scan path '{remote_path}' in section '{section_title}'")
+        if shared.user_input.dry_run:
+            logging.info("Skipping Plex scan (dry-run mode)")
+            return
+        query = f"?path={quote_plus(remote_path)}" if remote_path is not None else ""
+        self.__get(f"/library/sections/{self.__keys[section_title]}/refresh{query}")
+
+    def __skip_refreshing(self, requests: Iterable[RefreshRequest]) -> list[RefreshRequest]:
+        skipped = set()
+        pending = []
+        for section_title, remote_path in requests:
+            if section_title not in self.__refreshing:
+                pending.append((section_title, remote_path))
+            elif section_title not in skipped:
+                logging.warning(f"Section '{section_title}' of {self.host} is currently refreshing; skipping scan.")
+                skipped.add(section_title)
+        return pending
+
+    def scan(self, paths: Optional[set[Path]]) -> set[Path]:
+        """
+        Requests a partial-scan of every path, or a refresh of every section if paths is None.
+        :return: The paths that matched a section of this server.
+        """
+        refreshed = not self.__load_sections(refresh=False)
+        requests, matched = self.__refresh_requests(paths)
+        if paths and not matched and not refreshed:
+            # Maybe a library folder added since the cache was written
+            self.__load_sections(refresh=True)
+            refreshed = True
+            requests, matched = self.__refresh_requests(paths)
+        if not refreshed and any(section_title in self.__refreshing for section_title, _ in requests):
+            # The refresh may have ended since the cache was written
+            self.__load_sections(refresh=True)
+            refreshed = True
+            requests, matched = self.__refresh_requests(paths)
+        pending = self.__skip_refreshing(requests)
+        sent = set()
+        while pending:
+            request = pending.pop(0)
+            try:
+                self.__send(*request)
+            except HTTPError as e:
+                if e.code != 404 or refreshed:
+                    raise
+                # The section was removed or re-created since the cache was written
+                logging.info(f"Library sections of {self.host} changed, refreshing them")
+                self.__load_sections(refresh=True)
+                refreshed = True
+                requests, matched = self.__refresh_requests(paths)
+                pending = [request for request in self.__skip_refreshing(requests) if request not in sent]
+                continue
+            sent.add(request)
+        return matched
@@ -0,0 +1,201 @@
+import random
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from .scan_queue import QueuedScan
+
+IDLE = "idle"
+REFRESHING = "refreshing"
+FAILING = "failing"
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Exponential backoff with jitter: base_delay doubled on every attempt up to max_delay,
+    then randomly shortened by up to half, so retries of many sections don't line up.
+    The exponent is capped, a float overflows past 2 ** 1023 during a long outage.
+    """
+    return min(max_delay, base_delay * 2 ** min(attempt, 32)) * random.uniform(0.5, 1.0)
+
+
+class _SectionState:
+    __slots__ = ("state", "attempts", "retry_at", "parked")
+
+    def __init__(self):
+        self.state = IDLE
+        self.attempts = 0
+        self.retry_at = 0.0
+        # subpath parts => (subpath, first_seen)
+        self.parked: dict[tuple[str, ...], tuple[Path, float]] = {}
+
+
+class SectionTracker:
+    """
+    Per-section retry state machine of a Plex server.
+
+    A section found refreshing, or whose partial-scan failed, moves to the 'refreshing' or 'failing'
+    state and its scans are parked. It is checked again once its backoff delay is over, the delay
+    doubling with every unsuccessful check. When a check finds it idle, all its parked scans are
+    drained together as a single batch. wake() makes a parked section due at once, e.g. when Plex
+    notifies that its refresh ended. Like the scan queue, it is only touched from the service event loop.
+
+    With max_parked set, parking more scans than that, e.g. while Plex is unreachable during an import storm,
+    collapses the deepest parked scans of the section into their parent folders, like a full scan queue.
+    """
+
+    def __init__(self, base_delay: float, max_delay: float, max_parked: int = 0):
+        self.__base_delay = base_delay
+        self.__max_delay = max_delay
+        self.__max_parked = max_parked
+        self.__sections: dict[str, _SectionState] = {}
+        self.__collapsed = 0
+
+    @property
+    def collapsed(self) -> int:
+        """
+        Number of parked scans merged into their parent folder because too many were parked, since creation.
+        """
+        return self.__collapsed
+
+    def park(self, section_title: str, scans: Iterable[QueuedScan], state: str,
+             retry_at: Optional[float] = None) -> float:
+        """
+        Parks scans of a section and schedules its next check with backoff, or at retry_at if given.
+        :return: The delay before the next check.
+        """
+        section = self.__sections.setdefault(section_title, _SectionState())
+        for _, subpath, first_seen in scans:
+            parked = section.parked.get(subpath.parts)
+            section.parked[subpath.parts] = (subpath, min(first_seen, parked[1]) if parked else first_seen)
+        if self.__max_parked and self.parked_count() > self.__max_parked:
+            self.__collapse(section)
+        now = time.monotonic()
+        # Scans failing while the section already waits for its next check join the same check
+        waiting = section.state != IDLE and section.retry_at > now
+        if retry_at is None and not waiting:
+            retry_at = now + backoff_delay(section.attempts, self.__base_delay, self.__max_delay)
+            section.attempts += 1
+        section.state = state
+        if retry_at is not None:
+            section.retry_at = max(section.retry_at, retry_at) if waiting else retry_at
+        return section.retry_at - now
+
+    def __collapse(self, section: _SectionState) -> None:
+        """
+        Moves the deepest parked scans of a section up to their parent folder, the largest groups of siblings
+        first, until the tracker is back 10% under max_parked, so that the next scans parked don't walk the
+        section again, or the section has nothing left to collapse.
+        """
+        excess = self.parked_count() - (self.__max_parked - self.__max_parked // 10)
+        while excess > 0:
+            depth = max(len(parts) for parts in section.parked)
+            if not depth:
+                return
+            siblings: dict[tuple[str, ...], list[tuple[str, ...]]] = {}
+            for parts in section.parked:
+                if len(parts) == depth:
+                    siblings.setdefault(parts[:-1], []).append(parts)
+            for parent, children in sorted(siblings.items(), key=lambda item: -len(item[1])):
+                subpath = section.parked[children[0]][0].parent
+                first_seen = min(section.parked.pop(parts)[1] for parts in children)
+                parked = section.parked.get(parent)
+                section.parked[parent] = (subpath, min(first_seen, parked[1]) if parked else first_seen)
+                self.__collapsed += len(children)
+                excess -= len(children) - (0 if parked else 1)
+                if excess <= 0:
+                    return
+
+    def settle(self, section_title: str) -> None:
+        """
+        Back to the idle state, once the section accepted a scan or was found idle.
+        """
+        section = self.__sections.get(section_title)
+        if section is not None and not section.parked:
+            del self.__sections[section_title]
+        elif section is not None:
+            section.state = IDLE
+            section.attempts = 0
+
+    def state(self, section_title: str) -> str:
+        section = self.__sections.get(section_title)
+        return section.state if section is not None else IDLE
+
+    def wake(self, section_title: str) -> bool:
+        """
+        Makes a parked section due for a check at once.
+        :return: True if the section had parked scans.
+        """
+        section = self.__sections.get(section_title)
+        if section is None or not section.parked:
+            return False
+        section.retry_at = 0.0
+        return True
+
+    def take_due(self) -> list[QueuedScan]:
+        """
+        :return: The parked scans of every section due for a check, removed from the parked ones.
+        """
+        now = time.monotonic()
+        due = []
+        for section_title, section in self.__sections.items():
+            if section.parked and section.retry_at <= now:
+                due.extend((section_title, subpath, first_seen) for subpath, first_seen in section.parked.values())
+                section.parked = {}
+        return due
+
+    def next_retry(self) -> Optional[float]:
+        """
+        :return: The monotonic time of the earliest check of a parked section, if any.
+        """
+        return min((section.retry_at for section in self.__sections.values() if section.parked), default=None)
+
+    def parked_count(self) -> int:
+        return sum(len(section.parked) for section in self.__sections.values())
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an unreachable Plex server.
+
+    Closed, requests go through. After THRESHOLD consecutive failures it opens: nothing is sent
+    until its backoff delay is over. It is then half-open: the next batch is sent as a probe, and
+    closes the breaker if it succeeds, or opens it again for a doubled delay if it fails.
+    """
+
+    THRESHOLD: int = 3
+
+    def __init__(self, base_delay: float, max_delay: float):
+        self.__base_delay = base_delay
+        self.__max_delay = max_delay
+        self.__failures = 0
+        self.__opened = 0
+        self.retry_at: Optional[float] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.retry_at is not None
+
+    def allow(self) -> bool:
+        """
+        :return: True if requests may be sent: the breaker is closed, or half-open for a probe.
+        """
+        return self.retry_at is None or time.monotonic() >= self.retry_at
+
+    def record_success(self) -> None:
+        self.__failures = 0
+        self.__opened = 0
+        self.retry_at = None
+
+    def record_failure(self) -> bool:
+        """
+        :return: True if this failure opened the breaker.
+        """
+        self.__failures += 1
+        if self.__failures < self.THRESHOLD:
+            return False
+        if self.retry_at is not None and time.monotonic() < self.retry_at:
+            return False  # Already open, a late failure of a request sent before it opened
+        self.retry_at = time.monotonic() + backoff_delay(self.__opened, self.__base_delay, self.__max_delay)
+        self.__opened += 1
+        return True
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class RateLimiter:
+    """
+    Token bucket shared by all dispatcher lanes, allowing at most max_rps requests per second.
+    A max_rps of 0 disables the limit.
+    """
+
+    def __init__(self, max_rps: float):
+        self.__interval = 1.0 / max_rps if max_rps > 0 else 0.0
+        self.__next_slot = time.monotonic()
+
+    async def acquire(self) -> None:
+        """
+        Waits until the caller is allowed to send its next request.
+        """
+        if not self.__interval:
+            return
+        now = time.monotonic()
+        slot = max(self.__next_slot, now)
+        self.__next_slot = slot + self.__interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class ScanDispatcher:
+    """
+    Runs scan requests from the service event loop.
+
+    Requests are coroutines submitted to a lane (the Plex section title): lanes run concurrently as
+    loop tasks, but the requests of a lane are always sent one at a time, in submission order.
+    The blocking Plex calls of the requests go through run_blocking(), on a bounded thread pool,
+    so that at most `workers` of them are in flight whatever the number of busy lanes.
+    """
+
+    def __init__(self, workers: int, max_rps: float):
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="plex-scan")
+        self.__limiter = RateLimiter(max_rps)
+        self.__lanes: dict[str, deque[Callable[[], Awaitable[None]]]] = {}
+        self.__runners: set[asyncio.Task] = set()
+
+    async def run_blocking(self, function: Callable[..., T], *args: Any) -> T:
+        """
+        Runs a blocking call, typically a plexapi request, on the worker pool.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, partial(function, *args))
+
+    def submit(self, lane: str, request: Callable[[], Awaitable[None]]) -> None:
+        """
+        Queues a request at the end of the given lane, starting a lane runner if it is idle.
+        Must be called from the event loop.
+        """
+        if lane in self.__lanes:
+            self.__lanes[lane].append(request)
+            return
+        self.__lanes[lane] = deque([request])
+        runner = asyncio.get_running_loop().create_task(self.__run_lane(lane))
+        self.__runners.add(runner)
+        runner.add_done_callback(self.__runners.discard)
+
+    async def __run_lane(self, lane: str) -> None:
+        pending = self.__lanes[lane]
+        try:
+            while pending:
+                request = pending.popleft()
+                await self.__limiter.acquire()
+                try:
+                    await request()
+                except Exception as e:
+                    logging.error(f"Scan request for section '{lane}' failed: {e}")
+        finally:
+            del self.__lanes[lane]
+
+    async def wait(self) -> None:
+        """
+        Waits until every submitted request has been sent.
+        """
+        while self.__runners:
+            await asyncio.gather(*self.__runners, return_exceptions=True)
+
+    async def shutdown(self) -> None:
+        """
+        Drops the requests that have not started yet, waits for the ones in flight and stops the workers.
+        """
+        for pending in self.__lanes.values():
+            pending.clear()
+        await self.wait()
+        self.__executor.shutdown(wait=True)
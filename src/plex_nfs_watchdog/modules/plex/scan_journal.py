@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Iterator
+
+from .scan_queue import ScanKey, to_key
+
+QUEUED = "+"
+DONE = "-"
+
+
+class _OutstandingScans:
+    """
+    The scans queued but not completed yet, in queueing order, with the sequence number of their record.
+    Like in ScanQueue, every ancestor prefix of a scan is mapped to the scans below it, so that settling
+    a scan only looks at the scans below it.
+    """
+
+    def __init__(self):
+        self.__keys: dict[ScanKey, int] = {}
+        self.__descendants: dict[ScanKey, set[ScanKey]] = {}
+
+    def __len__(self) -> int:
+        return len(self.__keys)
+
+    def __iter__(self) -> Iterator[tuple[ScanKey, int]]:
+        return iter(self.__keys.items())
+
+    def add(self, key: ScanKey, seq: int) -> None:
+        if key in self.__keys:
+            # Queued again: a completed scan sent before this record doesn't cover it
+            self.__keys[key] = seq
+            return
+        self.__keys[key] = seq
+        section_title, parts = key
+        for depth in range(len(parts)):
+            self.__descendants.setdefault((section_title, parts[:depth]), set()).add(key)
+
+    def settle(self, key: ScanKey, checkpoint: int) -> None:
+        """
+        Removes a completed scan and the scans below it, among the ones recorded up to checkpoint:
+        the scans queued after the completed one was sent may have been missed by Plex.
+        """
+        settled = [other for other in self.__descendants.get(key, ()) if self.__keys[other] <= checkpoint]
+        if self.__keys.get(key, checkpoint + 1) <= checkpoint:
+            settled.append(key)
+        for other in settled:
+            del self.__keys[other]
+            section_title, parts = other
+            for depth in range(len(parts)):
+                prefix = (section_title, parts[:depth])
+                below = self.__descendants[prefix]
+                below.discard(other)
+                if not below:
+                    del self.__descendants[prefix]
+
+
+class ScanJournal:
+    """
+    Append-only, crash-safe journal of the scans queued and completed by the daemon.
+
+    Every line is a compact JSON array: ["+", section_title, subpath, seq] when a scan is queued,
+    with seq the sequence number of the record, and ["-", section_title, subpath, checkpoint] once
+    it has been sent to Plex. A completed scan also settles the queued scans below it, since the queue
+    coalesces them into their ancestor, but only the ones recorded up to the checkpoint taken before
+    it was sent: a scan queued below it while it was in flight is still outstanding.
+    Records are buffered and written by a background thread every flush_interval seconds,
+    with a single fsync per flush, so journaling never slows down event ingestion.
+    Once the file holds far more lines than outstanding scans, it is compacted by atomically
+    replacing it with the outstanding scans only.
+    """
+
+    def __init__(self, path: Path, flush_interval: float = 1.0, compact_threshold: int = 10000):
+        self.__path = path
+        self.__flush_interval = flush_interval
+        self.__compact_threshold = compact_threshold
+        self.__buffer: list[tuple[str, str, str, int]] = []
+        self.__lock = Lock()
+        self.__outstanding = _OutstandingScans()
+        self.__lines = 0
+        self.__seq = 0
+        self.__stopped = Event()
+        self.__writer = Thread(target=self.__write_loop, name="scan-journal", daemon=True)
+
+    def replay(self) -> list[tuple[str, Path]]:
+        """
+        Reads the journal left by a previous run.
+        :return: The scans that were queued but never completed, oldest first.
+        """
+        outstanding = _OutstandingScans()
+        lines = 0
+        seq = 0
+        try:
+            with open(self.__path, "r") as journal_file:
+                for line in journal_file:
+                    lines += 1
+                    try:
+                        op, section_title, subpath, record_seq = json.loads(line)
+                    except ValueError:
+                        continue  # A line torn by a crash
+                    key = to_key(section_title, subpath.split("/"))
+                    if op == QUEUED:
+                        outstanding.add(key, record_seq)
+                        seq = max(seq, record_seq)
+                    elif op == DONE:
+                        outstanding.settle(key, record_seq)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Could not read the scan journal {self.__path}: {e}")
+        self.__outstanding = outstanding
+        self.__lines = lines
+        self.__seq = seq
+        return [(section_title, Path(*parts)) for (section_title, parts), _ in outstanding]
+
+    def start(self) -> None:
+        """
+        Starts the writer thread. The journal is first compacted down to the scans found by replay(),
+        which also drops a line torn by a crash.
+        """
+        self.__path.parent.mkdir(parents=True, exist_ok=True)
+        self.__compact()
+        self.__writer.start()
+
+    def stop(self) -> None:
+        """
+        Stops the writer thread after flushing the buffered records.
+        """
+        self.__stopped.set()
+        self.__writer.join()
+        self.__flush()
+
+    def checkpoint(self) -> int:
+        """
+        :return: The sequence number of the last queued record, to take before sending a scan to Plex.
+        """
+        return self.__seq
+
+    def record_queued(self, section_title: str, subpath: Path) -> None:
+        with self.__lock:
+            self.__seq += 1
+            self.__buffer.append((QUEUED, section_title, subpath.as_posix(), self.__seq))
+
+    def record_done(self, section_title: str, subpath: Path, checkpoint: int) -> None:
+        """
+        :param checkpoint: The checkpoint() taken before the scan was sent.
+        """
+        with self.__lock:
+            self.__buffer.append((DONE, section_title, subpath.as_posix(), checkpoint))
+
+    def __write_loop(self) -> None:
+        while not self.__stopped.wait(self.__flush_interval):
+            self.__flush()
+            if self.__lines > self.__compact_threshold and self.__lines > 2 * len(self.__outstanding):
+                self.__compact()
+
+    def __flush(self) -> None:
+        with self.__lock:
+            records, self.__buffer = self.__buffer, []
+        if not records:
+            return
+        for op, section_title, subpath, seq in records:
+            key = to_key(section_title, subpath.split("/"))
+            if op == QUEUED:
+                self.__outstanding.add(key, seq)
+            else:
+                self.__outstanding.settle(key, seq)
+        try:
+            with open(self.__path, "a") as journal_file:
+                journal_file.writelines(json.dumps(record) + "\n" for record in records)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            self.__lines += len(records)
+        except OSError as e:
+            logging.error(f"Could not write to the scan journal {self.__path}: {e}")
+
+    def __compact(self) -> None:
+        """
+        Rewrites the journal with the outstanding scans only.
+        """
+        tmp_path = self.__path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "w") as journal_file:
+                journal_file.writelines(
+                    json.dumps((QUEUED, section_title, "/".join(parts), seq)) + "\n"
+                    for (section_title, parts), seq in self.__outstanding
+                )
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+            os.replace(tmp_path, self.__path)
+            self.__lines = len(self.__outstanding)
+        except OSError as e:
+            logging.error(f"Could not compact the scan journal {self.__path}: {e}")
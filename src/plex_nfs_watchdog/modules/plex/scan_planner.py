@@ -0,0 +1,111 @@
+import logging
+import time
+from pathlib import Path
+from typing import Optional
+
+from plexapi.library import LibrarySection
+
+from .scan_queue import QueuedScan
+from ..metrics import metrics
+
+
+class ScanPlanner:
+    """
+    Cost-based planning of the partial-scans due for a section, run on every batch before dispatching.
+
+    A storm touching many folders of a section, e.g. a migration, is cheaper for Plex as a single
+    section refresh than as thousands of partial-scans. The section is escalated to a full refresh
+    when the batch holds at least escalate_count folders, or when the top-level folders it touches
+    make up at least escalate_ratio of the section's top-level items (movies, shows, artists...).
+    Below these thresholds, merge_siblings or more sibling folders are merged into their parent,
+    level by level from the deepest one, so a parent with many changed children is scanned once.
+    Each threshold is disabled by 0.
+    """
+
+    # Seconds the number of top-level items of a section is reused
+    ITEM_COUNT_TTL: float = 3600.0
+
+    def __init__(self, server: str, escalate_count: int, escalate_ratio: float, merge_siblings: int):
+        self.__server = server
+        self.__escalate_count = escalate_count
+        self.__escalate_ratio = escalate_ratio
+        self.__merge_siblings = merge_siblings
+        self.__item_counts: dict[str, tuple[float, int]] = {}
+
+    def __item_count(self, plex_section: LibrarySection) -> Optional[int]:
+        cached = self.__item_counts.get(plex_section.key)
+        if cached is not None and time.monotonic() - cached[0] < self.ITEM_COUNT_TTL:
+            return cached[1]
+        try:
+            with metrics.track_plex_request(self.__server, "count"):
+                item_count = plex_section.totalSize
+        except Exception as e:
+            logging.warning(f"Could not count the items of section '{plex_section.title}': {e}")
+            return None
+        self.__item_counts[plex_section.key] = (time.monotonic(), item_count)
+        return item_count
+
+    def __should_escalate(self, plex_section: LibrarySection, scans: list[QueuedScan]) -> bool:
+        if self.__escalate_count and len(scans) >= self.__escalate_count:
+            logging.info(
+                f"Section '{plex_section.title}' of {self.__server}: {len(scans)} queued folders "
+                f"(threshold {self.__escalate_count}) => full section scan"
+            )
+            return True
+        if not self.__escalate_ratio:
+            return False
+        top_folders = {subpath.parts[0] for _, subpath, _ in scans if subpath.parts}
+        if len(top_folders) < 2:
+            return False
+        item_count = self.__item_count(plex_section)
+        if not item_count or len(top_folders) / item_count < self.__escalate_ratio:
+            return False
+        logging.info(
+            f"Section '{plex_section.title}' of {self.__server}: {len(top_folders)} of {item_count} top-level items "
+            f"touched (threshold {self.__escalate_ratio:.0%}) => full section scan"
+        )
+        return True
+
+    def __merge(self, scans: list[QueuedScan]) -> list[QueuedScan]:
+        section_title = scans[0][0]
+        # path parts => first_seen
+        pending: dict[tuple[str, ...], float] = {}
+        for _, subpath, first_seen in scans:
+            pending[subpath.parts] = min(first_seen, pending.get(subpath.parts, first_seen))
+
+        max_depth = max(len(parts) for parts in pending)
+        # Parents never merge into the section root, that is what escalation is for
+        for depth in range(max_depth, 1, -1):
+            siblings: dict[tuple[str, ...], list[tuple[str, ...]]] = {}
+            for parts in pending:
+                if len(parts) == depth:
+                    siblings.setdefault(parts[:-1], []).append(parts)
+            for parent, children in siblings.items():
+                if len(children) >= self.__merge_siblings:
+                    first_seen = min(pending.pop(child) for child in children)
+                    pending[parent] = min(first_seen, pending.get(parent, first_seen))
+
+        # Deeper folders may still sit below a merged parent
+        return [
+            (section_title, Path(*parts), first_seen) for parts, first_seen in pending.items()
+            if not any(parts[:depth] in pending for depth in range(len(parts)))
+        ]
+
+    def plan(self, plex_section: LibrarySection, scans: list[QueuedScan]) -> list[QueuedScan]:
+        """
+        :param scans: The scans due for the section, all with the same section title.
+        :return: The scans to send instead. The section root (Path(".")) stands for a full section scan.
+        """
+        if any(not subpath.parts for _, subpath, _ in scans):
+            return [(scans[0][0], Path("."), min(first_seen for _, _, first_seen in scans))]
+        if self.__should_escalate(plex_section, scans):
+            return [(scans[0][0], Path("."), min(first_seen for _, _, first_seen in scans))]
+        if not self.__merge_siblings or len(scans) < self.__merge_siblings:
+            return scans
+        planned = self.__merge(scans)
+        if len(planned) < len(scans):
+            logging.info(
+                f"Section '{plex_section.title}' of {self.__server}: merged {len(scans)} queued folders "
+                f"into {len(planned)} (at least {self.__merge_siblings} siblings per parent)"
+            )
+        return planned
@@ -0,0 +1,225 @@
+import heapq
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+# A queued scan is identified by its section title and the parts of its subpath,
+# e.g. ("Movies", ("Action", "Foo (2020)")). The section root is ("Movies", ()).
+# Titles and parts are interned, see to_key(): the keys of thousands of scans in the same folders share their strings.
+ScanKey = tuple[str, tuple[str, ...]]
+# A scan handed out by the queue: (section_title, subpath, time.monotonic() of its first event)
+QueuedScan = tuple[str, Path, float]
+
+
+def to_key(section_title: str, parts: Iterable[str]) -> ScanKey:
+    """
+    Builds the key of a scan from its subpath parts, "." parts being dropped. Section titles and folder names
+    are interned with sys.intern(), so every key below a folder points to the same strings,
+    which are freed again once no key uses them.
+    """
+    return sys.intern(section_title), tuple(sys.intern(part) for part in parts if part and part != ".")
+
+
+class _PendingScan:
+    """
+    Scheduling state of a queued scan, timestamps come from time.monotonic().
+    """
+    __slots__ = ("seq", "first_seen", "last_seen", "not_before")
+
+    def __init__(self, seq: int, first_seen: float, last_seen: float, not_before: float):
+        self.seq = seq
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.not_before = not_before
+
+
+class ScanQueue:
+    """
+    Queue of pending partial-scans of a Plex server. It is only touched from the service event loop,
+    so it needs no lock: other threads hand their folders over with call_soon_threadsafe().
+
+    Entries are deduplicated in O(1) and coalesced by ancestry:
+      - if 'Movies: Action' is queued, 'Movies: Action/Foo (2020)' is absorbed by it;
+      - queueing 'Movies: Action' collapses any queued 'Movies: Action/...' entries.
+
+    A scan becomes due once no event touched it for quiet_period seconds, but never later than
+    max_delay seconds after its first event. Due times live in a heap with one entry per scan,
+    so thousands of pending scans cost a single loop timer, set to next_due_time().
+
+    With max_entries set, the queue degrades gracefully instead of growing without bounds: once it holds
+    more scans, the scans around a new one are collapsed into their nearest common ancestor folder,
+    from its parent up to the section root. Plex then scans a larger folder, but no change is lost.
+    The cap may be exceeded by a single scan in a section that holds no other one.
+    """
+
+    # Scans falling due this close to each other are handed out together, so they share a batch
+    BATCH_WINDOW: float = 1.0
+
+    def __init__(self, quiet_period: float = 0.0, max_delay: float = 0.0, max_entries: int = 0):
+        self.__quiet_period = quiet_period
+        self.__max_delay = max_delay
+        self.__max_entries = max_entries
+        self.__entries: dict[ScanKey, _PendingScan] = {}
+        # Maps every ancestor prefix of a queued entry to the queued entries below it.
+        self.__descendants: dict[ScanKey, set[ScanKey]] = {}
+        # (due time, seq, key); entries are validated against __entries when popped, or dropped by __compact_heap()
+        self.__heap: list[tuple[float, int, ScanKey]] = []
+        self.__seq = 0
+        self.__max_depth = 0
+        self.__collapsed = 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    @property
+    def max_depth(self) -> int:
+        return self.__max_depth
+
+    @property
+    def collapsed(self) -> int:
+        """
+        Number of scans merged into an ancestor scan because the queue was full, since it was created.
+        """
+        return self.__collapsed
+
+    def __due_time(self, pending: _PendingScan) -> float:
+        settled = min(pending.last_seen + self.__quiet_period, pending.first_seen + self.__max_delay)
+        return max(settled, pending.not_before)
+
+    def __find_ancestor(self, section_title: str, parts: tuple[str, ...]) -> Optional[ScanKey]:
+        """
+        Returns the queued entry covering the given subpath (itself included), if any.
+        """
+        for depth in range(len(parts) + 1):
+            key = (section_title, parts[:depth])
+            if key in self.__entries:
+                return key
+        return None
+
+    def __link(self, key: ScanKey) -> None:
+        section_title, parts = key
+        for depth in range(len(parts)):
+            self.__descendants.setdefault((section_title, parts[:depth]), set()).add(key)
+
+    def __unlink(self, key: ScanKey) -> None:
+        section_title, parts = key
+        for depth in range(len(parts)):
+            prefix = (section_title, parts[:depth])
+            below = self.__descendants.get(prefix)
+            if below is None:
+                continue
+            below.discard(key)
+            if not below:
+                del self.__descendants[prefix]
+
+    def put(self, section_title: str, subpath: Path, retry_after: float = 0.0,
+            first_seen: Optional[float] = None) -> Optional[ScanKey]:
+        """
+        Queues a scan of subpath in the given section, or restarts the quiet period of the
+        pending scan covering it.
+        :param retry_after: Seconds to hold the scan back regardless of its quiet period.
+        :param first_seen: Time of the first event of a re-queued scan, defaults to now.
+        :return: The key of the scan queued, which is an ancestor folder if the queue was full and collapsed it,
+            or None if an equal or ancestor scan is already pending.
+        """
+        key = to_key(section_title, subpath.parts)
+        if not self.__put(key, retry_after, first_seen):
+            return None
+        if self.__max_entries and len(self.__entries) > self.__max_entries:
+            return self.__collapse(key) or key
+        return key
+
+    def __put(self, key: ScanKey, retry_after: float, first_seen: Optional[float]) -> bool:
+        section_title, parts = key
+        now = time.monotonic()
+        ancestor = self.__find_ancestor(section_title, parts)
+        if ancestor is not None:
+            pending = self.__entries[ancestor]
+            pending.last_seen = now
+            pending.not_before = max(pending.not_before, now + retry_after)
+            if first_seen is not None:
+                pending.first_seen = min(pending.first_seen, first_seen)
+            return False
+
+        first_seen = now if first_seen is None else min(first_seen, now)
+        for child in list(self.__descendants.get(key, ())):
+            self.__unlink(child)
+            first_seen = min(first_seen, self.__entries.pop(child).first_seen)
+
+        self.__seq += 1
+        pending = _PendingScan(self.__seq, first_seen, now, now + retry_after)
+        self.__entries[key] = pending
+        self.__link(key)
+        self.__max_depth = max(self.__max_depth, len(self.__entries))
+        heapq.heappush(self.__heap, (self.__due_time(pending), pending.seq, key))
+        if len(self.__heap) > 2 * len(self.__entries) + 1024:
+            self.__compact_heap()
+        return True
+
+    def __compact_heap(self) -> None:
+        """
+        Rebuilds the heap from the queued scans, dropping the stale entries left by collapsed scans,
+        which would otherwise pile up until their due time.
+        """
+        self.__heap = [(self.__due_time(pending), pending.seq, key) for key, pending in self.__entries.items()]
+        heapq.heapify(self.__heap)
+
+    def __collapse(self, key: ScanKey) -> Optional[ScanKey]:
+        """
+        Merges the scans queued near key into their nearest common ancestor, until the queue is back under its cap.
+        :return: The ancestor queued last, which absorbed key, or None if nothing was collapsed.
+        """
+        section_title, parts = key
+        ancestor = None
+        for depth in range(len(parts) - 1, -1, -1):
+            prefix = (section_title, parts[:depth])
+            below = len(self.__descendants.get(prefix, ()))
+            if below > 1:
+                # The ancestor absorbs every scan below it, see __put()
+                self.__put(prefix, 0.0, None)
+                self.__collapsed += below
+                ancestor = prefix
+                if len(self.__entries) <= self.__max_entries:
+                    break
+        return ancestor
+
+    def pop_due(self, now: float) -> list[QueuedScan]:
+        """
+        :return: The scans due at the given time.monotonic() value, removed from the queue, possibly none.
+        """
+        due = []
+        horizon = now
+        while self.__heap and self.__heap[0][0] <= horizon:
+            _, seq, key = heapq.heappop(self.__heap)
+            pending = self.__entries.get(key)
+            if pending is None or pending.seq != seq:
+                continue  # Stale heap entry: the scan was collapsed or already handed out
+            due_time = self.__due_time(pending)
+            if due_time > horizon:
+                # Touched since it was pushed, push it back with its new due time
+                heapq.heappush(self.__heap, (due_time, seq, key))
+                continue
+            # Once a scan is due, the ones falling due shortly after join its batch
+            horizon = now + self.BATCH_WINDOW
+            del self.__entries[key]
+            self.__unlink(key)
+            section_title, parts = key
+            due.append((section_title, Path(*parts), pending.first_seen))
+        return due
+
+    def next_due_time(self) -> Optional[float]:
+        """
+        :return: The earliest time a scan may be due, scans touched since they were queued being due later.
+        """
+        return self.__heap[0][0] if self.__heap else None
+
+    def drain(self) -> list[QueuedScan]:
+        """
+        Removes and returns every pending scan, whether due or not, in queueing order.
+        """
+        entries = sorted(self.__entries.items(), key=lambda entry: entry[1].seq)
+        self.__entries.clear()
+        self.__descendants.clear()
+        self.__heap.clear()
+        return [(section_title, Path(*parts), pending.first_seen) for (section_title, parts), pending in entries]
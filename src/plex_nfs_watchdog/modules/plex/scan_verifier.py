@@ -0,0 +1,144 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from pathlib import Path, PurePath, PurePosixPath, PureWindowsPath
+from threading import Lock
+
+from plexapi.library import LibrarySection
+
+from ..metrics import metrics
+
+# Sorts after any real path part, so (*prefix, _LAST) bounds the descendants of prefix
+_LAST = "\U0010ffff"
+
+VIDEO_EXT: frozenset[str] = frozenset([
+    "3g2", "3gp", "amv", "asf", "avi", "drc", "f4v", "flv", "m2ts", "m2v", "m4p", "m4v", "mkv", "mng", "mov",
+    "mp4", "mpe", "mpeg", "mpg", "mpv", "mxf", "nsv", "ogv", "qt", "rm", "rmvb", "roq", "svi", "ts", "vob",
+    "webm", "wmv", "yuv"
+])
+AUDIO_EXT: frozenset[str] = frozenset([
+    "aac", "aiff", "alac", "f4a", "f4b", "flac", "m4a", "mp2", "mp3", "ogg", "opus", "wav", "wma"
+])
+PHOTO_EXT: frozenset[str] = frozenset(["gif", "heic", "jpeg", "jpg", "png", "raw", "tif", "tiff"])
+
+# Per section type: the item type holding the media parts, and the extensions Plex indexes as parts
+SECTION_MEDIA: dict[str, tuple[str, frozenset[str]]] = {
+    "movie": ("movie", VIDEO_EXT),
+    "show": ("episode", VIDEO_EXT),
+    "artist": ("track", AUDIO_EXT),
+    "photo": ("photo", PHOTO_EXT | VIDEO_EXT),
+}
+
+
+class _SectionContents:
+    """
+    The media parts indexed by Plex in a section, sorted by path parts so that the parts below
+    a folder form a contiguous range.
+    """
+
+    def __init__(self, parts: dict[tuple[str, ...], tuple[int, float]]):
+        self.fetched_at = time.monotonic()
+        self.keys = sorted(parts)
+        self.values = [parts[key] for key in self.keys]
+
+    def below(self, folder: tuple[str, ...]) -> dict[tuple[str, ...], tuple[int, float]]:
+        """
+        :return: (size, updated_at) of every indexed file below folder, keyed by path parts relative to it.
+        """
+        start = bisect_left(self.keys, folder)
+        end = bisect_left(self.keys, (*folder, _LAST))
+        return {self.keys[idx][len(folder):]: self.values[idx] for idx in range(start, end)}
+
+
+def remote_path_type(remote_path: str) -> type[PurePath]:
+    """
+    Guesses the path flavour of the Plex server from one of its library locations.
+    """
+    return PureWindowsPath if "\\" in remote_path or remote_path[1:2] == ":" else PurePosixPath
+
+
+class ScanVerifier:
+    """
+    Asks Plex whether the files below a folder are already indexed before sending a partial-scan.
+
+    The media parts of a section are fetched with one batched search per section, then cached for
+    ttl seconds. A folder is considered up to date when its local media files and the ones Plex
+    indexed below the matching remote folder are the same, with the same sizes, and no local file
+    (sidecar subtitles included) was modified after the matching Plex items were last updated.
+    """
+
+    def __init__(self, server: str, ttl: float, sidecar_ext: frozenset[str]):
+        self.__server = server
+        self.__ttl = ttl
+        self.__sidecar_ext = sidecar_ext
+        self.__contents: dict[str, _SectionContents] = {}
+        self.__lock = Lock()
+
+    def __fetch_contents(self, plex_section: LibrarySection) -> _SectionContents:
+        libtype, _ = SECTION_MEDIA[plex_section.type]
+        path_type = None
+        parts: dict[tuple[str, ...], tuple[int, float]] = {}
+        with metrics.track_plex_request(self.__server, "contents"):
+            items = plex_section.search(libtype=libtype)
+        for item in items:
+            updated_at = item.updatedAt or item.addedAt
+            updated_ts = updated_at.timestamp() if updated_at else 0.0
+            for media in item.media:
+                for part in media.parts:
+                    if not part.file:
+                        continue
+                    path_type = path_type or remote_path_type(part.file)
+                    parts[path_type(part.file).parts] = (part.size or 0, updated_ts)
+        logging.debug(f"Fetched {len(parts)} indexed files of section '{plex_section.title}'")
+        return _SectionContents(parts)
+
+    def __get_contents(self, plex_section: LibrarySection) -> _SectionContents:
+        with self.__lock:
+            contents = self.__contents.get(plex_section.key)
+        if contents is None or time.monotonic() - contents.fetched_at > self.__ttl:
+            contents = self.__fetch_contents(plex_section)
+            with self.__lock:
+                self.__contents[plex_section.key] = contents
+        return contents
+
+    def is_indexed(self, plex_section: LibrarySection, remote_folder: str, local_folder: Path) -> bool:
+        """
+        :return: True if Plex already indexed the current content of local_folder, known to Plex as remote_folder.
+        """
+        if plex_section.type not in SECTION_MEDIA:
+            return False
+        _, media_ext = SECTION_MEDIA[plex_section.type]
+        try:
+            indexed = self.__get_contents(plex_section).below(remote_path_type(remote_folder)(remote_folder).parts)
+        except Exception as e:
+            logging.warning(f"Could not verify '{remote_folder}' against section '{plex_section.title}': {e}")
+            return False
+
+        newest_update = max((updated_ts for _, updated_ts in indexed.values()), default=0.0)
+        local_media = 0
+        try:
+            for dir_path, _, file_names in os.walk(local_folder):
+                rel_dir = Path(dir_path).relative_to(local_folder).parts
+                for file_name in file_names:
+                    ext = file_name.rpartition(".")[2].lower()
+                    is_media = ext in media_ext
+                    if not is_media and ext not in self.__sidecar_ext:
+                        continue
+                    stat = os.stat(os.path.join(dir_path, file_name))
+                    if not is_media:
+                        if stat.st_mtime > newest_update:
+                            return False
+                        continue
+                    local_media += 1
+                    indexed_file = indexed.get((*rel_dir, file_name))
+                    if indexed_file is None:
+                        return False
+                    size, updated_ts = indexed_file
+                    if size != stat.st_size or stat.st_mtime > updated_ts:
+                        return False
+        except OSError as e:
+            logging.debug(f"Could not walk '{local_folder}' for verification: {e}")
+            return False
+        # Same count: nothing was deleted locally since Plex indexed the folder
+        return local_media == len(indexed)
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Callable, Iterable, Optional
+
+from .snapshot_watcher import RACY_WINDOW_NS, DirState, entries_changed, list_dir, stat_mtime
+from .watch_budget import WatchPruner
+
+
+class DirSnapshot:
+    """
+    Persisted index of the folders under the watch roots, to catch up on the changes made while the daemon
+    was stopped, e.g. during an upgrade or a reboot of the host.
+
+    The index holds the same compact state as SnapshotEmitter for every watched folder: its mtime,
+    entry count and subdirectory names. It is saved next to the configuration file when the daemon stops,
+    and every interval seconds if set, while the watchers still run, so that any later change is
+    either seen by a watcher or found by the next catch-up. On startup, once the watchers run,
+    the live tree is diffed against the saved index and the changed folders are handed to on_changed:
+    a new folder as itself, and a known one only if its other entries changed or it lost a subfolder,
+    so that a new movie folder does not rescan the whole library root.
+
+    The walks are pruned by mtime: every known folder is stated, level by level on a thread pool,
+    but only the folders whose mtime changed are listed again, the others keep their saved subdirectories.
+    A folder changes when an entry is added, removed or renamed in it, which is how media gets imported;
+    a file rewritten in place is not noticed. Roots missing from the saved index are only indexed.
+    """
+
+    def __init__(self, path: Path, pruner: WatchPruner, workers: int, interval: float):
+        self.__path = path
+        self.__pruner = pruner
+        self.__workers = workers
+        self.__interval = interval
+        self.__index: dict[str, DirState] = {}
+        self.__taken_at_ns = 0
+        # Monotonic time at which the last walk ended
+        self.__walked_at = 0.0
+        # False until a walk covered every root, a partial index is never saved
+        self.__complete = False
+        self.__lock = Lock()
+        self.__stopped = Event()
+        self.__thread: Optional[Thread] = None
+
+    def load(self) -> None:
+        """
+        Reads the index saved by a previous run, if any.
+        """
+        try:
+            with open(self.__path, "r") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.__taken_at_ns = snapshot["taken_at_ns"]
+            self.__index = {
+                path: DirState(mtime_ns, entry_count, tuple(subdirs))
+                for path, (mtime_ns, entry_count, subdirs) in snapshot["folders"].items()
+            }
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"Could not read the folder snapshot {self.__path}, changes made while stopped are lost: {e}")
+
+    def save(self) -> None:
+        """
+        Atomically replaces the saved index with the current one, once a walk completed.
+        """
+        if not self.__complete:
+            return
+        tmp_path = self.__path.with_suffix(".tmp")
+        try:
+            self.__path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "w") as snapshot_file:
+                json.dump({
+                    "taken_at_ns": self.__taken_at_ns,
+                    "folders": {path: [state.mtime_ns, state.entry_count, state.subdirs]
+                                for path, state in self.__index.items()},
+                }, snapshot_file, separators=(",", ":"))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(tmp_path, self.__path)
+        except OSError as e:
+            logging.error(f"Could not save the folder snapshot {self.__path}: {e}")
+
+    def __subdirs(self, path: str, state: DirState, roots: set[str]) -> list[str]:
+        if path not in roots and not self.__pruner.descends(os.path.basename(path)):
+            return []
+        return [os.path.join(path, name) for name in state.subdirs if self.__pruner.watches(name)]
+
+    def refresh(self, roots: Iterable[Path]) -> list[str]:
+        """
+        Walks the roots against the index and replaces it with the live state.
+        :return: The folders added or changed since the last walk, under the roots it already covered.
+        """
+        with self.__lock:
+            old_index, old_taken_at_ns = self.__index, self.__taken_at_ns
+            taken_at_ns = time.time_ns()
+            root_paths = {str(root) for root in roots}
+            index: dict[str, DirState] = {}
+            changed = []
+            # (folder, whether its changes are reported): a root without a previous state is only indexed,
+            # like the subfolders of a new folder, which is reported as a whole
+            frontier = [(path, path in old_index) for path in sorted(root_paths)]
+            with ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix="snapshot-walk") as pool:
+                while frontier:
+                    if self.__stopped.is_set() and not self.__complete:
+                        return []  # Stopped during the catch-up: the saved index is kept for the next run
+                    to_list = []
+                    paths = [path for path, _ in frontier]
+                    for (path, known), mtime_ns in zip(frontier, pool.map(stat_mtime, paths, chunksize=64)):
+                        if mtime_ns is None:
+                            continue  # Removed: its parent changed
+                        state = old_index.get(path)
+                        # A folder whose mtime was racy when saved may have changed within the same mtime
+                        if state is not None and mtime_ns == state.mtime_ns \
+                                and state.mtime_ns < old_taken_at_ns - RACY_WINDOW_NS:
+                            index[path] = state
+                        else:
+                            to_list.append((path, known))
+                    for (path, known), state in zip(to_list, pool.map(list_dir, [path for path, _ in to_list])):
+                        if state is None:
+                            continue
+                        index[path] = state
+                        if not known:
+                            continue
+                        old_state = old_index.get(path)
+                        if old_state is None:
+                            changed.append(path)
+                            continue
+                        new_subdirs = set(self.__subdirs(path, state, root_paths)).difference(
+                            self.__subdirs(path, old_state, root_paths)
+                        )
+                        if entries_changed(old_state, state, len(new_subdirs)):
+                            changed.append(path)
+                    frontier = [
+                        (subdir, known and path in old_index)
+                        for path, known in frontier if path in index
+                        for subdir in self.__subdirs(path, index[path], root_paths)
+                    ]
+            self.__index, self.__taken_at_ns = index, taken_at_ns
+            self.__walked_at = time.monotonic()
+            self.__complete = True
+            return changed
+
+    def start(self, roots: Callable[[], Iterable[Path]], on_changed: Callable[[list[str]], None]) -> None:
+        """
+        Starts the snapshot thread: it catches up on the changes made since the saved index, then saves
+        the index again every interval seconds, if set. Must be called once the watchers run, see stop().
+        """
+        self.__thread = Thread(target=self.__run, args=(roots, on_changed), name="dir-snapshot", daemon=True)
+        self.__thread.start()
+
+    def __run(self, roots: Callable[[], Iterable[Path]], on_changed: Callable[[list[str]], None]) -> None:
+        start = time.monotonic()
+        try:
+            self.load()
+            saved = bool(self.__index)
+            changed = self.refresh(roots())
+        except Exception as e:
+            logging.error(f"Could not catch up on the changes made while the daemon was stopped: {e}")
+            # The next walks start over from the live tree, they must not report the changes since the saved index
+            with self.__lock:
+                self.__index, self.__taken_at_ns = {}, 0
+            saved, changed = False, []
+        if self.__complete and not saved:
+            logging.info(f"Indexed {len(self.__index)} folders to catch up on the changes made while stopped")
+        elif self.__complete:
+            logging.info(
+                f"Found {len(changed)} folders changed while the daemon was stopped, "
+                f"out of {len(self.__index)} in {time.monotonic() - start:.1f}s"
+            )
+            if changed:
+                on_changed(changed)
+        self.save()
+        if not self.__interval:
+            return
+        while not self.__stopped.wait(self.__interval):
+            try:
+                self.refresh(roots())
+                self.save()
+            except Exception as e:
+                logging.error(f"Could not update the folder snapshot: {e}")
+
+    def stop(self, roots: Iterable[Path]) -> None:
+        """
+        Stops the snapshot thread and saves the index a last time. Must be called while the watchers still run,
+        a change made between this last walk and their stop would be missed otherwise.
+        A walk of the thread ending after the stop request is that last walk, the folders are not walked again.
+        """
+        stopped_at = time.monotonic()
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        if self.__complete and self.__walked_at < stopped_at:
+            self.refresh(roots)
+            self.save()
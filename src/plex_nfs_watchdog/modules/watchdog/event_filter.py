@@ -0,0 +1,80 @@
+import fnmatch
+import logging
+import os
+import re
+from collections import Counter
+from typing import Iterable, Optional
+
+from ..metrics.metrics import events_filtered
+
+_SEPARATORS = re.compile("[" + re.escape(os.sep + (os.altsep or "")) + "]")
+
+
+class EventFilter:
+    """
+    Rejects irrelevant filesystem events using only the event path, before any syscall is made.
+
+    Checks, cheapest first:
+      - folder 'modified' events, when skip_dir_modified is set: they only echo the create/delete/move
+        events of the files inside, which are filtered on their own;
+      - folder names to ignore anywhere in the path (e.g. '@eaDir', '.grab');
+      - file extensions, looked up in a frozenset (folders are never rejected on this);
+      - user supplied exclude/include globs, each compiled into a single regular expression
+        and matched against the full path.
+    """
+
+    def __init__(self, extensions: Optional[Iterable[str]], include: Iterable[str], exclude: Iterable[str],
+                 ignore_dirs: Iterable[str], skip_dir_modified: bool = False):
+        # None accepts every extension
+        self.__extensions = frozenset(ext.lower().lstrip(".") for ext in extensions) if extensions else None
+        self.__include = self.__compile(include)
+        self.__exclude = self.__compile(exclude)
+        self.__ignore_dirs = frozenset(ignore_dirs)
+        self.__skip_dir_modified = skip_dir_modified
+        self.accepted: int = 0
+        self.rejected: Counter[str] = Counter()
+
+    @staticmethod
+    def __compile(patterns: Iterable[str]) -> Optional[re.Pattern]:
+        patterns = list(patterns)
+        if not patterns:
+            return None
+        return re.compile("|".join(f"(?:{fnmatch.translate(os.path.normcase(pattern))})" for pattern in patterns))
+
+    def __reject(self, reason: str) -> bool:
+        self.rejected[reason] += 1
+        events_filtered.inc(reason)
+        return False
+
+    def accept(self, event_type: str, event_path: str, is_directory: bool) -> bool:
+        """
+        :return: True if the event may be relevant to Plex and should be processed.
+        """
+        if is_directory and self.__skip_dir_modified and event_type == "modified":
+            return self.__reject("dir_modified")
+
+        parts = _SEPARATORS.split(event_path)
+        if not self.__ignore_dirs.isdisjoint(parts):
+            return self.__reject("ignored_dir")
+
+        if not is_directory and self.__extensions is not None:
+            _, dot, ext = parts[-1].rpartition(".")
+            if not dot or ext.lower() not in self.__extensions:
+                return self.__reject("extension")
+
+        if self.__exclude is not None or self.__include is not None:
+            normalized_path = os.path.normcase(event_path)
+            if self.__exclude is not None and self.__exclude.match(normalized_path):
+                return self.__reject("exclude")
+            if not is_directory and self.__include is not None and not self.__include.match(normalized_path):
+                return self.__reject("include")
+
+        self.accepted += 1
+        return True
+
+    def log_stats(self) -> None:
+        total_rejected = sum(self.rejected.values())
+        logging.info(
+            f"Event filter rejected {total_rejected} of {total_rejected + self.accepted} events "
+            f"before any filesystem access: {dict(self.rejected)}"
+        )
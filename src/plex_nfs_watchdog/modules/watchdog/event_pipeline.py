@@ -0,0 +1,126 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from typing import Callable, Optional
+
+from .event_filter import EventFilter
+from ..metrics.metrics import events_overflowed
+from ..plex.plex_agent_group import plex_agents
+
+# A raw event waiting to be checked: (event_type, path, is_directory)
+RawEvent = tuple[str, str, bool]
+# A checked event: (folder to scan, event_type)
+CheckedFolder = tuple[str, str]
+
+
+class EventPipeline:
+    """
+    Takes filesystem event processing off the watchdog observer thread.
+
+    The observer callbacks only run the path-only EventFilter and push the raw event into a bounded queue. A resolver thread
+    drains it in batches, checks the batch paths on a small thread pool (exists/stat calls may
+    block for a long time on network mounts), then hands the surviving folders over to on_folders,
+    e.g. to the service event loop, which maps them to Plex sections.
+
+    When the queue is full, the 'parent' backpressure policy does not block the observer:
+    the event is reduced to its parent folder and parked in a deduplicated overflow set,
+    so a storm inside one folder costs a single entry. The 'block' policy waits for room instead.
+    """
+
+    BATCH_SIZE: int = 256
+
+    def __init__(self, event_filter: EventFilter, queue_size: int, stat_workers: int, backpressure: str,
+                 on_folders: Callable[[list[CheckedFolder]], None]):
+        self.__filter = event_filter
+        self.__on_folders = on_folders
+        self.__queue: Queue[Optional[RawEvent]] = Queue(maxsize=queue_size)
+        self.__block = backpressure == "block"
+        self.__overflow: dict[str, str] = {}
+        self.__overflow_lock = Lock()
+        self.__stat_pool = ThreadPoolExecutor(max_workers=stat_workers, thread_name_prefix="event-stat")
+        self.__stopped = Event()
+        self.__resolver = Thread(target=self.__resolve_loop, name="event-resolver", daemon=True)
+
+    def start(self) -> None:
+        self.__resolver.start()
+
+    def stop(self) -> None:
+        """
+        Stops the resolver thread once it has processed the events already queued.
+        """
+        self.__stopped.set()
+        try:
+            self.__queue.put_nowait(None)
+        except Full:
+            pass
+        self.__resolver.join()
+        self.__stat_pool.shutdown(wait=True)
+        self.__filter.log_stats()
+
+    def submit(self, event) -> None:
+        """
+        Enqueues a raw watchdog event, a move being enqueued as its destination and the deletion of its source.
+        Meant to be called from the observer thread, it never touches the filesystem.
+        """
+        for event_type, event_path in plex_agents.get_event_paths(event):
+            raw_event = (event_type, event_path, event.is_directory)
+            if self.__filter.accept(*raw_event):
+                self.__enqueue(raw_event)
+
+    def __enqueue(self, raw_event: RawEvent) -> None:
+        if self.__block:
+            self.__queue.put(raw_event)
+            return
+        try:
+            self.__queue.put_nowait(raw_event)
+        except Full:
+            event_type, event_path, _ = raw_event
+            with self.__overflow_lock:
+                # The parent of a deleted path is still there, it is checked like a modified folder
+                self.__overflow[os.path.dirname(event_path)] = "modified" if event_type == "deleted" else event_type
+            events_overflowed.inc()
+
+    def __next_batch(self) -> list[RawEvent]:
+        # Repeated events on the same path only need to be checked once per batch
+        batch: dict[tuple[str, bool], str] = {}
+        try:
+            raw_event = self.__queue.get(timeout=1)
+            taken = 0
+            while raw_event is not None:
+                event_type, event_path, is_directory = raw_event
+                batch[(event_path, is_directory)] = event_type
+                taken += 1
+                if taken >= self.BATCH_SIZE:
+                    break
+                raw_event = self.__queue.get_nowait()
+        except Empty:
+            pass
+        with self.__overflow_lock:
+            overflow, self.__overflow = self.__overflow, {}
+        if overflow:
+            logging.warning(f"Event queue is full, events were reduced to {len(overflow)} parent folders")
+        for folder, event_type in overflow.items():
+            batch[(folder, True)] = event_type
+        return [(event_type, event_path, is_directory) for (event_path, is_directory), event_type in batch.items()]
+
+    @staticmethod
+    def __check(raw_event: RawEvent) -> Optional[str]:
+        return plex_agents.check_event_path(*raw_event)
+
+    def __resolve_loop(self) -> None:
+        while not (self.__stopped.is_set() and self.__queue.empty()):
+            batch = self.__next_batch()
+            if not batch:
+                continue
+            try:
+                # The files of a folder all resolve to it, it is handed over once per batch
+                folders = dict.fromkeys(
+                    (folder, raw_event[0])
+                    for raw_event, folder in zip(batch, self.__stat_pool.map(self.__check, batch)) if folder is not None
+                )
+                if folders:
+                    self.__on_folders(list(folders))
+            except Exception as e:
+                logging.error(f"Failed to process a batch of {len(batch)} filesystem events: {e}")
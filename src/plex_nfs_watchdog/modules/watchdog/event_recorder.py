@@ -0,0 +1,36 @@
+import json
+import logging
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Iterable
+
+
+class EventRecorder:
+    """
+    Captures the raw watchdog events received by the daemon into a JSON lines trace,
+    to replay them later with benchmarks/event_storm.py.
+
+    The first line holds the library folders known at startup: {"libraries": [remote_path, ...]}.
+    Every other line is an event: {"t": seconds since start, "type": event_type, "src": src_path,
+    "dest": dest_path, "dir": is_directory}.
+    """
+
+    def __init__(self, path: Path, library_paths: Iterable[Path]):
+        self.__file = open(path, "w")
+        self.__lock = Lock()
+        self.__start = time.monotonic()
+        self.__file.write(json.dumps({"libraries": sorted(str(p) for p in library_paths)}) + "\n")
+        logging.info(f"Recording filesystem events to {path}")
+
+    def record(self, event) -> None:
+        line = json.dumps({
+            "t": round(time.monotonic() - self.__start, 6), "type": event.event_type,
+            "src": event.src_path, "dest": event.dest_path, "dir": event.is_directory
+        })
+        with self.__lock:
+            self.__file.write(line + "\n")
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__file.close()
@@ -1,31 +1,62 @@
+from typing import Callable, Optional
+
 from watchdog.events import FileSystemEventHandler
 
-from ..plex.plex_agent import plex_agent_singleton
+from .event_filter import EventFilter
+from .event_pipeline import CheckedFolder, EventPipeline
+from .event_recorder import EventRecorder
 from ..config import shared
+from ..metrics.metrics import events_received
 
 
 class PlexWatchdog(FileSystemEventHandler):
 
+    def __init__(self, pipeline: EventPipeline, recorder: Optional[EventRecorder] = None):
+        self.__pipeline = pipeline
+        self.__recorder = recorder
+
+    def __handle(self, listener: str, event) -> None:
+        events_received.inc(listener)
+        if self.__recorder is not None:
+            self.__recorder.record(event)
+        if listener in shared.user_input.listeners:
+            self.__pipeline.submit(event)
+
     def on_moved(self, event):
-        if "move" in shared.user_input.listeners:
-            plex_agent_singleton.parse_event(event)
+        self.__handle("move", event)
 
     def on_modified(self, event):
-        if "modify" in shared.user_input.listeners:
-            plex_agent_singleton.parse_event(event)
+        self.__handle("modify", event)
 
     def on_created(self, event):
-        if "create" in shared.user_input.listeners:
-            plex_agent_singleton.parse_event(event)
+        self.__handle("create", event)
 
     def on_deleted(self, event):
-        if "delete" in shared.user_input.listeners:
-            plex_agent_singleton.parse_event(event)
+        self.__handle("delete", event)
 
     def on_closed(self, event):
-        if "io_close" in shared.user_input.listeners:
-            plex_agent_singleton.parse_event(event)
+        self.__handle("io_close", event)
 
     def on_opened(self, event):
-        if "io_open" in shared.user_input.listeners:
-            plex_agent_singleton.parse_event(event)
+        self.__handle("io_open", event)
+
+
+def build_event_handler(on_folders: Callable[[list[CheckedFolder]], None],
+                        recorder: Optional[EventRecorder] = None) -> tuple[EventPipeline, PlexWatchdog]:
+    """
+    Builds the event handler to schedule on the observers, and the pipeline it feeds,
+    which hands the checked folders over to on_folders.
+    """
+    event_filter = EventFilter(
+        None if "*" in shared.user_input.extensions else shared.user_input.extensions,
+        shared.user_input.include, shared.user_input.exclude, shared.user_input.ignore_dirs,
+        skip_dir_modified=(
+            shared.user_input.watcher == "native"
+            and {"create", "delete", "move"}.issubset(shared.user_input.listeners)
+        )
+    )
+    event_pipeline = EventPipeline(
+        event_filter, shared.user_input.event_queue_size, shared.user_input.stat_workers, shared.user_input.backpressure,
+        on_folders
+    )
+    return event_pipeline, PlexWatchdog(event_pipeline, recorder)
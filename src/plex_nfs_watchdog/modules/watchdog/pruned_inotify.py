@@ -0,0 +1,105 @@
+import errno
+import os
+from functools import partial
+
+from watchdog.observers.api import DEFAULT_EMITTER_TIMEOUT, DEFAULT_OBSERVER_TIMEOUT, BaseObserver
+from watchdog.observers.inotify import InotifyEmitter
+from watchdog.observers.inotify_buffer import InotifyBuffer
+from watchdog.observers.inotify_c import Inotify
+from watchdog.utils import BaseThread
+from watchdog.utils.delayed_queue import DelayedQueue
+
+from .watch_budget import WatchPruner
+
+
+class PrunedInotify(Inotify):
+    """
+    Recursive inotify watch that skips the folders its WatchPruner prunes.
+
+    watchdog looks up the watch of the parent folder of every file it reports in a newly created
+    folder, so a pruned folder is mapped to the watch of its parent without a watch of its own.
+    """
+
+    def __init__(self, path: bytes, recursive: bool = False, event_mask=None, pruner: WatchPruner = None):
+        self.__pruner = pruner
+        # Pruned folders mapped to the watch of their parent
+        self.__unwatched: set[bytes] = set()
+        super().__init__(path, recursive, event_mask)
+
+    def __relative_names(self, path: bytes) -> list[str]:
+        return [os.fsdecode(name) for name in path[len(self._path):].split(os.sep.encode()) if name]
+
+    def _add_dir_watch(self, path, recursive, mask):
+        if not os.path.isdir(path):
+            raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        self._add_watch(path, mask)
+        if not recursive:
+            return
+        for root, dirnames, _ in os.walk(path):
+            descended = []
+            for dirname in dirnames:
+                full_path = os.path.join(root, dirname)
+                name = os.fsdecode(dirname)
+                if os.path.islink(full_path) or not self.__pruner.watches(name):
+                    continue
+                self._add_watch(full_path, mask)
+                if self.__pruner.descends(name):
+                    descended.append(dirname)
+            dirnames[:] = descended
+
+    def _add_watch(self, path, mask):
+        names = self.__relative_names(path)
+        if not names or (self.__pruner.covers(names[:-1]) and self.__pruner.watches(names[-1])):
+            return super()._add_watch(path, mask)
+        wd = self._wd_for_path[os.path.dirname(path)]
+        self._wd_for_path[path] = wd
+        self.__unwatched.add(path)
+        return wd
+
+    def read_events(self, *args, **kwargs):
+        events = super().read_events(*args, **kwargs)
+        if self.__unwatched:
+            with self._lock:
+                for event in events:
+                    if event.is_directory and (event.is_delete or event.is_moved_from):
+                        self.__forget(event.src_path)
+        return events
+
+    def __forget(self, path: bytes) -> None:
+        prefix = path + os.sep.encode()
+        for unwatched_path in [p for p in self.__unwatched if p == path or p.startswith(prefix)]:
+            self.__unwatched.discard(unwatched_path)
+            self._wd_for_path.pop(unwatched_path, None)
+
+
+class PrunedInotifyBuffer(InotifyBuffer):
+
+    def __init__(self, path: bytes, recursive: bool = False, event_mask=None, pruner: WatchPruner = None):
+        # Same as InotifyBuffer.__init__, with a PrunedInotify
+        BaseThread.__init__(self)
+        self._queue = DelayedQueue(self.delay)
+        self._inotify = PrunedInotify(path, recursive, event_mask, pruner)
+        self.start()
+
+
+class PrunedInotifyEmitter(InotifyEmitter):
+
+    def __init__(self, event_queue, watch, timeout=DEFAULT_EMITTER_TIMEOUT, event_filter=None,
+                 pruner: WatchPruner = None):
+        super().__init__(event_queue, watch, timeout, event_filter)
+        self.__pruner = pruner
+
+    def on_thread_start(self):
+        path = os.fsencode(self.watch.path)
+        self._inotify = PrunedInotifyBuffer(
+            path, self.watch.is_recursive, self.get_event_mask_from_filter(), self.__pruner
+        )
+
+
+class PrunedInotifyObserver(BaseObserver):
+    """
+    Linux inotify observer whose recursive watches skip the folders pruned by a WatchPruner.
+    """
+
+    def __init__(self, pruner: WatchPruner):
+        super().__init__(partial(PrunedInotifyEmitter, pruner=pruner), timeout=DEFAULT_OBSERVER_TIMEOUT)
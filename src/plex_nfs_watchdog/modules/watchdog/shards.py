@@ -0,0 +1,227 @@
+import argparse
+import logging
+import multiprocessing
+import signal
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from threading import Thread
+from typing import Iterable, Optional
+
+from .event_pipeline import CheckedFolder
+from .plex_watchdog_event import build_event_handler
+from .watch_budget import WatchPruner, count_watches
+from .watch_manager import WatchManager, build_observer, cover_roots
+from ..config import shared
+from ..metrics.metrics import events_filtered
+from ..plex.path_index import LibraryPathIndex
+from ..plex.plex_agent_group import plex_agents
+
+# A scan resolved by a shard worker: (agent index, section title, subpath, checked folder, event type)
+ShardRecord = tuple[int, str, str, str, str]
+# The folder mappings of every Plex agent, in the order of plex_agents.agents
+Mappings = list[dict[str, list[tuple[str, str]]]]
+
+SYNC = "sync"
+STOP = "stop"
+
+
+def assign_shards(roots: Iterable[Path], shards: int, sizes: dict[Path, int],
+                  current: Optional[list[list[Path]]] = None) -> list[list[Path]]:
+    """
+    Spreads watch roots over the shards, largest first onto the least loaded shard.
+    :param sizes: Estimated number of folders under each root.
+    :param current: The previous assignment: roots still watched stay on their shard, so they keep their watches.
+    """
+    roots = set(roots)
+    assigned: list[list[Path]] = [[] for _ in range(shards)]
+    for shard, shard_roots in enumerate(current or []):
+        assigned[shard] = [root for root in shard_roots if root in roots]
+        roots.difference_update(assigned[shard])
+    loads = [sum(sizes.get(root, 1) for root in shard_roots) for shard_roots in assigned]
+    for root in sorted(roots, key=lambda r: (-sizes.get(r, 1), r)):
+        shard = loads.index(min(loads))
+        assigned[shard].append(root)
+        loads[shard] += sizes.get(root, 1)
+    return assigned
+
+
+class _ShardResolver:
+    """
+    Maps the folders checked in a shard worker to the sections of every Plex agent.
+    """
+
+    def __init__(self, mappings: Mappings):
+        self.__indexes: list[LibraryPathIndex] = []
+        self.update(mappings)
+
+    def update(self, mappings: Mappings) -> None:
+        self.__indexes = [LibraryPathIndex(mapping) for mapping in mappings]
+
+    def resolve(self, folders: list[CheckedFolder]) -> list[ShardRecord]:
+        records = []
+        indexes = self.__indexes
+        for folder, event_type in folders:
+            matched = False
+            folder_path = Path(folder)
+            for agent_index, index in enumerate(indexes):
+                for section_title, subpath in index.resolve(folder_path):
+                    records.append((agent_index, section_title, str(subpath), folder, event_type))
+                    matched = True
+            if not matched:
+                logging.error(f"Could not find a matching Plex section for '{folder}'")
+                events_filtered.inc("no_section")
+        return records
+
+
+def run_shard(index: int, user_input: argparse.Namespace, script_start_time: float, roots: list[Path],
+              mappings: Mappings, connection: Connection) -> None:
+    """
+    Entry point of a shard worker process: watches its roots with its own observer, filters and checks
+    the events, resolves them to sections, and sends the records to the coordinator in one message per batch.
+    """
+    # The coordinator stops the workers, e.g. when Ctrl-C reaches the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    shared.user_input = user_input
+    plex_agents.set_script_start_time(script_start_time)
+    plex_agents.set_stat_cache_ttl(user_input.stat_cache_ttl)
+
+    resolver = _ShardResolver(mappings)
+
+    def on_folders(folders: list[CheckedFolder]) -> None:
+        records = resolver.resolve(folders)
+        if records:
+            connection.send(records)
+
+    event_pipeline, event_handler = build_event_handler(on_folders)
+    pruner = WatchPruner(user_input.ignore_dirs, user_input.shallow_dirs)
+    observer = build_observer(pruner)
+    watch_manager = WatchManager(observer, event_handler, pruner)
+    watch_manager.sync(roots)
+    event_pipeline.start()
+    observer.start()
+    logging.info(f"Shard {index} is watching {len(roots)} folder trees")
+    try:
+        while True:
+            message = connection.recv()
+            if message[0] == STOP:
+                break
+            _, roots, mappings = message
+            resolver.update(mappings)
+            watch_manager.sync(roots)
+    except EOFError:
+        pass  # The coordinator is gone
+    observer.unschedule_all()
+    observer.stop()
+    observer.join()
+    # Sends the records of the events already received
+    event_pipeline.stop()
+    try:
+        connection.send(None)
+    except OSError:
+        pass
+
+
+class ShardPool:
+    """
+    Watches the library folders from --shards worker processes instead of the daemon process.
+
+    Every worker runs its own observer, event filter, path checks and section resolution on a share
+    of the watch roots, so they are no longer bound to a single core. Only compact, already resolved
+    ShardRecord batches are sent back over a pipe, to a reader thread of this process which hands them
+    over to the service event loop: the queues and Plex dispatch stay in this process.
+    """
+
+    def __init__(self, shards: int, pruner: WatchPruner):
+        self.__shards = shards
+        self.__pruner = pruner
+        self.__context = multiprocessing.get_context("spawn")
+        self.__processes: list[multiprocessing.Process] = []
+        self.__connections: list[Connection] = []
+        self.__sizes: dict[Path, int] = {}
+        self.__assigned: list[list[Path]] = []
+        self.__reader: Optional[Thread] = None
+        self.__stopping = False
+
+    def assign(self, paths: Iterable[Path]) -> list[list[Path]]:
+        """
+        Balances the watch roots of the paths over the shards by their number of watched folders.
+        New roots are walked once, their size is kept for the next calls, and the roots already assigned
+        stay on their shard.
+        :return: The watch roots of every shard.
+        """
+        roots = cover_roots(paths, self.__pruner)
+        for root in roots:
+            if root not in self.__sizes:
+                self.__sizes[root] = count_watches([root], self.__pruner)
+        self.__assigned = assign_shards(roots, self.__shards, self.__sizes, self.__assigned)
+        return self.__assigned
+
+    @property
+    def roots(self) -> list[Path]:
+        """
+        The watch roots of the last assignment, over every shard.
+        """
+        return [root for shard_roots in self.__assigned for root in shard_roots]
+
+    def count_watches(self, roots: Iterable[Path]) -> int:
+        """
+        :return: The number of watched folders under assigned roots, without walking them again.
+        """
+        return sum(self.__sizes.get(root, 1) for root in roots)
+
+    def start(self, assigned: list[list[Path]], mappings: Mappings) -> None:
+        for index, roots in enumerate(assigned):
+            coordinator_end, worker_end = self.__context.Pipe()
+            process = self.__context.Process(
+                target=run_shard, name=f"shard-{index}", daemon=True,
+                args=(index, shared.user_input, plex_agents.script_start_time, roots, mappings, worker_end)
+            )
+            process.start()
+            worker_end.close()
+            self.__processes.append(process)
+            self.__connections.append(coordinator_end)
+        self.__reader = Thread(target=self.__read_loop, name="shard-reader", daemon=True)
+        self.__reader.start()
+
+    def __read_loop(self) -> None:
+        pending = list(self.__connections)
+        while pending:
+            for connection in wait(pending):
+                try:
+                    records = connection.recv()
+                except (EOFError, OSError):
+                    records = None
+                    if not self.__stopping:
+                        logging.error(f"Shard {self.__connections.index(connection)} exited, its folders are not watched anymore")
+                if records is None:
+                    pending.remove(connection)
+                    continue
+                plex_agents.queue_resolved_threadsafe(records)
+
+    def sync(self, assigned: list[list[Path]], mappings: Mappings) -> None:
+        """
+        Sends new watch roots and folder mappings to the workers, e.g. after a library change.
+        """
+        for connection, roots in zip(self.__connections, assigned):
+            try:
+                connection.send((SYNC, roots, mappings))
+            except OSError as e:
+                logging.warning(f"Could not update shard {self.__connections.index(connection)}: {e}")
+
+    def stop(self) -> None:
+        """
+        Stops the workers once they sent the records of the events they already received.
+        """
+        self.__stopping = True
+        for connection in self.__connections:
+            try:
+                connection.send((STOP,))
+            except OSError:
+                pass
+        if self.__reader is not None:
+            self.__reader.join()
+        for process in self.__processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
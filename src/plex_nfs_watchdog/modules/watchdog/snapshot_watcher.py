@@ -0,0 +1,174 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import NamedTuple, Optional
+
+from watchdog.events import DirCreatedEvent, DirDeletedEvent, DirModifiedEvent
+from watchdog.observers.api import DEFAULT_EMITTER_TIMEOUT, BaseObserver, EventEmitter
+
+from .watch_budget import WatchPruner
+
+# Directory mtimes this close to the poll time may hide a later change on filesystems with
+# a coarse timestamp resolution, so such directories are listed again on the next poll.
+RACY_WINDOW_NS: int = 2 * 10 ** 9
+
+
+class DirState(NamedTuple):
+    mtime_ns: int
+    entry_count: int
+    subdirs: tuple[str, ...]
+
+
+def list_dir(path: str) -> Optional[DirState]:
+    """
+    Lists a directory into its compact index state.
+    :return: The directory state, or None if it can't be read anymore.
+    """
+    try:
+        # Stat first: a change made while listing then shows up as a new mtime on the next poll
+        mtime_ns = os.stat(path).st_mtime_ns
+        entry_count = 0
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                entry_count += 1
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+        return DirState(mtime_ns, entry_count, tuple(subdirs))
+    except OSError:
+        return None
+
+
+def entries_changed(old_state: DirState, state: DirState, new_subdirs: int) -> bool:
+    """
+    Tells whether a folder changed otherwise than by the given number of new subdirectories, which are
+    reported on their own: an entry was removed or renamed, or another entry was added.
+    A file renamed while a subdirectory is created in the same folder goes unnoticed.
+    """
+    if state == old_state:
+        return False
+    if not new_subdirs or not set(old_state.subdirs).issubset(state.subdirs):
+        return True
+    return state.entry_count - old_state.entry_count != new_subdirs
+
+
+def stat_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class SnapshotEmitter(EventEmitter):
+    """
+    Incremental polling emitter for mounts on which inotify doesn't fire (e.g. NFS/CIFS clients).
+
+    Instead of re-walking and re-stating every file like watchdog's PollingEmitter, it keeps
+    a compact index of the watched directories (mtime, entry count and subdirectory names).
+    Every poll only stats the known directories, spread across a thread pool, and lists again
+    the ones whose mtime changed. Changes are reported at the folder level, which is all Plex
+    partial-scans need: a DirCreatedEvent or DirDeletedEvent for folders that appeared or vanished,
+    and a DirModifiedEvent for folders whose other entries changed, or that lost a subdirectory. Folders pruned by the WatchPruner are not indexed.
+    """
+
+    def __init__(self, event_queue, watch, timeout=DEFAULT_EMITTER_TIMEOUT, event_filter=None, workers: int = 8,
+                 pruner: WatchPruner = WatchPruner((), ())):
+        super().__init__(event_queue, watch, timeout, event_filter)
+        self.__workers = workers
+        self.__pruner = pruner
+        self.__pool: Optional[ThreadPoolExecutor] = None
+        self.__index: dict[str, DirState] = {}
+        self.__racy: set[str] = set()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix="snapshot-stat") as pool:
+            self.__pool = pool
+            start = time.monotonic()
+            self.__walk([self.watch.path], time.time_ns())
+            logging.info(
+                f"Indexed {len(self.__index)} folders under {self.watch.path} in {time.monotonic() - start:.1f}s"
+            )
+            super().run()
+
+    def __walk(self, roots: list[str], poll_time_ns: int) -> None:
+        """
+        Indexes the given folders, and their whole subtree if the watch is recursive, level by level.
+        """
+        frontier = roots
+        while frontier:
+            next_frontier = []
+            for path, state in zip(frontier, self.__pool.map(list_dir, frontier)):
+                if state is None:
+                    continue
+                self.__store(path, state, poll_time_ns)
+                next_frontier.extend(self.__watched_subdirs(path, state))
+            frontier = next_frontier
+
+    def __watched_subdirs(self, path: str, state: DirState) -> list[str]:
+        if not self.watch.is_recursive:
+            return []
+        if path != self.watch.path and not self.__pruner.descends(os.path.basename(path)):
+            return []
+        return [os.path.join(path, name) for name in state.subdirs if self.__pruner.watches(name)]
+
+    def __store(self, path: str, state: DirState, poll_time_ns: int) -> None:
+        self.__index[path] = state
+        if state.mtime_ns >= poll_time_ns - RACY_WINDOW_NS:
+            self.__racy.add(path)
+        else:
+            self.__racy.discard(path)
+
+    def __forget(self, path: str) -> None:
+        prefix = path + os.sep
+        for indexed_path in [p for p in self.__index if p == path or p.startswith(prefix)]:
+            del self.__index[indexed_path]
+            self.__racy.discard(indexed_path)
+
+    def queue_events(self, timeout):
+        # timeout behaves like an interval for polling emitters
+        if self.stopped_event.wait(timeout):
+            return
+        poll_time_ns = time.time_ns()
+
+        paths = list(self.__index)
+        changed = []
+        for path, mtime_ns in zip(paths, self.__pool.map(stat_mtime, paths, chunksize=256)):
+            if path not in self.__index:
+                continue  # Forgotten along with a vanished ancestor
+            if mtime_ns is None:
+                self.__forget(path)
+                self.queue_event(DirDeletedEvent(path))
+            elif mtime_ns != self.__index[path].mtime_ns or path in self.__racy:
+                changed.append(path)
+
+        for path, state in zip(changed, self.__pool.map(list_dir, changed)):
+            old_state = self.__index.get(path)
+            if old_state is None:
+                continue
+            if state is None:
+                self.__forget(path)
+                self.queue_event(DirDeletedEvent(path))
+                continue
+            self.__store(path, state, poll_time_ns)
+            if state == old_state:
+                continue  # Listed again only because its mtime was racy
+
+            old_subdirs = {os.path.join(path, name) for name in old_state.subdirs}
+            new_subdirs = [subdir for subdir in self.__watched_subdirs(path, state) if subdir not in old_subdirs]
+            # A new subdirectory is scanned on its own, the folder only if its other entries changed
+            if entries_changed(old_state, state, len(new_subdirs)):
+                self.queue_event(DirModifiedEvent(path))
+            for new_subdir in new_subdirs:
+                self.queue_event(DirCreatedEvent(new_subdir))
+            self.__walk(new_subdirs, poll_time_ns)
+
+
+class SnapshotObserver(BaseObserver):
+    """
+    Observer polling its watches with SnapshotEmitter, every poll_interval seconds.
+    """
+
+    def __init__(self, poll_interval: float, workers: int, pruner: WatchPruner = WatchPruner((), ())):
+        super().__init__(partial(SnapshotEmitter, workers=workers, pruner=pruner), timeout=poll_interval)
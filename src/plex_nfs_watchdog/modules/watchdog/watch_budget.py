@@ -0,0 +1,103 @@
+import logging
+import os
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+INOTIFY_LIMIT_PATH: str = "/proc/sys/fs/inotify/max_user_watches"
+# Share of the inotify limit from which a warning is logged, other processes of the user need watches too
+INOTIFY_WARNING_RATIO: float = 0.8
+
+
+class WatchPruner:
+    """
+    Decides which folders below a watch root are watched.
+
+    Folders named like ignored_dirs are not watched at all: events inside them are ignored anyway.
+    Folders named like shallow_dirs (artwork, ...) are watched, but not their sub-folders, so the
+    watch budget goes to the folders where media changes.
+    """
+
+    def __init__(self, ignored_dirs: Iterable[str], shallow_dirs: Iterable[str]):
+        self.__ignored_dirs = frozenset(ignored_dirs)
+        self.__shallow_dirs = frozenset(shallow_dirs)
+
+    def __bool__(self) -> bool:
+        return bool(self.__ignored_dirs or self.__shallow_dirs)
+
+    def watches(self, name: str) -> bool:
+        """
+        :return: True if a folder with this name is watched, provided its parent folder is watched recursively.
+        """
+        return name not in self.__ignored_dirs
+
+    def descends(self, name: str) -> bool:
+        """
+        :return: True if the sub-folders of a watched folder with this name are watched too.
+        """
+        return name not in self.__ignored_dirs and name not in self.__shallow_dirs
+
+    def covers(self, relative_parts: Sequence[str]) -> bool:
+        """
+        :return: True if the whole subtree of a folder is watched through a recursive watch
+                 of its ancestor, given the folder path relative to that ancestor.
+        """
+        return all(self.descends(name) for name in relative_parts)
+
+
+def count_watches(roots: Iterable[Path], pruner: WatchPruner) -> int:
+    """
+    Walks the watch roots like a recursive inotify watch would, without following symbolic links.
+    :return: The number of folders that would get an inotify watch.
+    """
+    count = 0
+    for root in roots:
+        stack = [str(root)]
+        count += 1
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if not entry.is_dir(follow_symlinks=False) or not pruner.watches(entry.name):
+                            continue
+                        count += 1
+                        if pruner.descends(entry.name):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+    return count
+
+
+def inotify_watch_limit() -> Optional[int]:
+    """
+    :return: The maximum number of inotify watches of a user, or None if it is unknown (e.g. not on Linux).
+    """
+    try:
+        with open(INOTIFY_LIMIT_PATH, "r") as limit_file:
+            return int(limit_file.read())
+    except (OSError, ValueError):
+        return None
+
+
+def report_watch_budget(roots: Sequence[Path], pruner: WatchPruner, count: Optional[int] = None) -> None:
+    """
+    Logs the estimated number of inotify watches needed for the roots against the kernel limit.
+    :param count: The number of watches if it is already known, the roots are walked otherwise.
+    """
+    limit = inotify_watch_limit()
+    if limit is None:
+        return
+    if count is None:
+        count = count_watches(roots, pruner)
+    message = (
+        f"Watching {len(roots)} folder trees needs about {count} inotify watches, "
+        f"the limit is {limit} (fs.inotify.max_user_watches)"
+    )
+    if count >= limit:
+        logging.error(
+            f"{message}: changes in some folders will be missed. Raise it, e.g. with "
+            f"'sysctl fs.inotify.max_user_watches={count * 2}', or use --shallow-dirs or --watcher poll"
+        )
+    elif count >= limit * INOTIFY_WARNING_RATIO:
+        logging.warning(f"{message}, shared with the other processes of the user (e.g. Plex itself)")
+    else:
+        logging.info(message)
@@ -0,0 +1,88 @@
+import logging
+import sys
+from pathlib import Path
+from threading import Lock
+from typing import Iterable
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers.api import BaseObserver, ObservedWatch
+
+from .snapshot_watcher import SnapshotObserver
+from .watch_budget import WatchPruner
+from ..config import shared
+
+
+def build_observer(pruner: WatchPruner) -> BaseObserver:
+    """
+    Builds the observer selected by --watcher.
+    """
+    if shared.user_input.watcher == "poll":
+        return SnapshotObserver(shared.user_input.poll_interval, shared.user_input.poll_workers, pruner)
+    if sys.platform.startswith("linux"):
+        # watchdog's inotify modules can only be imported on Linux
+        from .pruned_inotify import PrunedInotifyObserver
+        return PrunedInotifyObserver(pruner)
+    from watchdog.observers import Observer
+    return Observer()
+
+
+def cover_roots(paths: Iterable[Path], pruner: WatchPruner) -> set[Path]:
+    """
+    :param paths: Resolved folders, so that symbolic links to the same folder are equal.
+    :return: The folders not already watched through a recursive watch of one of the others.
+    """
+    roots = []
+    for path in sorted(set(paths), key=lambda p: len(p.parts)):
+        covering = next(
+            (root for root in roots if root in path.parents and pruner.covers(path.relative_to(root).parts)),
+            None
+        )
+        if covering is not None:
+            logging.info(f"{path} is already watched through {covering}")
+            continue
+        roots.append(path)
+    return set(roots)
+
+
+class WatchManager:
+    """
+    Keeps the watches of an observer in line with the folders to watch, adding and removing
+    watches while the observer runs, so the other watches never miss an event.
+
+    Only a minimal covering set of the folders is watched: a folder inside another watched folder
+    already gets its events through it, watching it again would double its events and inotify watches.
+    """
+
+    def __init__(self, observer: BaseObserver, event_handler: FileSystemEventHandler, pruner: WatchPruner):
+        self.__observer = observer
+        self.__event_handler = event_handler
+        self.__pruner = pruner
+        self.__watches: dict[Path, ObservedWatch] = {}
+        self.__lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.__watches)
+
+    @property
+    def roots(self) -> list[Path]:
+        with self.__lock:
+            return sorted(self.__watches)
+
+    def sync(self, paths: Iterable[Path]) -> None:
+        """
+        Watches the given folders recursively, through a minimal covering set of watches.
+        """
+        wanted = cover_roots(paths, self.__pruner)
+        with self.__lock:
+            for path in sorted(self.__watches.keys() - wanted):
+                logging.info(f"Unscheduling watcher for {path}")
+                try:
+                    self.__observer.unschedule(self.__watches.pop(path))
+                except KeyError:
+                    pass  # Already dropped by the observer
+            for path in sorted(wanted - self.__watches.keys()):
+                logging.info(f"Scheduling watcher for {path}")
+                try:
+                    self.__watches[path] = self.__observer.schedule(self.__event_handler, str(path), recursive=True)
+                except OSError as e:
+                    logging.warning(f"Could not watch {path}: {e}")
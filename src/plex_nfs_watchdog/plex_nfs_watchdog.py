@@ -1,18 +1,23 @@
 import argparse
+import asyncio
 import logging
+import signal
 import time
 import colorlog
 import sys
 import os
 from pathlib import Path
-from watchdog.observers import Observer
+from typing import Callable, Optional
 
 # Adjust this if needed
 sys.path.append(os.path.join(os.path.dirname(__file__), "."))
 
-from modules.watchdog.plex_watchdog_event import PlexWatchdog
 from modules.config import shared
-from modules.plex.plex_agent import plex_agent_singleton
+from modules.control import control_socket
+from modules.plex.plex_agent_group import plex_agents
+
+# The watchdog modules, and plexapi through the Plex agents, are only imported by the daemon:
+# --scan is run by post-processing hooks thousands of times a day and must start fast
 
 SCRIPT_START_TIME = time.time()
 
@@ -33,9 +38,9 @@ logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("watchdog").setLevel(logging.WARNING)
 
 
-def get_args_from_cli() -> None:
+def get_args_from_cli(argv: Optional[list[str]] = None) -> None:
     """
-    Parses the command line arguments and stores them in shared.user_input.
+    Parses the command line arguments, or argv if given, and stores them in shared.user_input.
 
     If --paths is not passed, we'll watch all library paths from Plex.
     """
@@ -59,11 +64,11 @@ def get_args_from_cli() -> None:
         help="A list of folder paths. If omitted, all Plex library folders are monitored."
     )
     parser.add_argument(
-        "--host", "-H", action="store", help="The host of the Plex server",
-        type=str, default="http://localhost:32400", required=False
+        "--host", "-H", action="store", nargs='+', help="The hosts of the Plex servers to notify",
+        type=str, default=["http://localhost:32400"], required=False
     )
     parser.add_argument(
-        "--token", "-t", action="store", help="The Plex server token",
+        "--token", "-t", action="store", nargs='+', help="The Plex server tokens, one per host or one for all",
         type=str, default=None, required=False
     )
     parser.add_argument(
@@ -71,7 +76,151 @@ def get_args_from_cli() -> None:
         help="Dry run mode, does not send any request for partial-scans"
     )
     parser.add_argument(
-        "--interval", "-i", help="Interval in seconds between partial-scans",
+        "--interval", "-i", help="Maximum delay in seconds between a change and its partial-scan",
+        action="store", type=int, required=False, default=None
+    )
+    parser.add_argument(
+        "--quiet-period", "-q",
+        help="Seconds without new events a path must wait before it is scanned, at most --interval",
+        action="store", type=float, required=False, default=5.0
+    )
+    parser.add_argument(
+        "--workers", "-w", help="Number of concurrent partial-scan requests sent to Plex",
+        action="store", type=int, required=False, default=4
+    )
+    parser.add_argument(
+        "--max-rps", help="Maximum partial-scan requests per second sent to Plex, 0 for no limit",
+        action="store", type=float, required=False, default=10.0
+    )
+    parser.add_argument(
+        "--watcher", action="store", type=str, required=False, choices=["native", "poll"], default="native",
+        help="How changes are detected: native filesystem notifications (inotify, ...), "
+             "or polling folder modification times for mounts on which notifications don't fire"
+    )
+    parser.add_argument(
+        "--poll-interval", help="Seconds between two polls of the watched folders with --watcher poll",
+        action="store", type=float, required=False, default=30.0
+    )
+    parser.add_argument(
+        "--poll-workers", help="Number of threads checking folders during a poll with --watcher poll",
+        action="store", type=int, required=False, default=8
+    )
+    parser.add_argument(
+        "--extensions", action="store", nargs='+', required=False, default=shared.supported_ext,
+        help="File extensions whose events are processed, '*' processes every file", type=str
+    )
+    parser.add_argument(
+        "--include", action="store", nargs='+', required=False, default=[],
+        help="Glob patterns a file path must match for its events to be processed", type=str
+    )
+    parser.add_argument(
+        "--exclude", action="store", nargs='+', required=False, default=[],
+        help="Glob patterns of paths whose events are ignored", type=str
+    )
+    parser.add_argument(
+        "--ignore-dirs", action="store", nargs='+', required=False, default=shared.ignored_dirs,
+        help="Folder names whose content is never watched for changes", type=str
+    )
+    parser.add_argument(
+        "--shallow-dirs", action="store", nargs='+', required=False, default=[],
+        help="Folder names watched without their sub-folders, for folders that never hold media (artwork, ...)",
+        type=str
+    )
+    parser.add_argument(
+        "--event-queue-size", help="Maximum number of filesystem events waiting to be processed",
+        action="store", type=int, required=False, default=10000
+    )
+    parser.add_argument(
+        "--stat-workers", help="Number of threads checking event paths on the filesystem",
+        action="store", type=int, required=False, default=8
+    )
+    parser.add_argument(
+        "--shards", help="Number of worker processes sharing the watched folders, each with its own watcher, "
+                         "for libraries too large for a single core; 1 watches from the daemon process",
+        action="store", type=int, required=False, default=1
+    )
+    parser.add_argument(
+        "--stat-cache-ttl", help="Seconds a checked folder is trusted before events inside it touch the filesystem "
+                                 "again, 0 disables the cache",
+        action="store", type=float, required=False, default=5.0
+    )
+    parser.add_argument(
+        "--backpressure", help="What to do with new events when the event queue is full: "
+                               "reduce them to their parent folder, or block the watcher until there is room",
+        action="store", type=str, required=False, choices=["parent", "block"], default="parent"
+    )
+    parser.add_argument(
+        "--no-journal", action='store_true',
+        help="Do not keep pending scans in an on-disk journal, so they are lost if the daemon stops"
+    )
+    parser.add_argument(
+        "--retry-base", help="Seconds before checking again a refreshing section or retrying a failed scan, "
+                             "doubled on every new attempt",
+        action="store", type=float, required=False, default=30.0
+    )
+    parser.add_argument(
+        "--retry-max", help="Maximum seconds between two checks of a refreshing section or retries of a failed scan",
+        action="store", type=float, required=False, default=900.0
+    )
+    parser.add_argument(
+        "--escalate-count", help="Queued folders of a section from which a batch is replaced by a full section scan, "
+                                 "0 disables it",
+        action="store", type=int, required=False, default=500
+    )
+    parser.add_argument(
+        "--escalate-ratio", help="Share of a section's top-level items touched by a batch from which it is replaced "
+                                 "by a full section scan, 0 disables it",
+        action="store", type=float, required=False, default=0.5
+    )
+    parser.add_argument(
+        "--merge-siblings", help="Queued sibling folders from which they are scanned through their parent, "
+                                 "0 disables it",
+        action="store", type=int, required=False, default=5
+    )
+    parser.add_argument(
+        "--max-queued-scans", help="Pending scans per Plex server from which new ones are collapsed into their "
+                                   "parent folders to bound memory, 0 disables it",
+        action="store", type=int, required=False, default=50000
+    )
+    parser.add_argument(
+        "--no-catch-up", action='store_true',
+        help="Do not snapshot the watched folders to catch up on the changes made while the daemon was stopped"
+    )
+    parser.add_argument(
+        "--snapshot-interval", help="Seconds between two saves of the folder snapshot, which walk every watched folder, "
+                                    "besides the one when the daemon stops; 0 only saves it then",
+        action="store", type=float, required=False, default=0.0
+    )
+    parser.add_argument(
+        "--library-refresh", help="Seconds between two checks of the Plex library folders in daemon mode, 0 disables it",
+        action="store", type=float, required=False, default=300.0
+    )
+    parser.add_argument(
+        "--verify", action='store_true',
+        help="Skip the partial-scans of folders whose files Plex already indexed with the same size and mtime"
+    )
+    parser.add_argument(
+        "--verify-ttl", help="Seconds the library contents fetched for --verify are reused",
+        action="store", type=float, required=False, default=60.0
+    )
+    parser.add_argument(
+        "--via-daemon", action='store_true',
+        help="With --scan, hands the folders to the running daemon instead of scanning them directly"
+    )
+    parser.add_argument(
+        "--control-socket", help="Unix socket on which the daemon takes the folders of --scan --via-daemon",
+        action="store", type=Path, required=False, default=shared.control_socket_path
+    )
+    parser.add_argument(
+        "--sections-ttl", help="Seconds the library sections cached for --scan are used before being fetched again",
+        action="store", type=float, required=False, default=3600.0
+    )
+    parser.add_argument(
+        "--record-events", help="Records every filesystem event received in daemon mode to this file, for replay",
+        action="store", type=Path, required=False, default=None
+    )
+    parser.add_argument(
+        "--metrics-port", help="Serves Prometheus metrics on this port while running as a daemon",
         action="store", type=int, required=False, default=None
     )
     parser.add_argument(
@@ -84,13 +233,48 @@ def get_args_from_cli() -> None:
         choices=shared.listeners_type, default=None
     )
 
-    shared.user_input = parser.parse_args()
+    shared.user_input = parser.parse_args(argv)
 
     # Validate daemon-related args
     if shared.user_input.daemon and (shared.user_input.interval is None or shared.user_input.interval <= 0):
         parser.error("--interval is required when using --daemon. It must be a positive integer.")
     if shared.user_input.daemon and shared.user_input.listeners is None:
         parser.error("--listeners is required when using --daemon. Must be a valid event type.")
+    if shared.user_input.quiet_period < 0:
+        parser.error("--quiet-period must not be negative.")
+    if shared.user_input.interval is not None:
+        shared.user_input.quiet_period = min(shared.user_input.quiet_period, shared.user_input.interval)
+    if shared.user_input.daemon and shared.user_input.watcher == "poll" and "modify" not in shared.user_input.listeners:
+        parser.error("--watcher poll reports changes as folder modifications, it requires the 'modify' listener.")
+    if shared.user_input.poll_interval <= 0 or shared.user_input.poll_workers <= 0:
+        parser.error("--poll-interval and --poll-workers must be positive.")
+    if shared.user_input.workers <= 0:
+        parser.error("--workers must be a positive integer.")
+    if shared.user_input.max_rps < 0:
+        parser.error("--max-rps must not be negative.")
+    if shared.user_input.token is not None and len(shared.user_input.token) not in (1, len(shared.user_input.host)):
+        parser.error("--token needs either a single token or one token per --host.")
+    if shared.user_input.retry_base <= 0 or shared.user_input.retry_max < shared.user_input.retry_base:
+        parser.error("--retry-base must be positive and not greater than --retry-max.")
+    if shared.user_input.escalate_count < 0 or shared.user_input.merge_siblings < 0 \
+            or shared.user_input.max_queued_scans < 0:
+        parser.error("--escalate-count, --merge-siblings and --max-queued-scans must not be negative.")
+    if not 0 <= shared.user_input.escalate_ratio <= 1:
+        parser.error("--escalate-ratio must be between 0 and 1.")
+    if shared.user_input.library_refresh < 0 or shared.user_input.snapshot_interval < 0:
+        parser.error("--library-refresh and --snapshot-interval must not be negative.")
+    if shared.user_input.verify_ttl < 0 or shared.user_input.sections_ttl < 0 or shared.user_input.stat_cache_ttl < 0:
+        parser.error("--verify-ttl, --sections-ttl and --stat-cache-ttl must not be negative.")
+    if shared.user_input.via_daemon and not shared.user_input.scan:
+        parser.error("--via-daemon only applies to --scan.")
+    if shared.user_input.via_daemon and not control_socket.is_supported():
+        parser.error("--via-daemon needs Unix domain sockets, which this platform does not support.")
+    if shared.user_input.event_queue_size <= 0 or shared.user_input.stat_workers <= 0:
+        parser.error("--event-queue-size and --stat-workers must be positive integers.")
+    if shared.user_input.shards <= 0:
+        parser.error("--shards must be a positive integer.")
+    if shared.user_input.shards > 1 and shared.user_input.record_events is not None:
+        parser.error("--record-events records the events of the daemon process, it can't be used with --shards.")
 
     # If user provided --paths, validate them; else None
     if shared.user_input.paths:
@@ -104,84 +288,261 @@ def get_args_from_cli() -> None:
     else:
         shared.user_input.paths = None
 
-    # Ensure we have a Plex token or a cached config
-    if shared.user_input.token is None and not plex_agent_singleton.is_cache_loaded():
+    # Ensure we have a Plex token or a cached config, the daemon has its own
+    if shared.user_input.token is None and not plex_agents.is_cache_loaded() and not shared.user_input.via_daemon:
         parser.error("Plex host and token are missing!")
 
 
+def scan_via_daemon() -> bool:
+    """
+    Hands the --scan folders over to the running daemon, which queues them like watched events.
+    Once the request is sent, a failure is reported instead of scanning the folders directly,
+    as the daemon may have queued them already.
+    :return: False if no daemon could be reached.
+    """
+    folders = sorted(path.absolute() for path in shared.user_input.paths) if shared.user_input.paths else None
+    try:
+        reply = control_socket.submit_scans(shared.user_input.control_socket, folders)
+    except (FileNotFoundError, ConnectionRefusedError) as e:
+        logging.warning(f"Could not reach the daemon on {shared.user_input.control_socket}: {e}")
+        return False
+    except ValueError as e:
+        logging.error(f"Could not read the reply of the daemon, protocol error: {e}")
+        sys.exit(-1)
+    except OSError as e:
+        logging.error(f"Could not hand the folders over to the daemon: {e}")
+        sys.exit(-1)
+    if not reply.get("ok"):
+        logging.error(f"The daemon rejected the scans: {reply.get('error')}")
+        sys.exit(-1)
+    for folder in reply["unmatched"]:
+        logging.error(f"Could not map '{folder}' to any known Plex section.")
+    logging.info(f"The daemon queued {reply['queued']} folders to scan")
+    return True
+
+
+def get_watch_paths(paths: set[Path]) -> list[Path]:
+    """
+    Filters out the paths that don't match any library folder.
+    :return: The resolved folders to watch.
+    """
+    valid_paths = []
+    for given_path in paths:
+        full_path = given_path.resolve()
+        if not plex_agents.is_library_path(given_path):
+            logging.warning(f"{full_path} does not correspond to any known Plex library folder, skipping...")
+            continue
+        if not full_path.is_dir():
+            logging.warning(f"{full_path} is not a local folder, skipping...")
+            continue
+        valid_paths.append(full_path)
+    return valid_paths
+
+
+async def run_daemon(start_watching: Callable[[], None], stop_watching: Callable[[], None],
+                     control_server: Optional[control_socket.ControlServer],
+                     on_library_change: Callable[[], None]) -> None:
+    """
+    Runs the daemon on the service event loop until SIGINT or SIGTERM, then stops it: the watchers first,
+    so that the events they already reported are queued and journaled, then the scan services.
+    Blocking start and stop calls run on the loop's default executor.
+    """
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+
+    def on_signal():
+        logging.warning("Detected a stop signal, stopping PlexNFSWatchdog...")
+        stopped.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, on_signal)
+        except NotImplementedError:
+            pass  # Windows: Ctrl-C raises a KeyboardInterrupt, which cancels this task
+
+    await plex_agents.start_service()
+    try:
+        if shared.user_input.library_refresh > 0:
+            plex_agents.start_library_refresh(shared.user_input.library_refresh, on_library_change)
+        if control_server is not None:
+            control_server.start()
+        logging.info("Registering watchers...")
+        await loop.run_in_executor(None, start_watching)
+        logging.info("Ready to operate...")
+        await stopped.wait()
+    finally:
+        if control_server is not None:
+            await loop.run_in_executor(None, control_server.stop)
+        await loop.run_in_executor(None, stop_watching)
+        await plex_agents.stop_service()
+
+
 def main() -> None:
     # If we already have a cached Plex config, load it
     if shared.cache_path.exists():
-        plex_agent_singleton.load_config_cache()
+        plex_agents.load_config_cache()
 
     # Parse CLI arguments
     get_args_from_cli()
 
+    if shared.user_input.via_daemon:
+        if scan_via_daemon():
+            return
+        if shared.user_input.token is None and not plex_agents.is_cache_loaded():
+            logging.error("Plex host and token are missing to scan without the daemon!")
+            sys.exit(-1)
+        logging.warning("Scanning without the daemon")
+
+    # A manual scan only needs the cached library sections and a request per scan, see QuickScanner
+    if shared.user_input.scan and not shared.user_input.verify:
+        plex_agents.quick_scan(shared.user_input.paths)
+        return
+
     # Let the agent know script start time if needed
-    plex_agent_singleton.set_script_start_time(SCRIPT_START_TIME)
+    plex_agents.set_script_start_time(SCRIPT_START_TIME)
 
     # Connect to Plex
-    plex_agent_singleton.connect()
+    plex_agents.connect()
 
     # If no paths were specified, default to all library folder paths
-    if shared.user_input.paths is None:
-        library_paths = plex_agent_singleton.get_all_library_paths()
+    watch_all_libraries = shared.user_input.paths is None
+    if watch_all_libraries:
+        library_paths = plex_agents.get_all_library_paths()
         if not library_paths:
             logging.error("No library paths found in Plex. Exiting.")
             sys.exit(-1)
         shared.user_input.paths = library_paths
         logging.info("No --paths specified. Monitoring all Plex library folders by default.")
 
-    # If user just wants a manual scan
+    # If user just wants a manual scan, verified against the Plex index
     if shared.user_input.scan:
-        plex_agent_singleton.manual_scan(shared.user_input.paths)
+        plex_agents.manual_scan(shared.user_input.paths)
         return
 
     # Otherwise, daemon mode
-    event_handler = PlexWatchdog()
-    observer = Observer()
-    observers = []
+    from modules.metrics.metrics import MetricsServer
+    from modules.watchdog.event_recorder import EventRecorder
+    from modules.watchdog.plex_watchdog_event import build_event_handler
+    from modules.watchdog.watch_budget import WatchPruner, report_watch_budget
+    from modules.watchdog.watch_manager import WatchManager, build_observer
 
-    # Filter out paths that don't match any library subpath (if needed)
-    valid_paths = []
-    for given_path in shared.user_input.paths:
-        full_path = given_path.resolve()
-        matches = plex_agent_singleton.find_sections_and_subpaths(given_path)
-        if not matches:
-            logging.warning(f"{full_path} does not correspond to any known Plex library folder, skipping...")
-            continue
-        valid_paths.append(full_path)
+    plex_agents.set_stat_cache_ttl(shared.user_input.stat_cache_ttl)
+    pruner = WatchPruner(shared.user_input.ignore_dirs, shared.user_input.shallow_dirs)
 
-    for full_path in valid_paths:
-        logging.info(f"Scheduling watcher for {full_path}")
-        observer.schedule(event_handler, str(full_path), recursive=True)
-    observers.append(observer)
+    def watched_paths() -> list[Path]:
+        return get_watch_paths(plex_agents.get_all_library_paths() if watch_all_libraries else shared.user_input.paths)
 
-    if not observers or not valid_paths:
-        logging.error("No valid paths to watch, exiting...")
-        sys.exit(-1)
+    recorder = None
+    if shared.user_input.shards > 1:
+        from modules.watchdog.shards import ShardPool
+
+        def folder_mappings() -> list[dict[str, list[tuple[str, str]]]]:
+            return [agent.folder_mappings for agent in plex_agents.agents]
+
+        shard_pool = ShardPool(shared.user_input.shards, pruner)
+        assigned = shard_pool.assign(watched_paths())
+        if not any(assigned):
+            logging.error("No valid paths to watch, exiting...")
+            sys.exit(-1)
+        if shared.user_input.watcher == "native":
+            roots = [root for shard_roots in assigned for root in shard_roots]
+            report_watch_budget(roots, pruner, shard_pool.count_watches(roots))
+
+        def start_watchers():
+            shard_pool.start(assigned, folder_mappings())
+
+        stop_watchers = shard_pool.stop
+
+        def watch_roots() -> list[Path]:
+            return shard_pool.roots
 
+        def on_library_change():
+            # Library folders were added or removed in Plex: hand the new set over to the shards
+            shard_pool.sync(shard_pool.assign(watched_paths()), folder_mappings())
+    else:
+        if shared.user_input.record_events is not None:
+            recorder = EventRecorder(shared.user_input.record_events, plex_agents.get_all_library_paths())
+        event_pipeline, event_handler = build_event_handler(plex_agents.queue_paths_threadsafe, recorder)
+        observer = build_observer(pruner)
+        watch_manager = WatchManager(observer, event_handler, pruner)
+        watch_manager.sync(watched_paths())
+
+        if not watch_manager:
+            logging.error("No valid paths to watch, exiting...")
+            sys.exit(-1)
+        if shared.user_input.watcher == "native":
+            report_watch_budget(watch_manager.roots, pruner)
+
+        def start_watchers():
+            event_pipeline.start()
+            observer.start()
+
+        def stop_watchers():
+            observer.unschedule_all()
+            observer.stop()
+            if observer.is_alive():
+                observer.join()
+            event_pipeline.stop()
+
+        def on_library_change():
+            # Library folders were added or removed in Plex: watch the new set without a restart
+            watch_manager.sync(watched_paths())
+
+        def watch_roots() -> list[Path]:
+            return watch_manager.roots
+
+    dir_snapshot = None
+    if not shared.user_input.no_catch_up:
+        from modules.watchdog.dir_snapshot import DirSnapshot
+        dir_snapshot = DirSnapshot(
+            shared.dir_snapshot_path, pruner, shared.user_input.stat_workers, shared.user_input.snapshot_interval
+        )
+
+    def on_caught_up(folders: list[str]):
+        plex_agents.queue_paths_threadsafe([(folder, "catch-up") for folder in folders])
+
+    def start_watching():
+        start_watchers()
+        if dir_snapshot is not None:
+            # Once the watchers run, so that no change falls between them and the catch-up
+            dir_snapshot.start(watch_roots, on_caught_up)
+
+    def stop_watching():
+        if dir_snapshot is not None:
+            # While the watchers still run, see DirSnapshot.stop()
+            dir_snapshot.stop(watch_roots())
+        stop_watchers()
+
+    metrics_server = None
     try:
-        logging.info("Registering watchers...")
-        observer.start()
-        stop_plex_watchdog_service = plex_agent_singleton.start_service()
-        logging.info("Ready to operate...")
+        if shared.user_input.metrics_port is not None:
+            # Before the control socket is bound, a port already in use stops the daemon here
+            metrics_server = MetricsServer(shared.user_input.metrics_port)
+            metrics_server.start()
 
-        while True:
-            time.sleep(2)
+        control_server = None
+        if control_socket.is_supported():
+            try:
+                control_server = control_socket.ControlServer(
+                    shared.user_input.control_socket, plex_agents.submit_scans
+                )
+            except OSError as e:
+                logging.warning(f"Not taking scan requests from --via-daemon clients: {e}")
+
+        asyncio.run(run_daemon(start_watching, stop_watching, control_server, on_library_change))
 
     except KeyboardInterrupt:
-        logging.warning("Detected a keyboard interrupt, stopping PlexNFSWatchdog...")
-        for obs in observers:
-            obs.unschedule_all()
-            obs.stop()
-            obs.join()
-        if 'stop_plex_watchdog_service' in locals():
-            stop_plex_watchdog_service()
+        logging.warning("Detected a keyboard interrupt, stopped PlexNFSWatchdog")
 
     except OSError as os_err:
         logging.error(f"OS error: {os_err}")
 
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        if recorder is not None:
+            recorder.close()
+
 
 if __name__ == '__main__':
     main()
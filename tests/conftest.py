@@ -0,0 +1,8 @@
+import sys
+from pathlib import Path
+
+# The modules are imported as top-level packages, like plex_nfs_watchdog.py does,
+# and the benchmark helpers like the benchmarks do
+root = Path(__file__).resolve().parent.parent
+sys.path.append(str(root / "src" / "plex_nfs_watchdog"))
+sys.path.append(str(root / "benchmarks"))
@@ -0,0 +1,70 @@
+import socket
+import threading
+from pathlib import Path
+
+import pytest
+
+from modules.control import control_socket
+from modules.control.control_socket import ControlServer, submit_scans
+
+
+def serve_once(path: Path, reply: bytes) -> None:
+    """
+    Listens on path for a single client, reads its request and sends reply, if any, as is.
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(str(path))
+    listener.listen(1)
+
+    def serve():
+        with listener:
+            connection, _ = listener.accept()
+            with connection, connection.makefile("rb") as request_file:
+                request_file.readline()
+                if reply:
+                    connection.sendall(reply)
+                else:
+                    connection.recv(1)  # Until the client gives up
+
+    threading.Thread(target=serve, daemon=True).start()
+
+
+def test_submit_scans_to_the_daemon(tmp_path):
+    received = []
+
+    def on_scan(paths):
+        received.append(paths)
+        return len(paths) - 1, paths[-1:]
+
+    server = ControlServer(tmp_path / "daemon.sock", on_scan)
+    server.start()
+    try:
+        reply = submit_scans(tmp_path / "daemon.sock", [Path("/data/Movies/Foo"), Path("/elsewhere")])
+    finally:
+        server.stop()
+    assert reply == {"ok": True, "queued": 1, "unmatched": ["/elsewhere"]}
+    assert received == [[Path("/data/Movies/Foo"), Path("/elsewhere")]]
+
+
+def test_submit_scans_without_daemon(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        submit_scans(tmp_path / "daemon.sock", None)
+    # Left over by a daemon that did not stop cleanly
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(str(tmp_path / "daemon.sock"))
+    with pytest.raises(ConnectionRefusedError):
+        submit_scans(tmp_path / "daemon.sock", None)
+
+
+def test_submit_scans_times_out_once_sent(tmp_path, monkeypatch):
+    monkeypatch.setattr(control_socket, "CLIENT_TIMEOUT", 0.2)
+    serve_once(tmp_path / "daemon.sock", b"")
+    with pytest.raises(TimeoutError):
+        submit_scans(tmp_path / "daemon.sock", None)
+
+
+@pytest.mark.parametrize("reply", [b"not json\n", b"[1, 2]\n"])
+def test_submit_scans_rejects_an_invalid_reply(tmp_path, reply):
+    serve_once(tmp_path / "daemon.sock", reply)
+    with pytest.raises(ValueError):
+        submit_scans(tmp_path / "daemon.sock", None)
@@ -0,0 +1,76 @@
+import threading
+import time
+from pathlib import Path
+
+from modules.watchdog.dir_snapshot import DirSnapshot
+from modules.watchdog.watch_budget import WatchPruner
+
+
+def make_snapshot(tmp_path: Path, interval: float = 0.0) -> DirSnapshot:
+    return DirSnapshot(tmp_path / "dir_snapshot.json", WatchPruner(["@eaDir"], []), 2, interval)
+
+
+def count_walks(snapshot: DirSnapshot, before_walk=None) -> list:
+    walks = []
+    refresh = snapshot.refresh
+
+    def counted(roots):
+        walks.append(time.monotonic())
+        if before_walk is not None:
+            before_walk(len(walks))
+        return refresh(roots)
+
+    snapshot.refresh = counted
+    return walks
+
+
+def test_catch_up_reports_the_folders_added_while_stopped(tmp_path):
+    movies = tmp_path / "Movies"
+    (movies / "Foo (2020)").mkdir(parents=True)
+    snapshot = make_snapshot(tmp_path)
+    snapshot.refresh([movies])
+    snapshot.save()
+
+    (movies / "Bar (2021)" / "Extras").mkdir(parents=True)
+    snapshot = make_snapshot(tmp_path)
+    snapshot.load()
+    assert snapshot.refresh([movies]) == [str(movies / "Bar (2021)")]
+
+
+def test_stop_walks_the_folders_once(tmp_path):
+    movies = tmp_path / "Movies"
+    movies.mkdir()
+    snapshot = make_snapshot(tmp_path)
+    walks = count_walks(snapshot)
+    caught_up = []
+    snapshot.start(lambda: [movies], caught_up.extend)
+    while not walks:
+        time.sleep(0.01)
+    snapshot.stop([movies])
+    # The catch-up walk, then the last one on stop: no periodic walk by default
+    assert len(walks) == 2
+    # Nothing to catch up on without a saved index
+    assert caught_up == []
+    assert (tmp_path / "dir_snapshot.json").exists()
+
+
+def test_stop_during_a_periodic_walk_does_not_walk_again(tmp_path):
+    movies = tmp_path / "Movies"
+    movies.mkdir()
+    snapshot = make_snapshot(tmp_path, interval=0.01)
+    walking, stop_requested = threading.Event(), threading.Event()
+
+    def hold_periodic_walk(walk: int):
+        if walk == 2:
+            walking.set()
+            stop_requested.wait(5.0)
+
+    walks = count_walks(snapshot, hold_periodic_walk)
+    snapshot.start(lambda: [movies], lambda folders: None)
+    assert walking.wait(5.0)
+    stopper = threading.Thread(target=snapshot.stop, args=([movies],))
+    stopper.start()
+    time.sleep(0.05)
+    stop_requested.set()
+    stopper.join(5.0)
+    assert len(walks) == 2
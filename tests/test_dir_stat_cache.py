@@ -0,0 +1,110 @@
+import os
+import shutil
+import time
+from pathlib import Path
+
+from watchdog.events import DirMovedEvent, FileCreatedEvent
+
+from modules.plex.dir_stat_cache import DirStatCache
+from modules.plex.plex_agent_group import PlexAgentGroup
+
+
+def cached(cache, folders):
+    return [folder for folder in folders if cache.get(folder) is not None]
+
+
+def test_cache_stays_within_its_bound():
+    cache = DirStatCache(60.0, max_entries=3)
+    folders = [f"/data/Movies/{i}" for i in range(10)]
+    for folder in folders:
+        cache.put(folder, None, True)
+        assert len(cached(cache, folders)) <= 3
+    assert cache.get(folders[-1]) is not None
+
+
+def test_full_cache_drops_expired_entries_first():
+    cache = DirStatCache(0.05, max_entries=2)
+    cache.put("/data/Movies/Old", None, True)
+    time.sleep(0.06)
+    cache.put("/data/Movies/A", None, True)
+    cache.put("/data/Movies/B", None, True)
+    assert cached(cache, ["/data/Movies/Old", "/data/Movies/A", "/data/Movies/B"]) == [
+        "/data/Movies/A", "/data/Movies/B"]
+
+
+def test_entries_expire():
+    cache = DirStatCache(0.05)
+    cache.put("/data/Movies/Foo", None, True)
+    assert cache.get("/data/Movies/Foo").changed
+    time.sleep(0.06)
+    assert cache.get("/data/Movies/Foo") is None
+
+
+def test_zero_ttl_disables_the_cache(tmp_path: Path):
+    cache = DirStatCache(0.0)
+    cache.put("/data/Movies/Foo", None, True)
+    assert cache.stat(str(tmp_path), 0.0).changed
+    assert cached(cache, ["/data/Movies/Foo", str(tmp_path)]) == []
+
+
+def test_stat_tells_changed_folders_apart(tmp_path: Path):
+    cache = DirStatCache(60.0)
+    assert cache.stat(str(tmp_path), 0.0).changed
+    assert not cache.stat(str(tmp_path), time.time() + 60).changed
+    assert cache.stat(str(tmp_path / "Gone"), 0.0) is None
+
+
+def test_invalidate_subtree_keeps_sibling_prefixes():
+    cache = DirStatCache(60.0)
+    folders = ["/data/Movies/Action", "/data/Movies/Action/Foo", "/data/Movies/Actionable", "/data/Movies"]
+    for folder in folders:
+        cache.put(folder, None, True)
+    cache.invalidate("/data/Movies/Action", subtree=True)
+    assert cached(cache, folders) == ["/data/Movies/Actionable", "/data/Movies"]
+
+
+def test_nearest_existing_trusts_cached_ancestors(tmp_path: Path):
+    cache = DirStatCache(60.0)
+    (tmp_path / "Movies").mkdir()
+    assert cache.nearest_existing(str(tmp_path / "Movies" / "Foo" / "foo.mkv"), 0.0) == str(tmp_path / "Movies")
+    # A cached ancestor is returned without checking the filesystem
+    cache.put("/nowhere/Movies", None, True)
+    assert cache.nearest_existing("/nowhere/Movies/Foo", 0.0) == "/nowhere/Movies"
+
+
+def test_move_is_checked_at_both_ends():
+    event = DirMovedEvent("/data/Movies/Foo", "/data/Movies/Action/Foo")
+    assert PlexAgentGroup.get_event_paths(event) == [
+        ("moved", "/data/Movies/Action/Foo"), ("deleted", "/data/Movies/Foo")]
+    assert PlexAgentGroup.get_event_paths(FileCreatedEvent("/data/Movies/foo.mkv")) == [
+        ("created", "/data/Movies/foo.mkv")]
+
+
+def test_deleted_cached_folder_routes_to_its_parent(tmp_path: Path):
+    group = PlexAgentGroup()
+    cache = DirStatCache(60.0)
+    # start_service() would build the cache from --stat-cache-ttl
+    group._PlexAgentGroup__dir_cache = cache
+    movies = str(tmp_path / "Movies")
+    foo = os.path.join(movies, "Foo")
+    extras = os.path.join(foo, "Extras")
+    os.makedirs(extras)
+    Path(foo, "foo.mkv").touch()
+    Path(extras, "trailer.mkv").touch()
+
+    assert group.check_event_path("created", os.path.join(foo, "foo.mkv"), False) == foo
+    assert group.check_event_path("created", os.path.join(extras, "trailer.mkv"), False) == extras
+    assert cache.get(foo).changed
+
+    shutil.rmtree(foo)
+    assert group.check_event_path("deleted", foo, True) == movies
+    assert cached(cache, [foo, extras]) == []
+    # A late event from the deleted folder is not accepted from the stale cache
+    assert group.check_event_path("modified", os.path.join(foo, "foo.mkv"), False) is None
+
+
+def test_deleted_file_routes_to_its_nearest_existing_folder(tmp_path: Path):
+    group = PlexAgentGroup()
+    (tmp_path / "Movies").mkdir()
+    deleted = str(tmp_path / "Movies" / "Foo" / "foo.mkv")
+    assert group.check_event_path("deleted", deleted, False) == str(tmp_path / "Movies")
@@ -0,0 +1,52 @@
+import json
+from pathlib import Path
+
+from watchdog.events import (DirModifiedEvent, FileClosedEvent, FileCreatedEvent, FileDeletedEvent,
+                             FileMovedEvent)
+
+from modules.watchdog.event_recorder import EventRecorder
+from synthetic_tree import load_trace
+
+
+def record(path: Path, events: list) -> None:
+    recorder = EventRecorder(path, [Path("/data/TV Shows"), Path("/data/Movies")])
+    for event in events:
+        recorder.record(event)
+    recorder.close()
+
+
+def test_trace_starts_with_the_library_folders(tmp_path):
+    trace_path = tmp_path / "trace.jsonl"
+    record(trace_path, [FileCreatedEvent("/data/Movies/Foo (2020)/foo.mkv")])
+    header, event = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    assert header == {"libraries": ["/data/Movies", "/data/TV Shows"]}
+    assert event["type"] == "created" and event["src"] == "/data/Movies/Foo (2020)/foo.mkv"
+    assert event["dir"] is False
+
+
+def test_recorded_trace_replays_the_same_events(tmp_path):
+    trace_path = tmp_path / "trace.jsonl"
+    record(trace_path, [
+        FileCreatedEvent("/data/Movies/Foo (2020)/foo.mkv"),
+        DirModifiedEvent("/data/Movies/Foo (2020)"),
+        FileMovedEvent("/data/TV Shows/Bar/s01e01.part", "/data/TV Shows/Bar/s01e01.mkv"),
+        FileDeletedEvent("/data/Movies/Old (1999)/old.mkv"),
+        FileClosedEvent("/data/Movies/Foo (2020)/foo.mkv"),
+    ])
+    root = tmp_path / "root"
+    tree, events = load_trace(trace_path, root)
+
+    assert tree.sections == {"Movies": ["/data/Movies"], "TV Shows": ["/data/TV Shows"]}
+    offsets = [offset for offset, _ in events]
+    assert offsets == sorted(offsets)
+    assert [(type(event), event.src_path, event.dest_path) for _, event in events] == [
+        (FileCreatedEvent, str(root / "data/Movies/Foo (2020)/foo.mkv"), ""),
+        (DirModifiedEvent, str(root / "data/Movies/Foo (2020)"), ""),
+        (FileMovedEvent, str(root / "data/TV Shows/Bar/s01e01.part"), str(root / "data/TV Shows/Bar/s01e01.mkv")),
+        (FileDeletedEvent, str(root / "data/Movies/Old (1999)/old.mkv"), ""),
+        (FileClosedEvent, str(root / "data/Movies/Foo (2020)/foo.mkv"), ""),
+    ]
+    # The paths the events point to exist, so that they are checked like on the recording host
+    assert (root / "data/Movies/Foo (2020)/foo.mkv").is_file()
+    assert (root / "data/TV Shows/Bar/s01e01.mkv").is_file()
+    assert not (root / "data/Movies/Old (1999)").exists()
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from modules.plex.path_index import LibraryPathIndex
+
+INTERNAL_PATHS = {
+    "Movies": [("Movies", "/data/Movies"), ("Films", "/archive/Films")],
+    "Kids": [("Kids", "/data/Kids")],
+    "Everything": [("Movies", "/data/Movies"), ("Kids", "/data/Kids")],
+}
+
+
+def test_resolve_a_folder_below_a_location():
+    index = LibraryPathIndex(INTERNAL_PATHS)
+    assert index.resolve(Path("/mnt/nfs/Films/Foo (2020)")) == [("Movies", Path("Foo (2020)"))]
+
+
+def test_resolve_a_location_to_the_section_root():
+    index = LibraryPathIndex(INTERNAL_PATHS)
+    assert index.resolve(Path("/mnt/nfs/Kids")) == [("Kids", Path(".")), ("Everything", Path("."))]
+
+
+def test_resolve_every_section_sharing_a_location_in_order():
+    index = LibraryPathIndex(INTERNAL_PATHS)
+    assert index.resolve(Path("/mnt/nfs/Movies/Foo (2020)/Extras")) == [
+        ("Movies", Path("Foo (2020)/Extras")), ("Everything", Path("Foo (2020)/Extras"))
+    ]
+
+
+def test_resolve_the_deepest_match_of_each_section():
+    index = LibraryPathIndex(INTERNAL_PATHS)
+    assert index.resolve(Path("/mnt/Movies/Kids/Movies/Foo (2020)")) == [
+        ("Movies", Path("Foo (2020)")), ("Kids", Path("Movies/Foo (2020)")), ("Everything", Path("Foo (2020)"))
+    ]
+
+
+def test_resolve_an_unknown_folder():
+    index = LibraryPathIndex(INTERNAL_PATHS)
+    assert index.resolve(Path("/mnt/nfs/Music/Foo")) == []
+    assert LibraryPathIndex({}).resolve(Path("/mnt/nfs/Movies")) == []
+
+
+def test_resolve_results_are_not_shared_through_the_memo():
+    index = LibraryPathIndex(INTERNAL_PATHS, memo_size=1)
+    first = index.resolve(Path("/mnt/nfs/Movies/Foo (2020)"))
+    first.clear()
+    assert index.resolve(Path("/mnt/nfs/Movies/Foo (2020)")) == [
+        ("Movies", Path("Foo (2020)")), ("Everything", Path("Foo (2020)"))
+    ]
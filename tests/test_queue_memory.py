@@ -0,0 +1,26 @@
+import argparse
+
+import pytest
+
+from queue_memory import run
+
+
+def storm(target: str, max_queued_scans: int) -> dict:
+    return run(argparse.Namespace(
+        events=10000, sections=4, depth=3, fanout=100, seed=1, target=target,
+        max_queued_scans=max_queued_scans, samples=10, kib_per_scan=2.0,
+    ))
+
+
+@pytest.mark.parametrize("target", ["queue", "parked"])
+def test_capped_scans_stay_within_their_memory_budget(target):
+    report = storm(target, 1000)
+    assert report["samples"][-1]["pending"] <= 1000
+    assert report["samples"][-1]["collapsed"] > 0
+    assert report["traced_peak_kib"] <= report["budget_kib"]
+
+
+def test_uncapped_scans_exceed_the_budget():
+    report = storm("queue", 0)
+    assert report["samples"][-1]["pending"] > 1000
+    assert report["traced_peak_kib"] > 2.0 * 1000
@@ -0,0 +1,105 @@
+import time
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+from modules.config import shared
+from modules.plex.quick_scan import QuickScanner, load_sections_cache, save_sections_cache
+from stub_plex import StubPlexServer
+
+SECTIONS = {"Movies": ["/data/Movies"], "TV Shows": ["/data/TV Shows", "/nas/TV Shows"]}
+
+
+@pytest.fixture(scope="module")
+def stub_server():
+    server = StubPlexServer(SECTIONS)
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def stub(stub_server):
+    stub_server.refreshes.clear()
+    return stub_server
+
+
+@pytest.fixture(autouse=True)
+def user_input(monkeypatch):
+    monkeypatch.setattr(shared, "user_input", Namespace(dry_run=False), raising=False)
+    return shared.user_input
+
+
+def refreshes(stub: StubPlexServer) -> list[tuple[str, str]]:
+    return [(section_title, path) for _, section_title, path in stub.refreshes]
+
+
+def test_sections_cache_round_trip(tmp_path):
+    cache_path = tmp_path / "sections_cache.json"
+    sections = [{"key": "1", "title": "Movies", "locations": ["/data/Movies"]}]
+    save_sections_cache(cache_path, "http://plex:32400", sections)
+    assert load_sections_cache(cache_path, "http://plex:32400", ttl=60) == sections
+    assert load_sections_cache(cache_path, "http://other:32400", ttl=60) is None
+    assert load_sections_cache(tmp_path / "missing.json", "http://plex:32400", ttl=60) is None
+
+
+def test_sections_cache_expires(tmp_path):
+    cache_path = tmp_path / "sections_cache.json"
+    save_sections_cache(cache_path, "http://plex:32400", [])
+    time.sleep(0.01)
+    assert load_sections_cache(cache_path, "http://plex:32400", ttl=0) is None
+
+
+def test_scan_sends_one_request_per_location(stub, tmp_path):
+    scanner = QuickScanner(stub.url, "token", tmp_path / "sections_cache.json", ttl=60)
+    matched = scanner.scan({Path("/mnt/TV Shows/Bar/Season 1"), Path("/mnt/Music/Baz")})
+    assert matched == {Path("/mnt/TV Shows/Bar/Season 1")}
+    assert refreshes(stub) == [
+        ("TV Shows", "/data/TV Shows/Bar/Season 1"), ("TV Shows", "/nas/TV Shows/Bar/Season 1")
+    ]
+
+
+def test_scan_reuses_the_cached_sections(stub, tmp_path):
+    cache_path = tmp_path / "sections_cache.json"
+    QuickScanner(stub.url, "token", cache_path, ttl=60).scan({Path("/mnt/Movies/Foo (2020)")})
+    requests = stub.requests
+    QuickScanner(stub.url, "token", cache_path, ttl=60).scan({Path("/mnt/Movies/Bar (2021)")})
+    # A single refresh request, no section listing
+    assert stub.requests == requests + 1
+    assert refreshes(stub) == [("Movies", "/data/Movies/Foo (2020)"), ("Movies", "/data/Movies/Bar (2021)")]
+
+
+def test_section_root_refreshes_the_whole_section_once(stub, tmp_path):
+    scanner = QuickScanner(stub.url, "token", tmp_path / "sections_cache.json", ttl=60)
+    scanner.scan({Path("/mnt/Movies"), Path("/mnt/Movies/Foo (2020)")})
+    assert refreshes(stub) == [("Movies", None)]
+
+
+def test_no_paths_refreshes_every_section(stub, tmp_path):
+    QuickScanner(stub.url, "token", tmp_path / "sections_cache.json", ttl=60).scan(None)
+    assert sorted(refreshes(stub)) == [("Movies", None), ("TV Shows", None)]
+
+
+def test_unmatched_paths_fetch_the_sections_again(stub, tmp_path):
+    cache_path = tmp_path / "sections_cache.json"
+    save_sections_cache(cache_path, stub.url, [{"key": "1", "title": "Movies", "locations": ["/data/Movies"]}])
+    scanner = QuickScanner(stub.url, "token", cache_path, ttl=60)
+    assert scanner.scan({Path("/mnt/TV Shows/Bar")}) == {Path("/mnt/TV Shows/Bar")}
+    assert refreshes(stub) == [("TV Shows", "/data/TV Shows/Bar"), ("TV Shows", "/nas/TV Shows/Bar")]
+    assert len(load_sections_cache(cache_path, stub.url, ttl=60)) == 2
+
+
+def test_removed_section_fetches_the_sections_again(stub, tmp_path):
+    cache_path = tmp_path / "sections_cache.json"
+    # Re-created since the cache was written, under another key
+    save_sections_cache(cache_path, stub.url, [{"key": "9", "title": "Movies", "locations": ["/data/Movies"]}])
+    QuickScanner(stub.url, "token", cache_path, ttl=60).scan({Path("/mnt/Movies/Foo (2020)")})
+    assert refreshes(stub) == [("Movies", "/data/Movies/Foo (2020)")]
+
+
+def test_dry_run_sends_no_refresh(stub, tmp_path, user_input):
+    user_input.dry_run = True
+    scanner = QuickScanner(stub.url, "token", tmp_path / "sections_cache.json", ttl=60)
+    assert scanner.scan({Path("/mnt/Movies/Foo (2020)")}) == {Path("/mnt/Movies/Foo (2020)")}
+    assert refreshes(stub) == []
@@ -0,0 +1,117 @@
+from pathlib import Path
+
+import pytest
+
+from modules.plex import retry_state
+from modules.plex.retry_state import FAILING, IDLE, REFRESHING, CircuitBreaker, SectionTracker, backoff_delay
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(retry_state, "time", fake)
+    return fake
+
+
+def test_backoff_delay_doubles_up_to_the_max_delay():
+    for attempt in range(5):
+        assert 2.0 * 2 ** attempt * 0.5 <= backoff_delay(attempt, 2.0, 600.0) <= 2.0 * 2 ** attempt
+    assert 300.0 <= backoff_delay(20, 2.0, 600.0) <= 600.0
+
+
+def test_backoff_delay_survives_a_long_outage():
+    assert 300.0 <= backoff_delay(5000, 2.0, 600.0) <= 600.0
+
+
+def test_tracker_parks_scans_with_backoff(clock):
+    tracker = SectionTracker(10.0, 600.0)
+    assert 5.0 <= tracker.park("Movies", [("Movies", Path("Foo (2020)"), 1.0)], REFRESHING) <= 10.0
+    assert tracker.state("Movies") == REFRESHING
+    # Not due yet: a scan parked meanwhile joins the same check
+    assert tracker.park("Movies", [("Movies", Path("Foo (2020)"), 0.5)], REFRESHING) <= 10.0
+    assert tracker.take_due() == []
+    assert tracker.parked_count() == 1
+
+    clock.now += 10.0
+    assert tracker.take_due() == [("Movies", Path("Foo (2020)"), 0.5)]
+    assert tracker.next_retry() is None
+    # Still refreshing at the check: the next delay doubles
+    assert 10.0 <= tracker.park("Movies", [("Movies", Path("Foo (2020)"), 0.5)], REFRESHING) <= 20.0
+
+
+def test_tracker_settle_resets_the_backoff(clock):
+    tracker = SectionTracker(10.0, 600.0)
+    tracker.park("Movies", [("Movies", Path("Foo (2020)"), 1.0)], FAILING)
+    clock.now += 10.0
+    tracker.take_due()
+    tracker.settle("Movies")
+    assert tracker.state("Movies") == IDLE
+    assert tracker.park("Movies", [("Movies", Path("Foo (2020)"), 1.0)], FAILING) <= 10.0
+
+
+def test_tracker_wake_makes_a_section_due(clock):
+    tracker = SectionTracker(10.0, 600.0)
+    assert not tracker.wake("Movies")
+    tracker.park("Movies", [("Movies", Path("Foo (2020)"), 1.0)], REFRESHING)
+    tracker.park("TV Shows", [("TV Shows", Path("Bar"), 1.0)], REFRESHING)
+    assert tracker.wake("Movies")
+    assert tracker.take_due() == [("Movies", Path("Foo (2020)"), 1.0)]
+
+
+def test_tracker_collapses_parked_scans_past_its_cap(clock):
+    tracker = SectionTracker(10.0, 600.0, max_parked=10)
+    scans = [("Movies", Path("Action", f"Foo ({year})"), float(year)) for year in range(2000, 2011)]
+    tracker.park("Movies", scans, FAILING)
+    assert tracker.parked_count() <= 10
+    assert tracker.collapsed == 11
+    clock.now += 10.0
+    assert tracker.take_due() == [("Movies", Path("Action"), 2000.0)]
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(10.0, 600.0)
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
+    # A late failure of a request sent before it opened doesn't open it again
+    assert not breaker.record_failure()
+
+
+def test_breaker_half_open_probe_failure_doubles_the_delay(clock):
+    breaker = CircuitBreaker(10.0, 600.0)
+    for _ in range(CircuitBreaker.THRESHOLD):
+        breaker.record_failure()
+    assert 5.0 <= breaker.retry_at - clock.now <= 10.0
+    clock.now = breaker.retry_at
+    # Half-open: a probe goes through
+    assert breaker.allow()
+    assert breaker.record_failure()
+    assert not breaker.allow()
+    assert 10.0 <= breaker.retry_at - clock.now <= 20.0
+
+
+def test_breaker_half_open_probe_success_closes_it(clock):
+    breaker = CircuitBreaker(10.0, 600.0)
+    for _ in range(CircuitBreaker.THRESHOLD):
+        breaker.record_failure()
+    clock.now = breaker.retry_at
+    assert breaker.allow()
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow()
+    # Closed again, it takes THRESHOLD failures to open it, for the base delay
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert 5.0 <= breaker.retry_at - clock.now <= 10.0
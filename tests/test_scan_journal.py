@@ -0,0 +1,93 @@
+import json
+from pathlib import Path
+
+from modules.plex.scan_journal import ScanJournal
+
+
+def write_journal(path: Path, records: list) -> None:
+    path.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+
+def test_replay_without_journal(tmp_path):
+    assert ScanJournal(tmp_path / "journal.jsonl").replay() == []
+
+
+def test_replay_returns_the_outstanding_scans_in_order(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, [
+        ["+", "Movies", "Foo (2020)", 1],
+        ["+", "TV Shows", "Bar/Season 1", 2],
+        ["+", "Movies", "Baz (2022)", 3],
+        ["-", "Movies", "Foo (2020)", 3],
+        ["+", "Movies", "Foo (2020)", 4],
+    ])
+    assert ScanJournal(path).replay() == [
+        ("TV Shows", Path("Bar/Season 1")), ("Movies", Path("Baz (2022)")), ("Movies", Path("Foo (2020)"))
+    ]
+
+
+def test_done_scan_settles_the_scans_below_it(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, [
+        ["+", "Movies", "Action/Foo (2020)", 1],
+        ["+", "Movies", "Action/Bar (2021)/Extras", 2],
+        ["+", "Movies", "Action (1990)", 3],
+        ["+", "TV Shows", "Action/Baz", 4],
+        ["-", "Movies", "Action", 4],
+    ])
+    assert ScanJournal(path).replay() == [("Movies", Path("Action (1990)")), ("TV Shows", Path("Action/Baz"))]
+
+
+def test_done_section_root_settles_the_whole_section(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, [
+        ["+", "Movies", "Foo (2020)", 1],
+        ["+", "TV Shows", "Bar", 2],
+        ["-", "Movies", ".", 2],
+    ])
+    assert ScanJournal(path).replay() == [("TV Shows", Path("Bar"))]
+
+
+def test_done_scan_keeps_the_scans_queued_while_it_was_sent(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_journal(path, [
+        ["+", "Movies", "Action", 1],
+        ["+", "Movies", "Action/Foo (2020)", 2],
+        # Action was sent to Plex after record 1, when it no longer absorbed new scans
+        ["-", "Movies", "Action", 1],
+        ["+", "Movies", "Foo (2020)", 3],
+        ["-", "Movies", "Foo (2020)", 2],
+    ])
+    assert ScanJournal(path).replay() == [("Movies", Path("Action/Foo (2020)")), ("Movies", Path("Foo (2020)"))]
+
+
+def test_replay_skips_a_torn_line(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    path.write_text('["+", "Movies", "Foo (2020)", 1]\n["+", "Movies", "Ba')
+    assert ScanJournal(path).replay() == [("Movies", Path("Foo (2020)"))]
+
+
+def test_records_survive_a_restart(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = ScanJournal(path, flush_interval=60.0)
+    journal.replay()
+    journal.start()
+    journal.record_queued("Movies", Path("Action/Foo (2020)"))
+    journal.record_queued("Movies", Path("Action/Bar (2021)"))
+    checkpoint = journal.checkpoint()
+    journal.record_queued("Movies", Path("Drama/Baz (2022)"))
+    journal.record_queued("Movies", Path("Action/Qux (2023)"))
+    journal.record_done("Movies", Path("Action"), checkpoint)
+    journal.stop()
+
+    journal = ScanJournal(path)
+    assert journal.replay() == [("Movies", Path("Drama/Baz (2022)")), ("Movies", Path("Action/Qux (2023)"))]
+    # Started, the journal is compacted down to the outstanding scans, and numbers the next records after them
+    journal.start()
+    journal.record_queued("Movies", Path("Action"))
+    journal.stop()
+    assert path.read_text().splitlines() == [
+        json.dumps(["+", "Movies", "Drama/Baz (2022)", 3]),
+        json.dumps(["+", "Movies", "Action/Qux (2023)", 4]),
+        json.dumps(["+", "Movies", "Action", 5]),
+    ]
@@ -0,0 +1,105 @@
+from pathlib import Path
+from typing import Optional
+
+from modules.plex.scan_planner import ScanPlanner
+
+
+class FakeSection:
+    """
+    The LibrarySection attributes read by the planner, counting the totalSize requests.
+    """
+
+    def __init__(self, total_size: Optional[int] = None, title: str = "Movies"):
+        self.key = 1
+        self.title = title
+        self.__total_size = total_size
+        self.count_requests = 0
+
+    @property
+    def totalSize(self) -> int:
+        self.count_requests += 1
+        if self.__total_size is None:
+            raise ConnectionError("Plex is unreachable")
+        return self.__total_size
+
+
+def scans(*subpaths: str, first_seen: float = 1.0) -> list:
+    return [("Movies", Path(subpath), first_seen) for subpath in subpaths]
+
+
+def folders(planned: list) -> list[str]:
+    return sorted(subpath.as_posix() for _, subpath, _ in planned)
+
+
+def test_small_batch_is_kept():
+    planner = ScanPlanner("plex", escalate_count=10, escalate_ratio=0.5, merge_siblings=3)
+    batch = scans("Foo (2020)", "Bar (2021)/Extras")
+    assert planner.plan(FakeSection(total_size=100), batch) == batch
+
+
+def test_escalates_at_the_folder_count():
+    planner = ScanPlanner("plex", escalate_count=3, escalate_ratio=0, merge_siblings=0)
+    batch = scans("A/1", "B/2") + [("Movies", Path("C/3"), 0.5)]
+    assert planner.plan(FakeSection(), batch) == [("Movies", Path("."), 0.5)]
+
+
+def test_escalates_at_the_ratio_of_top_level_items():
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0.5, merge_siblings=0)
+    batch = scans("Foo (2020)", "Bar (2021)/Extras")
+    assert folders(planner.plan(FakeSection(total_size=4), batch)) == ["."]
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0.5, merge_siblings=0)
+    assert planner.plan(FakeSection(total_size=5), batch) == batch
+
+
+def test_ratio_needs_two_top_level_folders():
+    section = FakeSection(total_size=1)
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0.5, merge_siblings=0)
+    batch = scans("Foo (2020)/Extras", "Foo (2020)/Subs")
+    assert planner.plan(section, batch) == batch
+    assert section.count_requests == 0
+
+
+def test_item_count_is_cached():
+    section = FakeSection(total_size=100)
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0.5, merge_siblings=0)
+    for _ in range(3):
+        planner.plan(section, scans("Foo (2020)", "Bar (2021)"))
+    assert section.count_requests == 1
+
+
+def test_failed_item_count_does_not_escalate():
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0.5, merge_siblings=0)
+    batch = scans("Foo (2020)", "Bar (2021)")
+    assert planner.plan(FakeSection(total_size=None), batch) == batch
+
+
+def test_section_root_covers_the_batch():
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0, merge_siblings=0)
+    batch = scans("Foo (2020)") + [("Movies", Path("."), 0.5)]
+    assert planner.plan(FakeSection(), batch) == [("Movies", Path("."), 0.5)]
+
+
+def test_merges_siblings_into_their_parent():
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0, merge_siblings=3)
+    batch = scans("Show/Season 1", "Show/Season 2", "Other/Season 1") + [("Movies", Path("Show/Season 3"), 0.5)]
+    planned = planner.plan(FakeSection(), batch)
+    assert folders(planned) == ["Other/Season 1", "Show"]
+    assert ("Movies", Path("Show"), 0.5) in planned
+
+
+def test_merges_level_by_level():
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0, merge_siblings=2)
+    batch = scans("Show/Season 1/Extras", "Show/Season 1/Subs", "Show/Season 2", "Other (2020)")
+    assert folders(planner.plan(FakeSection(), batch)) == ["Other (2020)", "Show"]
+
+
+def test_drops_folders_below_a_merged_parent():
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0, merge_siblings=2)
+    batch = scans("Show/Season 1", "Show/Season 2", "Show/Season 2/Extras/Deleted")
+    assert folders(planner.plan(FakeSection(), batch)) == ["Show"]
+
+
+def test_never_merges_into_the_section_root():
+    planner = ScanPlanner("plex", escalate_count=0, escalate_ratio=0, merge_siblings=2)
+    batch = scans("Foo (2020)", "Bar (2021)", "Baz (2022)", "Qux (2023)")
+    assert planner.plan(FakeSection(), batch) == batch
@@ -0,0 +1,131 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from modules.plex.scan_queue import QueuedScan, ScanQueue
+
+
+def folders(scans: list[QueuedScan]) -> list[tuple[str, Path]]:
+    return [(section_title, subpath) for section_title, subpath, _ in scans]
+
+
+def queued(queue: ScanQueue) -> list[tuple[str, Path]]:
+    return folders(queue.drain())
+
+
+def test_put_deduplicates_a_pending_scan():
+    queue = ScanQueue()
+    assert queue.put("Movies", Path("Foo (2020)")) == ("Movies", ("Foo (2020)",))
+    assert queue.put("Movies", Path("Foo (2020)")) is None
+    assert queue.put("TV Shows", Path("Foo (2020)")) == ("TV Shows", ("Foo (2020)",))
+    assert len(queue) == 2
+
+
+def test_put_ignores_dot_parts():
+    queue = ScanQueue()
+    assert queue.put("Movies", Path(".")) == ("Movies", ())
+    assert queue.put("Movies", Path("Foo (2020)")) is None
+    assert queued(queue) == [("Movies", Path("."))]
+
+
+def test_ancestor_absorbs_new_descendants():
+    queue = ScanQueue()
+    queue.put("Movies", Path("Action"))
+    assert queue.put("Movies", Path("Action/Foo (2020)")) is None
+    assert queue.put("Movies", Path("Action (1990)")) == ("Movies", ("Action (1990)",))
+    assert queued(queue) == [("Movies", Path("Action")), ("Movies", Path("Action (1990)"))]
+
+
+def test_ancestor_replaces_queued_descendants():
+    queue = ScanQueue()
+    queue.put("Movies", Path("Action/Foo (2020)"))
+    queue.put("Movies", Path("Action/Bar (2021)/Extras"))
+    queue.put("Movies", Path("Drama/Baz (2022)"))
+    queue.put("TV Shows", Path("Action/Qux"))
+    assert queue.put("Movies", Path("Action")) == ("Movies", ("Action",))
+    assert queued(queue) == [
+        ("Movies", Path("Drama/Baz (2022)")), ("TV Shows", Path("Action/Qux")), ("Movies", Path("Action"))
+    ]
+
+
+def test_pop_due_hands_out_due_scans_once():
+    queue = ScanQueue()
+    queue.put("Movies", Path("Foo (2020)"))
+    queue.put("Movies", Path("Bar (2021)"))
+    now = time.monotonic()
+    assert folders(queue.pop_due(now)) == [("Movies", Path("Foo (2020)")), ("Movies", Path("Bar (2021)"))]
+    # Handed out, they no longer absorb new scans below them
+    assert queue.put("Movies", Path("Foo (2020)/Extras")) == ("Movies", ("Foo (2020)", "Extras"))
+    assert folders(queue.pop_due(time.monotonic())) == [("Movies", Path("Foo (2020)/Extras"))]
+    assert queue.pop_due(time.monotonic()) == []
+    assert queue.next_due_time() is None
+
+
+def test_pop_due_waits_for_the_quiet_period():
+    queue = ScanQueue(quiet_period=5.0, max_delay=60.0)
+    queue.put("Movies", Path("Foo (2020)"))
+    now = time.monotonic()
+    assert queue.pop_due(now) == []
+    assert queue.next_due_time() == pytest.approx(now + 5.0, abs=0.5)
+    assert folders(queue.pop_due(now + 5.0)) == [("Movies", Path("Foo (2020)"))]
+    assert len(queue) == 0
+
+
+def test_pop_due_hands_out_a_busy_scan_after_the_max_delay():
+    queue = ScanQueue(quiet_period=5.0, max_delay=8.0)
+    queue.put("Movies", Path("Foo (2020)"), first_seen=time.monotonic() - 10.0)
+    assert queue.put("Movies", Path("Foo (2020)/Extras")) is None
+    assert folders(queue.pop_due(time.monotonic())) == [("Movies", Path("Foo (2020)"))]
+
+
+def test_pop_due_batches_the_scans_falling_due_together():
+    queue = ScanQueue(quiet_period=5.0, max_delay=60.0)
+    queue.put("Movies", Path("Foo (2020)"))
+    queue.put("Movies", Path("Bar (2021)"), retry_after=5.0 + ScanQueue.BATCH_WINDOW / 2)
+    queue.put("Movies", Path("Baz (2022)"), retry_after=5.0 + ScanQueue.BATCH_WINDOW * 2)
+    due = folders(queue.pop_due(time.monotonic() + 5.0))
+    assert due == [("Movies", Path("Foo (2020)")), ("Movies", Path("Bar (2021)"))]
+
+
+def test_ancestor_keeps_the_first_event_time_of_its_descendants():
+    queue = ScanQueue()
+    queue.put("Movies", Path("Action/Foo (2020)"), first_seen=10.0)
+    queue.put("Movies", Path("Action"))
+    assert queue.drain() == [("Movies", Path("Action"), 10.0)]
+
+
+def test_retry_after_holds_a_scan_back():
+    queue = ScanQueue()
+    queue.put("Movies", Path("Foo (2020)"), retry_after=60.0)
+    now = time.monotonic()
+    assert queue.pop_due(now) == []
+    assert folders(queue.pop_due(now + 60.0)) == [("Movies", Path("Foo (2020)"))]
+
+
+def test_full_queue_collapses_siblings_into_their_parent():
+    queue = ScanQueue(max_entries=3)
+    for name in ("Foo (2020)", "Bar (2021)", "Baz (2022)"):
+        queue.put("Movies", Path("Action", name))
+    assert queue.put("Movies", Path("Action/Qux (2023)")) == ("Movies", ("Action",))
+    assert len(queue) == 1
+    assert queue.collapsed == 4
+    # Later scans below the collapsed folder are absorbed by it
+    assert queue.put("Movies", Path("Action/Quux (2024)")) is None
+    assert queued(queue) == [("Movies", Path("Action"))]
+
+
+def test_full_queue_collapses_up_to_the_section_root():
+    queue = ScanQueue(max_entries=2)
+    queue.put("Movies", Path("Action/Foo (2020)"))
+    queue.put("Movies", Path("Drama/Bar (2021)"))
+    assert queue.put("Movies", Path("Comedy/Baz (2022)")) == ("Movies", ())
+    assert queued(queue) == [("Movies", Path())]
+
+
+def test_full_queue_keeps_a_lone_scan():
+    queue = ScanQueue(max_entries=1)
+    queue.put("Movies", Path("Foo (2020)"))
+    assert queue.put("TV Shows", Path("Bar")) == ("TV Shows", ("Bar",))
+    assert len(queue) == 2
+    assert queue.collapsed == 0